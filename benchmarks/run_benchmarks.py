@@ -0,0 +1,275 @@
+# Benchmarks of the screening steps on synthetic cohorts shaped like Table S6.
+#
+#   python benchmarks/run_benchmarks.py                          # the 'small' size, 1,000 samples
+#   python benchmarks/run_benchmarks.py --size medium large      # several preset sizes
+#   python benchmarks/run_benchmarks.py --samples 20000 --biomarkers 500 --categories 12
+#   python benchmarks/run_benchmarks.py --only rf_normal_cancers pca --repeat 5
+#
+# Every run is appended to benchmarks/history.jsonl. A benchmark is flagged as a regression when
+# its median wall time exceeds the median of the previous runs with the same configuration on the
+# same machine by more than the tolerance; with --fail-on-regression, the exit status is then 1.
+# The timings are taken with the spans of src/instrumentation.py, so --trace also saves the
+# breakdown of every benchmark (random forest phases, test batches, ...) as a Chrome trace.
+
+# Library imports
+import argparse
+import datetime
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import warnings
+from contextlib import redirect_stdout
+import numpy as np
+import pandas as pd
+# Add the paths to the src folder and to the benchmarks
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+#  Project imports
+from data_preprocessing import load_data, feature_label_split
+from random_forest_model import rf_normal_cancers
+from stats_tests import find_shared_nature_of_biomarkers
+from desc_stats import cancer_biomarkers_uniquely_high, cancer_biomarkers_higher_side_filtering
+from pca_analysis import cancer_dataframe_PCA
+from flat_forest import flatten_forest, forest_proba
+from instrumentation import span, enable_tracing, reset_trace, trace_events, extend_trace, export_chrome_trace
+from synthetic_cohort import synthetic_cohort, save_cohort
+
+history_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), "history.jsonl")
+
+# The preset sizes: (samples, biomarkers, categories)
+sizes = {'small': (1000, 39, 9),
+         'table_s6': (1817, 39, 9),
+         'medium': (10000, 200, 15),
+         'large': (100000, 1000, 30),
+         'xlarge': (1000000, 5000, 50)}
+
+# Excel sheets are limited to 1,048,576 rows, header included
+max_excel_rows = 1048575
+
+# The cancer type screened by the benchmarks (Pancreas)
+cancer_category_index = 7
+
+
+def bench_load_data(cohort, config):
+    return load_data(cohort['file_path'])
+
+def bench_rf_normal_cancers(cohort, config):
+    return rf_normal_cancers(cohort['categories'], cohort['dfs'], cancer_category_index,
+                             selected_biomarkers = np.arange(config['biomarkers']),
+                             iterations = config['rf_iterations'], debug = False, n_jobs = config['n_jobs'])
+
+def bench_find_shared_nature_of_biomarkers(cohort, config):
+    return find_shared_nature_of_biomarkers(cohort['categories'], cohort['dfs'], cancer_category_index, cohort['candidates'])
+
+def bench_uniquely_high(cohort, config):
+    return cancer_biomarkers_uniquely_high(cohort['categories'], cohort['dfs'], cohort['candidates'])
+
+def bench_higher_side_filtering(cohort, config):
+    return cancer_biomarkers_higher_side_filtering(cohort['categories'], cohort['dfs'], cancer_category_index, cohort['candidates'])
+
+def bench_pca(cohort, config):
+    features = pd.concat([feature_label_split(df)[0] for df in cohort['dfs']], ignore_index = True).dropna()
+    return cancer_dataframe_PCA(features, svd_solver = config['pca_solver'])
+
+def bench_forest_proba(cohort, config):
+    # Scoring in batches of 100 samples, as in the ROC iterations and the scoring service
+    model, forest, X = cohort['forest']
+    return [forest_proba(model, X[start:start + 100], forest) for start in range(0, len(X), 100)]
+
+benchmarks = {'load_data': bench_load_data,
+              'rf_normal_cancers': bench_rf_normal_cancers,
+              'find_shared_nature_of_biomarkers': bench_find_shared_nature_of_biomarkers,
+              'cancer_biomarkers_uniquely_high': bench_uniquely_high,
+              'cancer_biomarkers_higher_side_filtering': bench_higher_side_filtering,
+              'pca': bench_pca,
+              'forest_proba': bench_forest_proba}
+
+
+def prepare_cohort(config, names, work_dir):
+    """
+    Generate the synthetic cohort of the configuration, and save it as a workbook if load_data
+    is benchmarked and the cohort fits in Excel sheets.
+    """
+    categories, dfs = synthetic_cohort(config['samples'], config['biomarkers'], config['categories'], seed = config['seed'])
+    cohort = {'categories': categories,
+              'dfs': dfs,
+              'candidates': list(range(min(config['candidates'], config['biomarkers']))),
+              'file_path': None}
+    if 'forest_proba' in names:
+        # A forest of Normal versus the screened cancer type, scoring the samples of all the categories
+        from sklearn.ensemble import RandomForestClassifier
+        normal_levels = feature_label_split(dfs[categories.index('Normal')])[0].to_numpy()
+        cancer_levels = feature_label_split(dfs[cancer_category_index])[0].to_numpy()
+        model = RandomForestClassifier(random_state = 0, n_jobs = config['n_jobs']).fit(np.vstack([normal_levels, cancer_levels]),
+                                                                                        np.r_[np.zeros(len(normal_levels)), np.ones(len(cancer_levels))])
+        X = np.vstack([feature_label_split(df)[0].to_numpy() for df in dfs])[:10000]
+        cohort['forest'] = (model, flatten_forest(model), X)
+    if 'load_data' in names and sum(len(df) for df in dfs) <= max_excel_rows:
+        cohort['file_path'] = save_cohort(categories, dfs, os.path.join(work_dir, f"cohort_{config['size']}.xlsx"))
+    return cohort
+
+
+def time_benchmark(name, cohort, config, repeat = 3):
+    """
+    Run a benchmark `repeat` times, and return the median and the minimum wall time, the median
+    CPU time and the peak RSS, together with the recorded spans.
+    """
+    events = []
+    for run in range(repeat):
+        reset_trace()
+        # The functions print their intermediate results
+        with redirect_stdout(io.StringIO()):
+            with span(f"benchmark.{name}", 'benchmark', size=config['size'], run=run):
+                benchmarks[name](cohort, config)
+        events += trace_events()
+    runs = [event for event in events if event['name'] == f"benchmark.{name}"]
+    walls = [event['dur'] / 1e6 for event in runs]
+    return {'wall_s': float(np.median(walls)),
+            'min_wall_s': float(np.min(walls)),
+            'cpu_s': float(np.median([event['args']['cpu_ms'] / 1e3 for event in runs])),
+            'peak_rss_mb': runs[-1]['args']['peak_rss_mb']}, events
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output = True, text = True, check = True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def config_key(config):
+    # The settings that make two runs comparable
+    return {key: config[key] for key in ['samples', 'biomarkers', 'categories', 'seed', 'rf_iterations', 'candidates', 'pca_solver', 'n_jobs']}
+
+
+def load_history(file_path = history_file):
+    if not os.path.exists(file_path):
+        return []
+    with open(file_path) as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+
+def append_history(records, file_path = history_file):
+    with open(file_path, 'a') as file:
+        for record in records:
+            file.write(json.dumps(record) + "\n")
+
+
+def regression_status(record, history, baseline_runs = 5, tolerance = 0.2, min_difference_s = 0.05):
+    """
+    Compare a benchmark record with the previous runs of the same benchmark and configuration on
+    the same machine.
+
+    Returns
+    -------
+    tuple
+        The status ('new', 'ok', 'faster' or 'REGRESSION') and the baseline wall time (the median
+        of the last `baseline_runs` comparable runs, None for a new benchmark).
+    """
+    previous = [entry['wall_s'] for entry in history
+                if entry['benchmark'] == record['benchmark'] and entry['host'] == record['host'] and entry['config'] == record['config']]
+    if not previous:
+        return 'new', None
+    baseline = float(np.median(previous[-baseline_runs:]))
+    if record['wall_s'] > baseline * (1 + tolerance) and record['wall_s'] - baseline > min_difference_s:
+        return 'REGRESSION', baseline
+    if record['wall_s'] < baseline * (1 - tolerance) and baseline - record['wall_s'] > min_difference_s:
+        return 'faster', baseline
+    return 'ok', baseline
+
+
+def run_benchmarks(configs, names, repeat = 3, history_file_path = history_file, baseline_runs = 5, tolerance = 0.2, trace_file = None):
+    """
+    Run the benchmarks on every configuration, append the results to the history and flag the
+    regressions.
+
+    Returns
+    -------
+    pd.DataFrame
+        One row per benchmark and configuration, with the timings, the baseline and the status.
+    """
+    enable_tracing()
+    history = load_history(history_file_path)
+    timestamp = datetime.datetime.now().isoformat(timespec='seconds')
+    commit = git_commit()
+    records, all_events = [], []
+    with tempfile.TemporaryDirectory() as work_dir:
+        for config in configs:
+            print(f"\n[benchmark] {config['size']}: {config['samples']} samples, {config['biomarkers']} biomarkers, {config['categories']} categories")
+            cohort = prepare_cohort(config, names, work_dir)
+            for name in names:
+                if name == 'load_data' and cohort['file_path'] is None:
+                    print(f"[benchmark] skipped   {name}: more than {max_excel_rows} rows do not fit in an Excel sheet")
+                    continue
+                timings, events = time_benchmark(name, cohort, config, repeat)
+                all_events += events
+                record = {'timestamp': timestamp,
+                          'commit': commit,
+                          'host': platform.node(),
+                          'python': platform.python_version(),
+                          'size': config['size'],
+                          'config': config_key(config),
+                          'benchmark': name,
+                          'repeat': repeat,
+                          **timings}
+                record['status'], record['baseline_wall_s'] = regression_status(record, history, baseline_runs, tolerance)
+                print(f"[benchmark] {record['status']:<10} {name}: {record['wall_s']:.3f} s"
+                      + ("" if record['baseline_wall_s'] is None else f" (baseline {record['baseline_wall_s']:.3f} s)"))
+                records.append(record)
+    append_history(records, history_file_path)
+    if trace_file:
+        reset_trace()
+        extend_trace(all_events)
+        print(f"Trace saved to {export_chrome_trace(trace_file)}")
+    return pd.DataFrame(records, columns = ['size', 'benchmark', 'wall_s', 'min_wall_s', 'cpu_s', 'peak_rss_mb', 'baseline_wall_s', 'status'])
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog = "run_benchmarks.py", description = "Benchmarks of the screening steps on synthetic cohorts shaped like Table S6.")
+    parser.add_argument('--size', nargs = '+', choices = list(sizes), default = ['small'],
+                        help = "preset sizes, as (samples, biomarkers, categories): " + ", ".join(f"{name} {size}" for name, size in sizes.items()) + " (default: small)")
+    parser.add_argument('--samples', type = int, help = "custom number of samples (replaces --size)")
+    parser.add_argument('--biomarkers', type = int, default = 39, help = "custom number of biomarkers (default: %(default)s)")
+    parser.add_argument('--categories', type = int, default = 9, help = "custom number of categories, at least 9 (default: %(default)s)")
+    parser.add_argument('--seed', type = int, default = 0, help = "the seed of the synthetic cohort (default: %(default)s)")
+    parser.add_argument('--only', nargs = '+', choices = list(benchmarks), default = list(benchmarks), metavar = 'BENCHMARK',
+                        help = f"the benchmarks to run, among {list(benchmarks)} (default: all)")
+    parser.add_argument('--repeat', type = int, default = 3, help = "the number of runs of every benchmark (default: %(default)s)")
+    parser.add_argument('--rf-iterations', type = int, default = 5, help = "the number of random forest iterations (default: %(default)s)")
+    parser.add_argument('--candidates', type = int, default = 39, help = "the number of biomarkers screened by the tests and the filters (default: %(default)s)")
+    parser.add_argument('--pca-solver', default = 'auto', help = "the svd_solver of cancer_dataframe_PCA, e.g. 'incremental' (default: %(default)s)")
+    parser.add_argument('--n-jobs', type = int, help = "the random forest threads (default: 1)")
+    parser.add_argument('--history', default = history_file, help = "the history file (default: benchmarks/history.jsonl)")
+    parser.add_argument('--baseline-runs', type = int, default = 5, help = "the number of previous runs forming the baseline (default: %(default)s)")
+    parser.add_argument('--tolerance', type = float, default = 0.2, help = "the relative slowdown flagged as a regression (default: %(default)s)")
+    parser.add_argument('--fail-on-regression', action = 'store_true', help = "exit with status 1 if a regression is flagged")
+    parser.add_argument('--trace', metavar = 'FILE', help = "save the spans of all the benchmarks as a Chrome trace to FILE")
+    return parser
+
+
+def main(argv = None):
+    args = build_parser().parse_args(argv)
+    warnings.filterwarnings("ignore", category=UserWarning)
+    size_names = ['custom'] if args.samples else args.size
+    configs = [{'size': size_name,
+                **dict(zip(['samples', 'biomarkers', 'categories'], (args.samples, args.biomarkers, args.categories) if args.samples else sizes[size_name])),
+                'seed': args.seed,
+                'rf_iterations': args.rf_iterations,
+                'candidates': args.candidates,
+                'pca_solver': args.pca_solver,
+                'n_jobs': args.n_jobs}
+               for size_name in size_names]
+    results_df = run_benchmarks(configs, args.only, args.repeat, args.history, args.baseline_runs, args.tolerance, args.trace)
+    print("\nBenchmark summary:")
+    print(results_df.to_string(index = False, float_format = lambda x: f"{x:.3f}"))
+    if args.fail_on_regression and (results_df['status'] == 'REGRESSION').any():
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,220 @@
+# Synthetic cohorts shaped like Table S6, at sizes beyond the 1,817 samples, 39 biomarkers and
+# 9 categories of Cohen et al. (2018), for the benchmarks (see run_benchmarks.py).
+#
+# The profile of Table S6 is fitted once per category and biomarker, on the log levels:
+# - the fraction of samples at the detection floor (the lowest reported level of the biomarker),
+# - the mean, standard deviation and skewness of the levels above the floor, without the outliers,
+# - the fraction of outliers (above Q3 + 1.5 IQR) and their median distance from the mean,
+# - the fraction of missing levels.
+# The fitted profile is saved in table_s6_profile.json, so that cohorts can be generated without
+# the extracted clinical data.
+
+# Library imports
+import json
+import os
+import sys
+import numpy as np
+import pandas as pd
+from scipy.stats import skewnorm
+# Add the path to the src folder
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+#  Project imports
+from data_preprocessing import load_data, feature_label_split
+
+profile_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), "table_s6_profile.json")
+
+# The skewness of a skew-normal distribution is bounded by about 0.995 in absolute value
+max_skewness = 0.99
+
+
+def fit_cohort_profile(categories, dfs):
+    """
+    Fit the per-category, per-biomarker distribution of the log levels.
+
+    Parameters
+    ----------
+    categories : list
+        The names of the categories.
+    dfs : list
+        The dataframes of the categories, as returned by `load_data`.
+
+    Returns
+    -------
+    dict
+        The profile: the categories, the biomarkers, the fraction of samples and the AJCC stage
+        frequencies of every category, the detection floor of every biomarker, and
+        (category x biomarker) lists of the fitted parameters.
+    """
+    features = [feature_label_split(df)[0].astype(float) for df in dfs]
+    biomarkers = list(features[0].columns)
+    floor = pd.concat(features).min()
+
+    parameters = {key: np.zeros((len(categories), len(biomarkers)))
+                  for key in ['floor_fraction', 'log_mean', 'log_std', 'log_skewness', 'outlier_fraction', 'outlier_shift', 'missing_fraction']}
+    for c, category_features in enumerate(features):
+        for b, biomarker in enumerate(biomarkers):
+            levels = category_features[biomarker]
+            parameters['missing_fraction'][c, b] = levels.isna().mean()
+            levels = levels.dropna().to_numpy()
+            at_floor = levels <= floor[biomarker] * (1 + 1e-6)
+            parameters['floor_fraction'][c, b] = at_floor.mean()
+            log_levels = np.log(levels[~at_floor])
+            if len(log_levels) < 3:
+                log_levels = np.log(np.full(3, floor[biomarker]))
+            q1, q3 = np.percentile(log_levels, [25, 75])
+            outliers = log_levels > q3 + 1.5 * (q3 - q1)
+            inliers = log_levels[~outliers] if (~outliers).sum() >= 3 else log_levels
+            parameters['log_mean'][c, b] = inliers.mean()
+            parameters['log_std'][c, b] = inliers.std()
+            parameters['log_skewness'][c, b] = pd.Series(inliers).skew() if inliers.std() > 0 else 0.0
+            parameters['outlier_fraction'][c, b] = outliers.mean()
+            parameters['outlier_shift'][c, b] = np.median(log_levels[outliers]) - inliers.mean() if outliers.any() else 0.0
+
+    stage_fractions = [df.iloc[:, 3].value_counts(normalize=True).to_dict() for df in dfs]
+    sizes = np.array([len(df) for df in dfs])
+    return {'categories': list(categories),
+            'biomarkers': biomarkers,
+            'sample_fractions': (sizes / sizes.sum()).tolist(),
+            'stage_fractions': stage_fractions,
+            'floor': floor.tolist(),
+            **{key: np.nan_to_num(values).tolist() for key, values in parameters.items()}}
+
+
+def save_cohort_profile(profile, file_path = profile_file):
+    with open(file_path, 'w') as file:
+        json.dump(profile, file, indent=1)
+    return file_path
+
+
+def load_cohort_profile(file_path = profile_file, data_file_path = "data/clinical_cancer_data.xlsx"):
+    """
+    Load the saved profile of Table S6, or fit it to the clinical data if it was never saved.
+    """
+    if not os.path.exists(file_path):
+        save_cohort_profile(fit_cohort_profile(*load_data(data_file_path)), file_path)
+    with open(file_path) as file:
+        return json.load(file)
+
+
+def skewnorm_parameters(mean, std, skewness):
+    """
+    The shape, location and scale of the skew-normal distributions with the given moments
+    (method of moments, with the skewness clipped to the attainable range).
+    """
+    skewness = np.clip(skewness, -max_skewness, max_skewness)
+    power = np.abs(skewness) ** (2 / 3)
+    delta = np.sign(skewness) * np.sqrt(np.pi / 2 * power / (power + ((4 - np.pi) / 2) ** (2 / 3)))
+    shape = delta / np.sqrt(1 - delta**2)
+    scale = std / np.sqrt(1 - 2 * delta**2 / np.pi)
+    location = mean - scale * delta * np.sqrt(2 / np.pi)
+    return shape, location, scale
+
+
+def _template_indices(n, n_template, keep = ()):
+    # The first indices map to themselves, the following ones cycle through the template,
+    # skipping the indices in `keep` (e.g., Normal, which stays unique)
+    cycle = [i for i in range(n_template) if i not in keep]
+    return np.array([i if i < n_template else cycle[(i - n_template) % len(cycle)] for i in range(n)])
+
+
+def synthetic_cohort(n_samples = 1817, n_biomarkers = 39, n_categories = 9, profile = None, seed = 0, min_category_size = 20):
+    """
+    Generate a synthetic cohort with the per-category distributions of Table S6.
+
+    The biomarkers beyond those of the profile reuse the parameters of a profile biomarker
+    (cyclically), with their log levels shifted by a random amount common to all categories.
+    The categories beyond those of the profile reuse the parameters of a profile cancer type,
+    with their log means perturbed per biomarker. "Normal" stays at index 5, as expected by
+    `rf_normal_cancers`.
+
+    Parameters
+    ----------
+    n_samples : int, optional
+        The total number of samples (default is 1817, as in Table S6).
+    n_biomarkers : int, optional
+        The number of biomarkers (default is 39).
+    n_categories : int, optional
+        The number of categories, at least the 9 of the profile (default is 9).
+    profile : dict, optional
+        The profile, as returned by `fit_cohort_profile` (default is the saved profile of Table S6).
+    seed : int, optional
+        The seed of the random generator (default is 0).
+    min_category_size : int, optional
+        The minimum number of samples of a category (default is 20).
+
+    Returns
+    -------
+    tuple
+        The names of the categories and their dataframes, in the format of `load_data`.
+    """
+    profile = load_cohort_profile() if profile is None else profile
+    n_template_categories = len(profile['categories'])
+    n_template_biomarkers = len(profile['biomarkers'])
+    if n_categories < n_template_categories:
+        raise ValueError(f"At least {n_template_categories} categories are needed, got {n_categories}.")
+    rng = np.random.default_rng(seed)
+
+    normal_index = profile['categories'].index('Normal')
+    category_templates = _template_indices(n_categories, n_template_categories, keep = (normal_index,))
+    biomarker_templates = _template_indices(n_biomarkers, n_template_biomarkers)
+    categories = [profile['categories'][t] if c < n_template_categories else f"{profile['categories'][t]} {c}"
+                  for c, t in enumerate(category_templates)]
+    biomarkers = [profile['biomarkers'][t] if b < n_template_biomarkers else f"{profile['biomarkers'][t]} {b}"
+                  for b, t in enumerate(biomarker_templates)]
+
+    # The parameters of every (category, biomarker)
+    parameters = {key: np.asarray(profile[key])[np.ix_(category_templates, biomarker_templates)]
+                  for key in ['floor_fraction', 'log_mean', 'log_std', 'log_skewness', 'outlier_fraction', 'outlier_shift', 'missing_fraction']}
+    biomarker_shift = np.where(np.arange(n_biomarkers) < n_template_biomarkers, 0, rng.normal(0, 1, n_biomarkers))
+    category_shift = np.where((np.arange(n_categories) < n_template_categories)[:, None], 0, rng.normal(0, 0.3, (n_categories, n_biomarkers)))
+    parameters['log_mean'] = parameters['log_mean'] + biomarker_shift + category_shift
+    floor = np.asarray(profile['floor'])[biomarker_templates] * np.exp(biomarker_shift)
+    shape, location, scale = skewnorm_parameters(parameters['log_mean'], parameters['log_std'], parameters['log_skewness'])
+
+    # The number of samples of every category, in the proportions of the profile
+    fractions = np.asarray(profile['sample_fractions'])[category_templates]
+    sizes = np.maximum(min_category_size, np.round(n_samples * fractions / fractions.sum()).astype(int))
+
+    dfs = []
+    sample_number = 0
+    for c, (category, size) in enumerate(zip(categories, sizes)):
+        # Skewed log levels, with outliers above the bulk
+        log_levels = skewnorm.rvs(shape[c], loc = location[c], scale = scale[c], size = (size, n_biomarkers), random_state = rng)
+        outliers = rng.random((size, n_biomarkers)) < parameters['outlier_fraction'][c]
+        log_levels = np.where(outliers, parameters['log_mean'][c] + parameters['outlier_shift'][c] + rng.exponential(0.5, (size, n_biomarkers)), log_levels)
+        levels = np.maximum(np.exp(log_levels), floor)
+        # Levels at the detection floor, and missing levels
+        levels = np.where(rng.random((size, n_biomarkers)) < parameters['floor_fraction'][c], floor, levels)
+        levels[rng.random((size, n_biomarkers)) < parameters['missing_fraction'][c]] = np.nan
+
+        stage_fractions = profile['stage_fractions'][category_templates[c]]
+        stages = (rng.choice(list(stage_fractions), size = size, p = np.array(list(stage_fractions.values())) / sum(stage_fractions.values()))
+                  if stage_fractions else np.full(size, None))
+        ids = [f"SYN {i:07d}" for i in range(sample_number, sample_number + size)]
+        sample_number += size
+        df = pd.DataFrame(levels, columns = biomarkers)
+        df.insert(0, 'AJCC Stage', stages)
+        df.insert(0, 'Tumor type', category)
+        df.insert(0, 'Sample ID #', ids)
+        df.insert(0, 'Patient ID #', ids)
+        dfs.append(df)
+    return categories, dfs
+
+
+def save_cohort(categories, dfs, file_path):
+    """
+    Save the cohort as an Excel workbook readable by `load_data`: all the samples in the first
+    sheet, then one sheet per category (see append_sheets_by_tumor_type.py).
+    """
+    with pd.ExcelWriter(file_path, engine="openpyxl") as writer:
+        pd.concat(dfs, ignore_index = True).to_excel(writer, sheet_name = "All", index = False)
+        for category, df in zip(categories, dfs):
+            df.to_excel(writer, sheet_name = category, index = False)
+    return file_path
+
+
+if __name__ == "__main__":
+    # Refit the profile to the clinical data (see main.py extract and split)
+    data_file_path = sys.argv[1] if len(sys.argv) > 1 else "data/clinical_cancer_data.xlsx"
+    print(f"Profile saved to {save_cohort_profile(fit_cohort_profile(*load_data(data_file_path)))}")
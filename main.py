@@ -1,5 +1,553 @@
-def main():
-    print("Hello from cancer-biomarkers-from-clinical-data!")
+# Command-line interface of the biomarker screening.
+#
+#   python main.py extract                      # Table S6 -> data/prelim_clinical_cancer_data.xlsx
+#   python main.py split                        # -> data/clinical_cancer_data.xlsx, one sheet per tumor type
+#   python main.py convert --output data/clinical_cancer_data.csv   # read without decoding the workbook
+#   python main.py screen --cancers Pancreas    # screen only the given cancer types
+#   python main.py figures --profile preview    # the publication figures
+#   python main.py report --biomarkers CA-125   # descriptive statistics report
+#   python main.py resample --queue DIR         # random forest iterations on the workers of a queue
+#   python main.py worker --queue DIR           # a worker of the queue, on any host mounting DIR
+#   python main.py results --cancer Ovary       # importances across the runs recorded with --results-db
+#   python main.py train-panels                 # fit and save the models of the finalized panels
+#   python main.py score --input samples.csv    # score new samples with the panel models
+#   python main.py serve --port 8050            # score new samples over HTTP, in micro-batches
+#   python main.py sketch --input shard*.csv    # streaming statistics of a cohort too large for memory
+#   python main.py update --input new.csv       # add new samples, recomputing only what they can change
+#   python main.py covariates --features S4:Age --stratify S4:Sex   # covariates of Tables S4-S8
+#   python main.py stages --cancers Pancreas --stages I   # screening by AJCC stage, with a trend test
+#   python main.py stability --replicates 200   # selection frequencies of the biomarkers under resampling
+#
+# The screening stages are cached (see src/pipeline.py), so only what changed is recomputed.
+# The modeling and plotting modules are imported only by the commands that need them, and
+# --headless selects the non-interactive Agg backend before matplotlib is ever imported.
+
+# Library imports
+import argparse
+import os
+import sys
+import warnings
+import numpy as np
+# Add the path to the src folder
+sys.path.append('src')
+
+# Import project functions
+from extract_blood_test_table import extract_blood_test_table
+from append_sheets_by_tumor_type import append_sheets_by_tumor_type
+from data_preprocessing import load_data, feature_label_split
+from output_profiles import output_profiles, set_output_profile
+from pipeline import run_pipeline, override_params
+from scheduler import split_worker_budget
+from instrumentation import enable_tracing, export_chrome_trace, print_trace_summary
+
+# The cancer types and their category indices
+cancer_types = {'Breast': 0, 'Colorectum': 1, 'Esophagus': 2, 'Liver': 3, 'Lung': 4, 'Ovary': 6, 'Pancreas': 7, 'Stomach': 8}
+
+
+def resolve_biomarkers(biomarkers, biomarker_names):
+    """
+    The indices of the given biomarkers, each given by its name or its index, without duplicates.
+    """
+    biomarker_names = list(biomarker_names)
+    indices = []
+    for biomarker in biomarkers:
+        if biomarker.isdigit() and int(biomarker) < len(biomarker_names):
+            index = int(biomarker)
+        elif biomarker in biomarker_names:
+            index = biomarker_names.index(biomarker)
+        else:
+            raise ValueError(f"Unknown biomarker '{biomarker}'. Choose among {biomarker_names} or their indices.")
+        if index not in indices:
+            indices.append(index)
+    return indices
+
+
+def biomarker_indices(args):
+    """
+    The indices of the biomarkers given on the command line.
+    """
+    _, dfs = load_data(args.data)
+    try:
+        return resolve_biomarkers(args.biomarkers, feature_label_split(dfs[0])[0].columns)
+    except ValueError as error:
+        sys.exit(f"error: {error}")
+
+
+def screening_overrides(stages, biomarkers = None, iterations = None, rf_threshold = None, p_threshold = None):
+    """
+    The parameter overrides of the screening stages for the given command-line options.
+    """
+    from screening_stages import rf_screening
+    overrides = {}
+    for stage in stages:
+        params = {}
+        if iterations is not None and 'iterations' in stage['params']:
+            params['iterations'] = iterations
+        if stage['function'] is rf_screening:
+            if biomarkers is not None:
+                params['selected_biomarkers'] = biomarkers
+            if rf_threshold is not None:
+                params['threshold'] = rf_threshold
+        if p_threshold is not None and 'p_threshold' in stage['params']:
+            params['p_threshold'] = p_threshold
+        if params:
+            overrides[stage['name']] = params
+    return overrides
+
+
+def screening_pipeline(args):
+    """
+    The screening stages configured by the command-line options, and the number of stage workers.
+    """
+    from biomarker_screening import biomarker_screening_stages
+    biomarkers = biomarker_indices(args) if args.biomarkers else None
+    stage_workers, rf_jobs = split_worker_budget(args.workers, n_chains = len(args.cancers))
+    stages = biomarker_screening_stages(file_path = args.data, debug = not args.quiet, n_jobs = rf_jobs)
+    overrides = screening_overrides(stages, biomarkers, args.iterations, args.rf_threshold, args.p_threshold)
+    return override_params(stages, overrides), stage_workers
+
+
+def record_results(args, stages, artifacts):
+    """
+    Record the results of the run in the results database, if one is given.
+    """
+    if args.results_db:
+        from screening_stages import record_screening_results
+        print(f"Run {record_screening_results(args.results_db, stages, artifacts, label = args.label)} recorded in {args.results_db}")
+
+
+def extract(args):
+    extract_blood_test_table(args.source, engine = args.engine)
+
+
+def split(args):
+    append_sheets_by_tumor_type(args.input, engine = args.engine)
+
+
+def convert(args):
+    from table_reader import convert_table
+    try:
+        convert_table(args.input, args.output, sheet_name = args.sheet, engine = args.engine)
+    except (ValueError, ImportError) as error:
+        sys.exit(f"error: {error}")
+    print(f"{args.input} converted to {args.output}, to be given as --data")
+
+
+def screen(args):
+    stages, stage_workers = screening_pipeline(args)
+    stage_names = {stage['name'] for stage in stages}
+    targets = [f"yuen_welch_{cancer.lower()}" if f"yuen_welch_{cancer.lower()}" in stage_names else f"filter_{cancer.lower()}"
+               for cancer in args.cancers]
+    recorded = [f"rf_{cancer.lower()}" for cancer in args.cancers] + [f"filter_{cancer.lower()}" for cancer in args.cancers] + ['p_values', 'quantiles'] if args.results_db else []
+    artifacts = run_pipeline(stages, targets = ['data'] + targets + recorded, artifact_dir = args.artifact_dir, force = args.force, max_workers = stage_workers)
+    record_results(args, stages, artifacts)
+
+    biomarker_names = feature_label_split(artifacts['data'][1][0])[0].columns
+    print("\n\nSUMMARY OF FINDINGS:\n")
+    for cancer, target in zip(args.cancers, targets):
+        print(f"\nBiomarkers selected for {cancer.lower()}:\n")
+        if target.startswith('yuen_welch_'):
+            print([(biomarker_names[i], shared) for i, shared in artifacts[target]])
+        else:
+            print([biomarker_names[i] for i in artifacts[target]])
+
+
+def figures(args):
+    # Imported here, since the rendering pulls in the whole plotting stack
+    from figures import render_figures
+    set_output_profile(args.profile)
+    stages, stage_workers = screening_pipeline(args)
+    artifacts = run_pipeline(stages, targets = None if args.results_db else ['figure_specs'], artifact_dir = args.artifact_dir, force = args.force, max_workers = stage_workers)
+    record_results(args, stages, artifacts)
+    render_figures(artifacts['figure_specs'], batch = True, max_workers = args.max_workers, cache = not args.no_cache)
+
+
+def report(args):
+    from desc_stats import descriptive_statistics_report
+    set_output_profile(args.profile)
+    categories, dfs = load_data(args.data)
+    descriptive_statistics_report(categories, dfs, biomarker_indices = biomarker_indices(args) if args.biomarkers else None, file_path = args.output)
+    print(f"Descriptive statistics report saved to {args.output}")
+
+
+def resample(args):
+    from work_queue import rf_resampling_distributed
+    categories, dfs = load_data(args.data)
+    biomarkers = biomarker_indices(args) if args.biomarkers else None
+    biomarker_names = feature_label_split(dfs[0], biomarkers)[0].columns
+    comparisons = [tuple(cancer_types[cancer] for cancer in args.cancers)] if args.combined else [(cancer_types[cancer],) for cancer in args.cancers]
+    results = rf_resampling_distributed(categories, dfs, comparisons, iterations = args.iterations, selected_biomarkers = biomarkers,
+                                        queue_dir = args.queue, local_workers = args.local_workers, lease_seconds = args.lease)
+    for category_indices, comparison_results in results.items():
+        importance = np.mean([result['importance'] for result in comparison_results], axis=0)
+        accuracies = [result['accuracy'] for result in comparison_results]
+        important = sorted([(biomarker, score) for biomarker, score in zip(biomarker_names, importance) if score >= args.rf_threshold], key=lambda x: -x[1])
+        print(f"\nRandom forest classification: {' + '.join([categories[5]] + [categories[c] for c in category_indices])}")
+        print(f"Average Accuracy over {len(comparison_results)} iterations: {np.mean(accuracies):.4f} ± {np.std(accuracies):.4f}")
+        print(f"Biomarkers with Importance >= {args.rf_threshold}: {[(biomarker, round(float(score), 4)) for biomarker, score in important]}")
+
+
+def results(args):
+    from results_store import open_results_store, list_runs, importances_across_runs, p_values_across_runs
+    connection = open_results_store(args.db)
+    if args.cancer is None:
+        print(list_runs(connection).to_string(index = False))
+    else:
+        print(importances_across_runs(connection, args.cancer, args.biomarker).to_string(index = False))
+        if args.biomarker is not None:
+            print(p_values_across_runs(connection, args.cancer, args.biomarker).to_string(index = False))
+    connection.close()
+
+
+def train_panels(args):
+    from scoring_service import train_panel_models, save_panel_models
+    stages, stage_workers = screening_pipeline(args)
+    artifacts = run_pipeline(stages, targets = ['data', 'summary'], artifact_dir = args.artifact_dir, force = args.force, max_workers = stage_workers)
+    categories, dfs = artifacts['data']
+    panels = {cancer: biomarkers for cancer, biomarkers in artifacts['summary'].items() if cancer in args.cancers}
+    panel_models = train_panel_models(categories, dfs, panels, n_jobs = args.workers)
+    save_panel_models(panel_models, args.output)
+    for cancer, panel_model in panel_models['cancers'].items():
+        print(f"{cancer}: {panel_model['biomarkers']}")
+    print(f"Panel models saved to {args.output}")
+
+
+def score(args):
+    import pandas as pd
+    from scoring_service import load_panel_models, score_samples
+    from table_reader import read_table
+    panel_models = load_panel_models(args.models)
+    samples = read_table(args.input)
+    try:
+        scores = score_samples(panel_models, samples)
+    except ValueError as error:
+        sys.exit(f"error: {error}")
+    scores.insert(0, 'Predicted', np.where(scores.max(axis=1) >= args.threshold, scores.idxmax(axis=1), 'Normal'))
+    pd.concat([samples.iloc[:, :2] if args.keep_ids else samples.iloc[:, :0], scores], axis=1).to_csv(args.output, index = False)
+    print(f"{len(scores)} samples scored, saved to {args.output}")
+
+
+def serve(args):
+    import asyncio
+    from scoring_service import load_panel_models, serve_panel_models
+    panel_models = load_panel_models(args.models)
+    print(f"Scoring {list(panel_models['cancers'])} on http://{args.host}:{args.port}/score")
+    try:
+        asyncio.run(serve_panel_models(panel_models, args.host, args.port, max_batch_size = args.max_batch, max_delay_ms = args.max_delay_ms))
+    except KeyboardInterrupt:
+        pass
+
+
+def sketch(args):
+    from streaming_stats import streaming_statistics, merge_statistics, load_statistics, save_statistics, streaming_summary, statistics_categories
+    from desc_stats import cancer_biomarkers_uniquely_high
+    statistics = streaming_statistics(args.input, k = args.k, chunksize = args.chunksize) if args.input else None
+    for file_path in args.merge:
+        statistics = load_statistics(file_path) if statistics is None else merge_statistics(statistics, load_statistics(file_path))
+    if statistics is None:
+        sys.exit("error: give the cohort files (--input) or saved statistics (--merge)")
+    save_statistics(statistics, args.output)
+    print(f"Statistics of {len(statistics['categories'])} categories and {len(statistics['biomarkers'])} biomarkers saved to {args.output}")
+    try:
+        indices = resolve_biomarkers(args.biomarkers or [], statistics['biomarkers'])
+    except ValueError as error:
+        sys.exit(f"error: {error}")
+    for index in indices:
+        print(f"\nBiomarker {index}: {statistics['biomarkers'][index]}")
+        print(streaming_summary(statistics, index).to_string())
+    if args.uniquely_high:
+        cancer_biomarkers_uniquely_high(statistics_categories(statistics), statistics, range(len(statistics['biomarkers'])))
+
+
+def update(args):
+    from incremental_screening import incremental_update
+    from table_reader import read_table
+    stages, _ = screening_pipeline(args)
+    stage_names = {stage['name'] for stage in stages}
+    targets = [f"yuen_welch_{cancer.lower()}" if f"yuen_welch_{cancer.lower()}" in stage_names else f"filter_{cancer.lower()}"
+               for cancer in args.cancers]
+    samples = read_table(args.input)
+    try:
+        artifacts, report = incremental_update(stages, samples, targets = ['data'] + targets + ['p_values', 'quantiles'], artifact_dir = args.artifact_dir)
+    except ValueError as error:
+        sys.exit(f"error: {error}")
+    print(report.to_string(index = False))
+
+    biomarker_names = feature_label_split(artifacts['data'][1][0])[0].columns
+    changed = set(report.Stage[report.Changed])
+    print("\n\nSUMMARY OF FINDINGS:\n")
+    for cancer, target in zip(args.cancers, targets):
+        print(f"\nBiomarkers selected for {cancer.lower()}" + (" (changed)" if target in changed else "") + ":\n")
+        if target.startswith('yuen_welch_'):
+            print([(biomarker_names[i], shared) for i, shared in artifacts[target]])
+        else:
+            print([biomarker_names[i] for i in artifacts[target]])
+
+
+def parse_covariates(specs):
+    """
+    Table -> columns, from covariates given as TABLE:COLUMN, e.g., S4:Age.
+    """
+    columns = {}
+    for spec in specs:
+        table, separator, column = spec.partition(':')
+        if not separator:
+            raise ValueError(f"Covariate '{spec}' is not given as TABLE:COLUMN, e.g., S4:Age.")
+        columns.setdefault(table.upper(), []).append(column)
+    return columns
+
+
+def covariates(args):
+    from supplementary_tables import load_supplementary_tables, join_covariates, stratify
+    if not args.features and not args.stratify:
+        sys.exit("error: give covariates as --features, or a covariate to --stratify by")
+    categories, dfs = load_data(args.data)
+    biomarkers = biomarker_indices(args) if args.biomarkers else None
+    try:
+        features, strata = parse_covariates(args.features), parse_covariates([args.stratify] if args.stratify else [])
+        tables = load_supplementary_tables(args.source, tables = sorted({*features, *strata}), engine = args.engine)
+        feature_covariates = join_covariates(dfs, tables, features, encode = True)
+        strata_covariates = join_covariates(dfs, tables, strata)
+    except ValueError as error:
+        sys.exit(f"error: {error}")
+
+    for cancer in args.cancers:
+        if args.features:
+            from random_forest_model import rf_normal_cancers
+            rf_normal_cancers(categories, dfs, cancer_types[cancer],
+                              selected_biomarkers = biomarkers if biomarkers is not None else np.arange(feature_label_split(dfs[0])[0].shape[1]),
+                              iterations = args.iterations, threshold = args.rf_threshold, covariates = feature_covariates)
+        if args.stratify:
+            from stats_tests import stratified_p_value_matrix
+            column = strata[next(iter(strata))][0]
+            p_df = stratified_p_value_matrix(categories, stratify(dfs, strata_covariates, column), cancer_types[cancer],
+                                             biomarker_indices = biomarkers, test_type = args.test)
+            print(f"\np-values of {cancer} versus the other categories, by {column}:\n")
+            print(p_df.to_string(float_format = lambda p: f"{p:.3g}"))
+
+
+def stages(args):
+    from stage_screening import stage_groups, stage_p_values, stage_trend_test, stage_quantile_cube, stage_rf_screening
+    categories, dfs = load_data(args.data)
+    biomarkers = biomarker_indices(args) if args.biomarkers else None
+    groups = stage_groups(categories, dfs, biomarkers)
+    unknown = [stage for stage in args.stages or [] if stage not in groups['stages']]
+    if unknown:
+        sys.exit(f"error: unknown stages {unknown}. Choose among {groups['stages']}.")
+    if args.quantiles:
+        stage_quantile_cube(groups).to_csv(args.quantiles, index = False)
+        print(f"Quantiles by category and stage saved to {args.quantiles}")
+
+    for cancer in args.cancers:
+        p_df = stage_p_values(groups, cancer_types[cancer], test_type = args.test)
+        if args.stages:
+            p_df = p_df[p_df.index.get_level_values('Stage').isin(args.stages)]
+        print(f"\np-values of {cancer} versus the other categories, by stage:\n")
+        print(p_df.to_string(float_format = lambda p: f"{p:.3g}"))
+        trend_df = stage_trend_test(groups, cancer_types[cancer], reference_category_index = None if args.stages_only else 5,
+                                    alternative = args.trend)
+        print(f"\nJonckheere-Terpstra's test of a{'n' if args.trend == 'increasing' else ''} {args.trend} trend across the stages of {cancer}:\n")
+        print(trend_df.head(args.top).to_string(float_format = lambda value: f"{value:.4g}"))
+        if args.rf:
+            important_biomarkers = stage_rf_screening(categories, dfs, groups, cancer_types[cancer], stages = args.stages,
+                                                      selected_biomarkers = biomarkers if biomarkers is not None else np.arange(len(groups['biomarkers'])),
+                                                      iterations = args.iterations, threshold = args.rf_threshold)
+            skipped = [stage for stage in args.stages or groups['stages'] if (cancer_types[cancer], stage) in groups['groups'] and stage not in important_biomarkers]
+            if skipped:
+                print(f"\nNo random forest for the stages {skipped} of {cancer}, with less than 10 samples.")
+
+
+def stability(args):
+    from bootstrap_stability import bootstrap_stability
+    categories, dfs = load_data(args.data)
+    biomarkers = biomarker_indices(args) if args.biomarkers else None
+    frequencies, _ = bootstrap_stability(categories, dfs, [cancer_types[cancer] for cancer in args.cancers], replicates = args.replicates,
+                                         seed = args.seed, sample_fraction = args.sample_fraction, iterations = args.iterations,
+                                         rf_threshold = args.rf_threshold, p_threshold = args.p_threshold, selected_biomarkers = biomarkers,
+                                         workers = args.workers, checkpoint_dir = args.checkpoint_dir)
+    print(f"\nSelection frequencies over {args.replicates} replicates:\n")
+    print(frequencies.to_string(float_format = lambda frequency: f"{frequency:.3f}"))
+    if args.output:
+        frequencies.reset_index().to_csv(args.output, index = False)
+        print(f"\nSelection frequencies saved to {args.output}")
+
+
+def worker(args):
+    from work_queue import run_worker, stop_workers
+    if args.stop:
+        stop_workers(args.queue)
+    else:
+        run_worker(args.queue, poll_interval = args.poll_interval, idle_timeout = args.idle_timeout)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog = "main.py", description = "Screening of cancer biomarkers from the clinical data by Cohen et al. (2018).")
+    parser.add_argument('--headless', action = 'store_true', help = "render the figures with the non-interactive Agg backend, without a display")
+    parser.add_argument('--trace', metavar = 'FILE', help = "record the time and memory of every stage, random forest phase, test batch and figure, "
+                                                          "save them as a Chrome trace to FILE and print a summary")
+    subparsers = parser.add_subparsers(dest = 'command', required = True)
+
+    extract_parser = subparsers.add_parser('extract', help = "extract the blood test table (Table S6) from the supplementary tables")
+    extract_parser.add_argument('--source', default = "data/aar3247_cohen_sm_tables-s1-s11.xlsx", help = "the supplementary tables (default: %(default)s)")
+    extract_parser.add_argument('--engine', choices = ['calamine', 'openpyxl'], help = "the Excel reader (default: calamine if installed, otherwise openpyxl)")
+    extract_parser.set_defaults(command_function = extract)
+
+    split_parser = subparsers.add_parser('split', help = "split the blood test table into one sheet per tumor type")
+    split_parser.add_argument('--input', default = "data/prelim_clinical_cancer_data.xlsx", help = "the extracted blood test table (default: %(default)s)")
+    split_parser.add_argument('--engine', choices = ['calamine', 'openpyxl'], help = "the Excel reader (default: calamine if installed, otherwise openpyxl)")
+    split_parser.set_defaults(command_function = split)
+
+    convert_parser = subparsers.add_parser('convert', help = "convert a sheet of a workbook (by default all the samples of the clinical data) to CSV or Parquet")
+    convert_parser.add_argument('--input', default = "data/clinical_cancer_data.xlsx", help = "the workbook (default: %(default)s)")
+    convert_parser.add_argument('--sheet', default = 0, type = lambda sheet: int(sheet) if sheet.isdigit() else sheet, help = "the sheet, by name or index (default: the first one)")
+    convert_parser.add_argument('--output', required = True, help = "the .csv, .csv.gz or .parquet file")
+    convert_parser.add_argument('--engine', choices = ['calamine', 'openpyxl'], help = "the Excel reader (default: calamine if installed, otherwise openpyxl)")
+    convert_parser.set_defaults(command_function = convert)
+
+    # The options shared by the commands running the screening stages
+    data_options = argparse.ArgumentParser(add_help = False)
+    data_options.add_argument('--data', default = "data/clinical_cancer_data.xlsx", help = "the clinical data, one sheet per tumor type, or its conversion by 'convert' (default: %(default)s)")
+    data_options.add_argument('--biomarkers', nargs = '+', metavar = 'BIOMARKER', help = "the biomarkers to use, by name or index (default: all)")
+    screening_options = argparse.ArgumentParser(add_help = False, parents = [data_options])
+    screening_options.add_argument('--cancers', nargs = '+', type = str.capitalize, choices = list(cancer_types), default = list(cancer_types), metavar = 'CANCER',
+                                   help = f"the cancer types to screen, among {list(cancer_types)} (default: all)")
+    screening_options.add_argument('--iterations', type = int, help = "the number of random forest iterations (default: 100)")
+    screening_options.add_argument('--rf-threshold', type = float, help = "the random forest importance threshold (default: 0.04)")
+    screening_options.add_argument('--p-threshold', type = float, help = "the p-value threshold of Yuen-Welch's test (default: 0.05)")
+    screening_options.add_argument('--workers', type = int, default = 1, help = "the budget of workers, split between cancer types and random forest threads (default: %(default)s, 0 for all the CPUs)")
+    screening_options.add_argument('--artifact-dir', default = ".pipeline_artifacts", help = "the directory of the cached stage artifacts (default: %(default)s)")
+    screening_options.add_argument('--force', nargs = '*', default = [], metavar = 'STAGE', help = "stages to re-execute regardless of the cache")
+    screening_options.add_argument('--quiet', action = 'store_true', help = "do not print the details of every stage")
+    screening_options.add_argument('--results-db', metavar = 'FILE', help = "record the importances, iterations, selections, p-values and quantiles of the run in this SQLite database")
+    screening_options.add_argument('--label', help = "a label of the recorded run")
+
+    screen_parser = subparsers.add_parser('screen', parents = [screening_options], help = "screen the biomarkers of the given cancer types")
+    screen_parser.set_defaults(command_function = screen)
+
+    figures_parser = subparsers.add_parser('figures', parents = [screening_options], help = "render the figures of the article")
+    figures_parser.add_argument('--profile', choices = list(output_profiles), default = 'publication', help = "the output profile (default: %(default)s)")
+    figures_parser.add_argument('--max-workers', type = int, help = "the number of rendering processes (default: the number of CPUs)")
+    figures_parser.add_argument('--no-cache', action = 'store_true', help = "re-render all the figures")
+    figures_parser.set_defaults(command_function = figures)
+
+    report_parser = subparsers.add_parser('report', parents = [data_options], help = "descriptive statistics report of the biomarkers, one page each")
+    report_parser.add_argument('--output', default = "descriptive_statistics_report.pdf", help = "the PDF file (default: %(default)s)")
+    report_parser.add_argument('--profile', choices = list(output_profiles), default = 'publication', help = "the output profile (default: %(default)s)")
+    report_parser.set_defaults(command_function = report)
+
+    resample_parser = subparsers.add_parser('resample', parents = [data_options], help = "run the random forest iterations on the workers of a queue directory")
+    resample_parser.add_argument('--cancers', nargs = '+', type = str.capitalize, choices = list(cancer_types), default = list(cancer_types), metavar = 'CANCER',
+                                 help = f"the cancer types, each classified against Normal, among {list(cancer_types)} (default: all)")
+    resample_parser.add_argument('--combined', action = 'store_true', help = "classify the given cancer types together against Normal")
+    resample_parser.add_argument('--iterations', type = int, default = 100, help = "the number of random forest iterations (default: %(default)s)")
+    resample_parser.add_argument('--rf-threshold', type = float, default = 0.04, help = "the random forest importance threshold (default: %(default)s)")
+    resample_parser.add_argument('--queue', default = ".work_queue", help = "the queue directory, shared with the workers (default: %(default)s)")
+    resample_parser.add_argument('--local-workers', type = int, default = 1, help = "the number of workers started on this host (default: %(default)s, 0 to rely on 'worker' commands)")
+    resample_parser.add_argument('--lease', type = float, default = 600, help = "the seconds after which an unfinished task is given to another worker (default: %(default)s)")
+    resample_parser.set_defaults(command_function = resample)
+
+    results_parser = subparsers.add_parser('results', help = "query the recorded runs: the runs, or the importances (and p-values) of a cancer type across runs")
+    results_parser.add_argument('--db', default = "results.sqlite", help = "the results database (default: %(default)s)")
+    results_parser.add_argument('--cancer', type = str.capitalize, help = "the cancer type, e.g. Ovary (default: list the runs)")
+    results_parser.add_argument('--biomarker', help = "the biomarker, e.g. CA-125 (default: all)")
+    results_parser.set_defaults(command_function = results)
+
+    train_parser = subparsers.add_parser('train-panels', parents = [screening_options], help = "fit the models of the finalized panels on all the samples and save them")
+    train_parser.add_argument('--output', default = "panel_models.npz", help = "the file of the panel models (default: %(default)s)")
+    train_parser.set_defaults(command_function = train_panels)
+
+    score_parser = subparsers.add_parser('score', help = "score new samples with the panel models")
+    score_parser.add_argument('--models', default = "panel_models.npz", help = "the file of the panel models (default: %(default)s)")
+    score_parser.add_argument('--input', required = True, help = "the samples, a CSV or Excel file with a column per biomarker of the panels")
+    score_parser.add_argument('--output', default = "scores.csv", help = "the CSV file of the scores (default: %(default)s)")
+    score_parser.add_argument('--threshold', type = float, default = 0.5, help = "the score above which a sample is predicted as the cancer type of its highest score (default: %(default)s)")
+    score_parser.add_argument('--keep-ids', action = 'store_true', help = "copy the first two columns of the samples (e.g., Patient ID # and Sample ID #) to the scores")
+    score_parser.set_defaults(command_function = score)
+
+    serve_parser = subparsers.add_parser('serve', help = "score new samples over HTTP (POST /score), in micro-batches")
+    serve_parser.add_argument('--models', default = "panel_models.npz", help = "the file of the panel models (default: %(default)s)")
+    serve_parser.add_argument('--host', default = "127.0.0.1", help = "the address to listen on (default: %(default)s)")
+    serve_parser.add_argument('--port', type = int, default = 8050, help = "the port (default: %(default)s)")
+    serve_parser.add_argument('--max-batch', type = int, default = 1024, help = "the maximum number of samples scored together (default: %(default)s)")
+    serve_parser.add_argument('--max-delay-ms', type = float, default = 1.0, help = "the milliseconds a request waits for others to join its batch (default: %(default)s)")
+    serve_parser.set_defaults(command_function = serve)
+
+    sketch_parser = subparsers.add_parser('sketch', help = "streaming statistics (moments, quantile sketches) of a cohort read in chunks, mergeable across shards")
+    sketch_parser.add_argument('--input', nargs = '+', default = [], metavar = 'FILE', help = "the cohort, CSV or Parquet files laid out as Table S6")
+    sketch_parser.add_argument('--merge', nargs = '+', default = [], metavar = 'FILE', help = "statistics saved by previous runs, e.g., of other shards")
+    sketch_parser.add_argument('--output', default = "streaming_statistics.json", help = "the file of the statistics (default: %(default)s)")
+    sketch_parser.add_argument('--k', type = int, default = 200, help = "the size of the quantile sketches, exact up to this many values (default: %(default)s)")
+    sketch_parser.add_argument('--chunksize', type = int, default = 100000, help = "the samples read at a time (default: %(default)s)")
+    sketch_parser.add_argument('--biomarkers', nargs = '+', metavar = 'BIOMARKER', help = "print the statistics of these biomarkers, by name or index")
+    sketch_parser.add_argument('--uniquely-high', action = 'store_true', help = "print the biomarkers with uniquely high Q2 and Q3 levels in a category")
+    sketch_parser.set_defaults(command_function = sketch)
+
+    update_parser = subparsers.add_parser('update', parents = [screening_options], help = "append new samples to the data, and update the screening by recomputing only what they can change")
+    update_parser.add_argument('--input', required = True, help = "the new samples, a CSV or Excel file with the columns of the data sheets")
+    update_parser.set_defaults(command_function = update)
+
+    covariates_parser = subparsers.add_parser('covariates', parents = [data_options], help = "random forests with covariates of the supplementary tables as additional features, and tests stratified by a covariate")
+    covariates_parser.add_argument('--source', default = "data/aar3247_cohen_sm_tables-s1-s11.xlsx", help = "the supplementary tables (default: %(default)s)")
+    covariates_parser.add_argument('--engine', choices = ['calamine', 'openpyxl'], help = "the Excel reader (default: calamine if installed, otherwise openpyxl)")
+    covariates_parser.add_argument('--cancers', nargs = '+', type = str.capitalize, choices = list(cancer_types), default = ['Ovary', 'Pancreas'], metavar = 'CANCER',
+                                   help = f"the cancer types, among {list(cancer_types)} (default: %(default)s)")
+    covariates_parser.add_argument('--features', nargs = '+', default = [], metavar = 'TABLE:COLUMN', help = "covariates added to the biomarkers of the random forests, e.g., S4:Age S4:Sex")
+    covariates_parser.add_argument('--stratify', metavar = 'TABLE:COLUMN', help = "the covariate stratifying the tests of the biomarkers, e.g., S4:Sex")
+    covariates_parser.add_argument('--test', choices = ['ywtest', 'utest'], default = 'ywtest', help = "the test of the stratified p-values (default: %(default)s)")
+    covariates_parser.add_argument('--iterations', type = int, default = 100, help = "the number of random forest iterations (default: %(default)s)")
+    covariates_parser.add_argument('--rf-threshold', type = float, default = 0.04, help = "the random forest importance threshold (default: %(default)s)")
+    covariates_parser.set_defaults(command_function = covariates)
+
+    stages_parser = subparsers.add_parser('stages', parents = [data_options], help = "screening by AJCC stage: quantiles, tests and random forests of every stage, and a trend test across the stages")
+    stages_parser.add_argument('--cancers', nargs = '+', type = str.capitalize, choices = list(cancer_types), default = ['Ovary', 'Pancreas'], metavar = 'CANCER',
+                               help = f"the cancer types, among {list(cancer_types)} (default: %(default)s)")
+    stages_parser.add_argument('--stages', nargs = '+', metavar = 'STAGE', help = "the stages of the tests and the random forests, e.g., I (default: all)")
+    stages_parser.add_argument('--test', choices = ['ywtest', 'utest'], default = 'ywtest', help = "the test of the stages versus the other categories (default: %(default)s)")
+    stages_parser.add_argument('--trend', choices = ['increasing', 'decreasing', 'two-sided'], default = 'increasing', help = "the alternative of the trend test (default: %(default)s)")
+    stages_parser.add_argument('--stages-only', action = 'store_true', help = "the trend across the stages only, without the Normal samples before the first stage")
+    stages_parser.add_argument('--top', type = int, default = 10, help = "the biomarkers with the most significant trends to print (default: %(default)s)")
+    stages_parser.add_argument('--quantiles', metavar = 'FILE', help = "save the quantiles of every category and stage to this CSV file")
+    stages_parser.add_argument('--rf', action = 'store_true', help = "also run the random forests of the Normal samples versus every stage")
+    stages_parser.add_argument('--iterations', type = int, default = 100, help = "the number of random forest iterations (default: %(default)s)")
+    stages_parser.add_argument('--rf-threshold', type = float, default = 0.04, help = "the random forest importance threshold (default: %(default)s)")
+    stages_parser.set_defaults(command_function = stages)
+
+    stability_parser = subparsers.add_parser('stability', parents = [data_options], help = "selection frequencies of the biomarkers over bootstrap replicates of the whole screening, run on a pool of workers")
+    stability_parser.add_argument('--cancers', nargs = '+', type = str.capitalize, choices = list(cancer_types), default = list(cancer_types), metavar = 'CANCER',
+                                  help = f"the cancer types to screen, among {list(cancer_types)} (default: all)")
+    stability_parser.add_argument('--replicates', type = int, default = 200, help = "the number of replicates (default: %(default)s)")
+    stability_parser.add_argument('--seed', type = int, default = 0, help = "the seed of the replicates (default: %(default)s)")
+    stability_parser.add_argument('--sample-fraction', type = float, help = "draw this fraction of every category without replacement, instead of bootstrap samples")
+    stability_parser.add_argument('--iterations', type = int, default = 100, help = "the number of random forest iterations (default: %(default)s)")
+    stability_parser.add_argument('--rf-threshold', type = float, default = 0.04, help = "the random forest importance threshold (default: %(default)s)")
+    stability_parser.add_argument('--p-threshold', type = float, default = 0.05, help = "the p-value threshold of Yuen-Welch's test (default: %(default)s)")
+    stability_parser.add_argument('--workers', type = int, default = 0, help = "the budget of workers, split between replicates and random forest threads (default: %(default)s, all the CPUs)")
+    stability_parser.add_argument('--checkpoint-dir', default = ".stability", help = "the directory of the completed replicates, reused by a restarted run (default: %(default)s)")
+    stability_parser.add_argument('--output', metavar = 'FILE', help = "save the selection frequencies to this CSV file")
+    stability_parser.set_defaults(command_function = stability)
+
+    worker_parser = subparsers.add_parser('worker', help = "compute the tasks of a queue directory, until it is stopped or idle")
+    worker_parser.add_argument('--queue', default = ".work_queue", help = "the queue directory (default: %(default)s)")
+    worker_parser.add_argument('--poll-interval', type = float, default = 0.5, help = "the seconds between two looks at an empty queue (default: %(default)s)")
+    worker_parser.add_argument('--idle-timeout', type = float, help = "exit after this many seconds without tasks (default: never)")
+    worker_parser.add_argument('--stop', action = 'store_true', help = "ask all the workers of the queue to exit after their current task")
+    worker_parser.set_defaults(command_function = worker)
+    return parser
+
+
+def main(argv = None):
+    args = build_parser().parse_args(argv)
+    if args.headless:
+        os.environ['MPLBACKEND'] = 'Agg'
+    if getattr(args, 'workers', None) == 0:
+        args.workers = None
+    warnings.filterwarnings("ignore", category=UserWarning)
+    if args.trace:
+        enable_tracing()
+    args.command_function(args)
+    if args.trace:
+        print_trace_summary()
+        print(f"Trace saved to {export_chrome_trace(args.trace)}")
 
 
 if __name__ == "__main__":
@@ -1,7 +1,10 @@
 import pandas as pd
 
-def append_sheets_by_tumor_type(file_path = "data/prelim_clinical_cancer_data.xlsx"):
-    df = pd.read_excel(file_path, sheet_name=0)  # Assumes first sheet has all data
+#  Project imports
+from table_reader import read_table
+
+def append_sheets_by_tumor_type(file_path = "data/prelim_clinical_cancer_data.xlsx", engine = None):
+    df = read_table(file_path, sheet_name=0, engine=engine)  # Assumes first sheet has all data
 
     # List of tumor types to split into separate sheets
     tumor_types = [
@@ -0,0 +1,242 @@
+# Library imports
+import glob
+import io
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import redirect_stdout
+import numpy as np
+import pandas as pd
+
+#  Project imports
+from data_preprocessing import feature_label_split
+from fingerprint import fingerprint
+from instrumentation import span, enable_tracing, tracing_enabled, reset_trace, trace_events, extend_trace
+from random_forest_model import rf_normal_cancers
+from scheduler import split_worker_budget
+from screening_state import screening_state
+from shared_dataset import shared_dataset, attach_dataset, category_rows
+from incremental_screening import filter_from_state, yuen_welch_from_state
+
+# Stability of the screening under resampling of the patients. Every bootstrap replicate draws the
+# samples of every category with replacement (or a fraction of them without replacement), and runs
+# the whole chain of the screening on them for every cancer type: the random forest importance
+# (`rf_normal_cancers`), the uniquely high levels and the higher side filtering, and Yuen-Welch's
+# test (`find_shared_nature_of_biomarkers`). The selection frequency of a biomarker is the fraction
+# of the replicates in which it passes each step.
+#
+# The replicates run in a pool of worker processes. The levels of the cohort are placed in shared
+# memory once (see shared_dataset.py), and a replicate only carries its index: its samples are drawn
+# from a generator seeded by the index, so a replicate gives the same selections on any worker. The
+# quantiles and the inputs of Yuen-Welch's test of a replicate are computed once, in a screening
+# state (see screening_state.py), for the filters and the tests of all the cancer types. With a
+# checkpoint directory, every replicate is saved as it completes, and a run restarted with the same
+# data and parameters only computes the missing replicates.
+
+# The steps of the chain, in order
+selection_steps = ['RF', 'Descriptive', 'Final']
+
+
+def replicate_dfs(handle, replicate, seed = 0, sample_fraction = None):
+    """
+    The dataframes of the categories of a replicate, drawn from the shared dataset, laid out as
+    Table S6 (the identifiers are the rows of the samples in their category).
+
+    Parameters
+    ----------
+    handle : dict
+        The handle of the shared dataset (see `shared_dataset.shared_dataset`).
+    replicate : int
+        The replicate, which seeds the draws with `seed`.
+    seed : int, optional
+        The seed of the run (default is 0).
+    sample_fraction : float, optional
+        The fraction of the samples of every category drawn without replacement (default is None,
+        i.e., as many samples as in the category, drawn with replacement).
+    """
+    levels, _ = attach_dataset(handle)
+    rng = np.random.default_rng([seed, replicate])
+    dfs = []
+    for c, category in enumerate(handle['categories']):
+        rows = category_rows(handle, c)
+        n_rows = rows.stop - rows.start
+        if sample_fraction is None:
+            positions = np.sort(rng.integers(0, n_rows, n_rows))
+        else:
+            positions = np.sort(rng.choice(n_rows, size = max(1, int(round(sample_fraction * n_rows))), replace = False))
+        df = pd.DataFrame(levels[rows.start + positions], columns = handle['biomarkers'])
+        df.insert(0, 'AJCC Stage', None)
+        df.insert(0, 'Tumor type', category)
+        df.insert(0, 'Sample ID #', positions.astype(str))
+        df.insert(0, 'Patient ID #', positions.astype(str))
+        dfs.append(df)
+    return dfs
+
+
+def bootstrap_replicate(handle, replicate, cancer_category_indices, seed = 0, sample_fraction = None, iterations = 100,
+                        rf_threshold = 0.04, p_threshold = 0.05, n_jobs = None):
+    """
+    Run the screening chain of every given cancer type on a replicate.
+
+    Returns
+    -------
+    dict
+        Cancer type -> step ('RF', 'Descriptive', 'Final') -> the names of the biomarkers passing
+        the step.
+    """
+    with span('bootstrap.replicate', 'bootstrap', replicate=replicate), redirect_stdout(io.StringIO()):
+        categories, biomarkers = handle['categories'], handle['biomarkers']
+        dfs = replicate_dfs(handle, replicate, seed = seed, sample_fraction = sample_fraction)
+        state = screening_state(categories, dfs)
+        selections = {}
+        for cancer_category_index in cancer_category_indices:
+            important_biomarkers = rf_normal_cancers(categories, dfs, cancer_category_index,
+                                                     selected_biomarkers = np.arange(len(biomarkers)),
+                                                     iterations = iterations,
+                                                     threshold = rf_threshold,
+                                                     debug = False,
+                                                     n_jobs = n_jobs)
+            filtered_biomarkers = filter_from_state(state, important_biomarkers, cancer_category_index)
+            shared_nature_of_biomarkers = yuen_welch_from_state(state, filtered_biomarkers, cancer_category_index, p_threshold = p_threshold)
+            selections[categories[cancer_category_index]] = {'RF': [biomarkers[i] for i in important_biomarkers.index],
+                                                             'Descriptive': [biomarkers[i] for i in filtered_biomarkers],
+                                                             'Final': [biomarkers[i] for i, _ in shared_nature_of_biomarkers]}
+    return selections
+
+
+def _bootstrap_task(trace, *args, **kwargs):
+    # Run a replicate in a worker, with tracing switched on or off as in the parent process, and
+    # return the recorded spans along with the selections
+    enable_tracing(trace)
+    reset_trace()
+    selections = bootstrap_replicate(*args, **kwargs)
+    events = trace_events()
+    reset_trace()
+    return selections, events
+
+
+def selection_frequencies(replicate_selections, biomarkers = None):
+    """
+    The selection frequencies of the biomarkers at every step of the screening.
+
+    Parameters
+    ----------
+    replicate_selections : list
+        The selections of every replicate, as returned by `bootstrap_replicate`.
+    biomarkers : list, optional
+        The biomarkers to report (default is None, i.e., those selected by at least one random
+        forest).
+
+    Returns
+    -------
+    pd.DataFrame
+        One row per cancer type and biomarker, with the fraction of the replicates in which the
+        biomarker passes the random forest ('RF'), the descriptive statistics filters
+        ('Descriptive') and Yuen-Welch's test ('Final'), sorted by cancer type and final
+        frequency.
+    """
+    counts = {}
+    for selections in replicate_selections:
+        for cancer, steps in selections.items():
+            cancer_biomarkers = biomarkers if biomarkers is not None else steps['RF']
+            for biomarker in cancer_biomarkers:
+                counts.setdefault((cancer, biomarker), dict.fromkeys(selection_steps, 0))
+            for step in selection_steps:
+                for biomarker in steps[step]:
+                    if (cancer, biomarker) in counts:
+                        counts[(cancer, biomarker)][step] += 1
+    frequencies = pd.DataFrame.from_dict(counts, orient = 'index', columns = selection_steps) / max(1, len(replicate_selections))
+    frequencies.index = pd.MultiIndex.from_tuples(frequencies.index, names = ['Cancer', 'Biomarker'])
+    return frequencies.sort_values(['Cancer', 'Final', 'Descriptive', 'RF'], ascending = [True, False, False, False])
+
+
+def bootstrap_stability(categories, dfs, cancer_category_indices, replicates = 200, seed = 0, sample_fraction = None, iterations = 100,
+                        rf_threshold = 0.04, p_threshold = 0.05, selected_biomarkers = None, workers = None, checkpoint_dir = None,
+                        verbose = True):
+    """
+    Bootstrap the whole screening chain and report how often every biomarker is selected.
+
+    Parameters
+    ----------
+    categories : list
+        The names of the categories.
+    dfs : list
+        The dataframes of the categories.
+    cancer_category_indices : list
+        The category indices of the cancer types to screen.
+    replicates : int, optional
+        The number of replicates (default is 200).
+    seed : int, optional
+        The seed of the draws of the replicates (default is 0).
+    sample_fraction : float, optional
+        Draw this fraction of the samples of every category without replacement, instead of a
+        bootstrap sample (default is None, i.e., the bootstrap).
+    iterations : int, optional
+        The iterations of every random forest screening (default is 100).
+    rf_threshold : float, optional
+        The random forest importance threshold (default is 0.04).
+    p_threshold : float, optional
+        The p-value threshold of Yuen-Welch's test (default is 0.05).
+    selected_biomarkers : array-like, optional
+        The indices of the biomarkers (default is None, i.e., all the biomarkers).
+    workers : int, optional
+        The budget of workers, split between replicate processes and random forest threads (see
+        `scheduler.split_worker_budget`; default is None, i.e., the number of CPUs).
+    checkpoint_dir : str, optional
+        The directory where every replicate is saved as it completes, and from which the replicates
+        of an earlier run with the same data and parameters are reused (default is None).
+    verbose : bool, optional
+        Whether to print the progress (default is True).
+
+    Returns
+    -------
+    tuple
+        The selection frequencies (see `selection_frequencies`) and the selections of every
+        replicate.
+    """
+    parameters = dict(cancer_category_indices = list(cancer_category_indices), seed = seed, sample_fraction = sample_fraction,
+                      iterations = iterations, rf_threshold = rf_threshold, p_threshold = p_threshold)
+    replicate_selections = {}
+    run_dir = None
+    if checkpoint_dir is not None:
+        levels = [feature_label_split(df, selected_biomarkers)[0] for df in dfs]
+        run_dir = os.path.join(checkpoint_dir, fingerprint(list(categories), levels, parameters)[:16])
+        os.makedirs(run_dir, exist_ok = True)
+        for file_path in glob.glob(os.path.join(run_dir, "replicate_*.json")):
+            replicate = int(os.path.basename(file_path)[len("replicate_"):-len(".json")])
+            if replicate < replicates:
+                with open(file_path) as file:
+                    replicate_selections[replicate] = json.load(file)
+        if verbose and replicate_selections:
+            print(f"[stability] {len(replicate_selections)} replicates reused from {run_dir}")
+
+    def save(replicate, selections):
+        replicate_selections[replicate] = selections
+        if run_dir is not None:
+            file_path = os.path.join(run_dir, f"replicate_{replicate:05d}.json")
+            with open(file_path + ".tmp", 'w') as file:
+                json.dump(selections, file)
+            os.replace(file_path + ".tmp", file_path)
+        if verbose:
+            print(f"[stability] {len(replicate_selections)}/{replicates} replicates")
+
+    pending = [replicate for replicate in range(replicates) if replicate not in replicate_selections]
+    process_workers, rf_jobs = split_worker_budget(workers, n_chains = max(1, len(pending)))
+    with shared_dataset(categories, dfs, selected_biomarkers) as handle:
+        with span('bootstrap_stability', 'bootstrap', replicates=len(pending)):
+            task_parameters = dict(seed = seed, sample_fraction = sample_fraction, iterations = iterations,
+                                   rf_threshold = rf_threshold, p_threshold = p_threshold, n_jobs = rf_jobs)
+            if process_workers == 1:
+                for replicate in pending:
+                    save(replicate, bootstrap_replicate(handle, replicate, cancer_category_indices, **task_parameters))
+            else:
+                with ProcessPoolExecutor(max_workers=process_workers, initializer=attach_dataset, initargs=(handle,)) as executor:
+                    futures = {executor.submit(_bootstrap_task, tracing_enabled(), handle, replicate, cancer_category_indices, **task_parameters): replicate
+                               for replicate in pending}
+                    for future in as_completed(futures):
+                        selections, events = future.result()
+                        extend_trace(events)
+                        save(futures[future], selections)
+
+    replicate_selections = [replicate_selections[replicate] for replicate in range(replicates)]
+    return selection_frequencies(replicate_selections), replicate_selections
@@ -0,0 +1,166 @@
+# Library imports
+import numpy as np
+import pandas as pd
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+
+#  Project imports
+from data_preprocessing import load_data, feature_label_split
+
+
+def standardized_columns(features, dtype = np.float32):
+    """
+    Center the columns of the feature matrix and scale them to unit norm.
+
+    With this scaling, the Pearson correlation of two columns is the dot product of the
+    corresponding standardized columns.
+
+    Parameters
+    ----------
+    features : pd.DataFrame or np.ndarray
+        The feature matrix (samples x biomarkers). Rows with missing values are dropped.
+    dtype : numpy dtype, optional
+        The dtype of the returned matrix (default is np.float32).
+
+    Returns
+    -------
+    np.ndarray
+        The standardized matrix. Constant columns are all zeros, hence uncorrelated with everything.
+    """
+    X = np.asarray(features, dtype=np.float64)
+    X = X[~np.isnan(X).any(axis=1)]
+    X = X - X.mean(axis=0)
+    norms = np.linalg.norm(X, axis=0)
+    norms[norms == 0] = 1
+    return (X / norms).astype(dtype)
+
+
+def biomarker_names(features):
+    """
+    The names of the biomarkers of the feature matrix: the column names of a dataframe, or the
+    column indices of an array.
+    """
+    return np.asarray(features.columns) if isinstance(features, pd.DataFrame) else np.arange(np.shape(features)[1])
+
+
+def correlated_pairs(features, threshold = 0.9, block_size = 1024, dtype = np.float32):
+    """
+    Find the pairs of biomarkers whose absolute Pearson correlation exceeds the threshold.
+
+    The correlation matrix is computed block by block, so at most `block_size` x `block_size`
+    correlations are held in memory at a time, and the above-threshold pairs are extracted
+    from each block with vectorized masking (`np.triu_indices` on the diagonal blocks).
+
+    Parameters
+    ----------
+    features : pd.DataFrame or np.ndarray
+        The feature matrix (samples x biomarkers).
+    threshold : float, optional
+        The absolute correlation cutoff (default is 0.9).
+    block_size : int, optional
+        Number of biomarkers per block (default is 1024).
+    dtype : numpy dtype, optional
+        The dtype in which the correlations are computed (default is np.float32).
+
+    Returns
+    -------
+    pd.DataFrame
+        One row per correlated pair with the columns 'Index 1', 'Index 2' (Index 1 < Index 2),
+        'Biomarker 1', 'Biomarker 2' and 'Correlation', sorted by the absolute correlation
+        (empty, with these columns, if no pair is correlated or there are less than two
+        biomarkers).
+    """
+    Z = standardized_columns(features, dtype=dtype)
+    n_features = Z.shape[1]
+    biomarkers = biomarker_names(features)
+
+    # The lists start with an empty block, so that they concatenate without any block
+    rows, cols, values = [np.empty(0, dtype=np.intp)], [np.empty(0, dtype=np.intp)], [np.empty(0, dtype=dtype)]
+    for start_1 in range(0, n_features, block_size):
+        stop_1 = min(start_1 + block_size, n_features)
+        for start_2 in range(start_1, n_features, block_size):
+            stop_2 = min(start_2 + block_size, n_features)
+            block = Z[:, start_1:stop_1].T @ Z[:, start_2:stop_2]
+            if start_1 == start_2:
+                # Diagonal block: only the strict upper triangle
+                i, j = np.triu_indices(stop_1 - start_1, k=1)
+                mask = np.abs(block[i, j]) > threshold
+                i, j = i[mask], j[mask]
+            else:
+                i, j = np.nonzero(np.abs(block) > threshold)
+            rows.append(i + start_1)
+            cols.append(j + start_2)
+            values.append(block[i, j])
+
+    rows = np.concatenate(rows)
+    cols = np.concatenate(cols)
+    values = np.concatenate(values).astype(np.float64)
+    pairs_df = pd.DataFrame({'Index 1': rows,
+                             'Index 2': cols,
+                             'Biomarker 1': biomarkers[rows],
+                             'Biomarker 2': biomarkers[cols],
+                             'Correlation': values})
+    order = np.argsort(-np.abs(values), kind='stable')
+    return pairs_df.iloc[order].reset_index(drop=True)
+
+
+def correlated_biomarker_groups(pairs_df, biomarkers):
+    """
+    Cluster the redundant biomarkers into groups, i.e., the connected components of the
+    graph whose edges are the correlated pairs.
+
+    Parameters
+    ----------
+    pairs_df : pd.DataFrame
+        The correlated pairs returned by `correlated_pairs`.
+    biomarkers : list
+        The names of all the biomarkers, in column order.
+
+    Returns
+    -------
+    list
+        List of groups (lists of biomarker names) with at least two biomarkers, largest first.
+    """
+    n_features = len(biomarkers)
+    graph = coo_matrix((np.ones(len(pairs_df)), (pairs_df['Index 1'], pairs_df['Index 2'])), shape=(n_features, n_features))
+    _, component_labels = connected_components(graph, directed=False)
+    component_sizes = np.bincount(component_labels)
+    groups = [[biomarkers[i] for i in np.flatnonzero(component_labels == label)]
+              for label in np.flatnonzero(component_sizes > 1)]
+    return sorted(groups, key=len, reverse=True)
+
+
+def correlation_screening(features, threshold = 0.9, block_size = 1024, cluster = False):
+    """
+    Screen the biomarkers for redundancy through their pairwise correlations.
+
+    Parameters
+    ----------
+    features : pd.DataFrame or np.ndarray
+        The feature matrix (samples x biomarkers). The biomarkers of an array are named by their
+        column indices.
+    threshold : float, optional
+        The absolute correlation cutoff (default is 0.9).
+    block_size : int, optional
+        Number of biomarkers per block (default is 1024).
+    cluster : bool, optional
+        Whether to also cluster the redundant biomarkers into groups (default is False).
+
+    Returns
+    -------
+    pd.DataFrame or tuple
+        The correlated pairs, and if `cluster` is True, also the groups of redundant biomarkers.
+    """
+    pairs_df = correlated_pairs(features, threshold=threshold, block_size=block_size)
+    if cluster:
+        return pairs_df, correlated_biomarker_groups(pairs_df, list(biomarker_names(features)))
+    return pairs_df
+
+
+# Debug code
+if __name__ == "__main__":
+    categories, dfs = load_data()
+    features = feature_label_split(pd.concat(dfs, ignore_index=True))[0]
+    pairs_df, groups = correlation_screening(features, threshold=0.7, cluster=True)
+    print(pairs_df)
+    print(f"\nGroups of redundant biomarkers: {groups}")
@@ -3,15 +3,22 @@
 import pandas as pd
 import numpy as np
 
-def load_data(file_path = "data/clinical_cancer_data.xlsx"):
+#  Project imports
+from instrumentation import span
+from table_reader import read_table, table_engine, file_engines
+
+def load_data(file_path = "data/clinical_cancer_data.xlsx", engine = None):
     
     """
-    Load the clinical cancer data from the given Excel file.
+    Load the clinical cancer data from the given Excel file, or from a CSV or Parquet conversion
+    of its first sheet, with all the samples (see `table_reader.convert_table`).
     
     Parameters
     ----------
     file_path : str, default "../data/clinical_cancer_data.xlsx"
-        The path to the Excel file containing the clinical cancer data.
+        The path to the Excel file containing the clinical cancer data, or to its conversion.
+    engine : str, optional
+        The Excel engine (default is None, i.e., the fastest installed, see `table_reader.excel_engine`).
     
     Returns
     -------
@@ -20,19 +27,69 @@ def load_data(file_path = "data/clinical_cancer_data.xlsx"):
         corresponding to the individual datasheets.
     """
     
-    # Load the excel file
-    xls = pd.ExcelFile(file_path)
+    with span('load_data', 'io', file=file_path):
+        if table_engine(file_path, engine) in file_engines.values():
+            # All the samples in one table, split by tumor type, in the order of the datasheets
+            df = read_table(file_path)
+            labels = df.iloc[:, 2]
+            categories = sorted(labels.dropna().unique())
+            dfs = [df[labels == category].reset_index(drop=True) for category in categories]
+            # As in a datasheet of its own, a column without any value is read as float
+            dfs = [category_df.astype({column: float for column in category_df.columns if category_df[column].isna().all()})
+                   for category_df in dfs]
+        else:
+            # Load all the sheets of the excel file at once
+            sheets = read_table(file_path, sheet_name = None, engine = engine)
 
-    # The datasheet names. Note that the individual datasheets start from sheet 2, i.e., index 1.
-    categories = xls.sheet_names[1:]
+            # The datasheet names. Note that the individual datasheets start from sheet 2, i.e., index 1.
+            categories = list(sheets)[1:]
 
-    # Load the individual datasheets into a list of dataframes
-    dfs = [pd.read_excel(xls, sheet_name) for sheet_name in xls.sheet_names[1:]]
+            # The individual datasheets
+            dfs = [sheets[sheet_name] for sheet_name in categories]
     
     return categories, dfs
 
 
-def feature_label_split(df: pd.DataFrame, selected_biomarkers = np.arange(39)) -> tuple:
+def save_data(categories, dfs, file_path = "data/clinical_cancer_data.xlsx", all_samples = None):
+    """
+    Save the clinical cancer data in the layout read by `load_data`: all the samples in the first
+    sheet, then one sheet per category, or only all the samples in a CSV or Parquet file.
+
+    Parameters
+    ----------
+    categories : list
+        The names of the datasheets.
+    dfs : list
+        The dataframes of the datasheets.
+    file_path : str, default "data/clinical_cancer_data.xlsx"
+        The Excel file, or the CSV or Parquet file.
+    all_samples : pd.DataFrame, optional
+        The first sheet (default is None, i.e., the datasheets one after the other).
+    """
+    if all_samples is None:
+        all_samples = pd.concat(dfs, ignore_index=True)
+    with span('save_data', 'io', file=file_path):
+        if table_engine(file_path) == 'csv':
+            all_samples.to_csv(file_path, index=False)
+            return file_path
+        if table_engine(file_path) == 'parquet':
+            all_samples.to_parquet(file_path, index=False)
+            return file_path
+        with pd.ExcelWriter(file_path, engine="openpyxl") as writer:
+            all_samples.to_excel(writer, sheet_name="All", index=False)
+            for category, df in zip(categories, dfs):
+                df.to_excel(writer, sheet_name=category, index=False)
+    return file_path
+
+
+def number_of_biomarkers(df: pd.DataFrame) -> int:
+    """
+    The number of biomarker columns of the dataframe: the columns after the first four, except
+    the trailing CancerSEEK score columns (39 for Table S6).
+    """
+    return sum(1 for column in df.columns[4:] if not str(column).startswith('CancerSEEK'))
+
+def feature_label_split(df: pd.DataFrame, selected_biomarkers = None) -> tuple:
     """
     Split the dataframe into biomarker levels and cancer label.
     
@@ -40,6 +97,8 @@ def feature_label_split(df: pd.DataFrame, selected_biomarkers = np.arange(39)) -
     ----------
     df : pd.DataFrame
         The dataframe to split.
+    selected_biomarkers : array-like, optional
+        The indices of the biomarkers to keep (default is None, i.e., all the biomarkers).
     
     Returns
     -------
@@ -52,14 +111,17 @@ def feature_label_split(df: pd.DataFrame, selected_biomarkers = np.arange(39)) -
     - The first column is the sample id.
     - The second column is the Tumor type.
     - The third column is the AJCC Stages.
-    - The columns from 4 to 43 are the biomarker levels.
+    - The columns from 4 to 43 are the biomarker levels (more for a synthetic cohort, see
+      benchmarks/synthetic_cohort.py).
     """
-    selected_features = selected_biomarkers + 4
+    if selected_biomarkers is None:
+        selected_biomarkers = np.arange(number_of_biomarkers(df))
+    selected_features = np.asarray(selected_biomarkers) + 4
     biomarker_levels = df.iloc[:, selected_features]
     cancer_label = df.iloc[:, 2]
     return biomarker_levels, cancer_label
 
-def feature_label_split_stage_I(df: pd.DataFrame, selected_biomarkers = np.arange(39)) -> tuple:
+def feature_label_split_stage_I(df: pd.DataFrame, selected_biomarkers = None) -> tuple:
     """
     Split the dataframe into biomarker levels and cancer label for stage I data.
     
@@ -1,12 +1,119 @@
 # Library imports
 import numpy as np
-import matplotlib.pyplot as plt
-import seaborn as sns
+import pandas as pd
+from scipy.signal import fftconvolve
 
 # Project imports
-from data_preprocessing import load_data, feature_label_split
+from data_preprocessing import load_data, feature_label_split, number_of_biomarkers
+from streaming_stats import streaming_quantiles
+from screening_state import state_quantiles
+from output_profiles import output_profiles, get_output_profile, rasterize_dense_layers
 
-def descriptive_statistics(categories, dfs, biomarker_index):   
+def binned_statistics(values, bins = 'auto', kde_gridsize = 512, cut = 3, bw_adjust = 1):
+    """
+    Compute the descriptive statistics, the histogram counts and a binned KDE of the given values.
+
+    The values are binned once onto a regular grid (linear binning), and the Gaussian KDE is
+    obtained by an FFT convolution of the binned counts with the sampled kernel. The cost is
+    linear in the number of samples plus O(g log g) in the grid size g, instead of the
+    O(n g) cost of evaluating a direct Gaussian KDE at every grid point.
+
+    Parameters
+    ----------
+    values : array-like
+        The biomarker levels of one category. NaN values are ignored.
+    bins : int, str or array-like, optional
+        The histogram bins, passed to `np.histogram_bin_edges` (default is 'auto').
+    kde_gridsize : int, optional
+        Number of grid points for the KDE (default is 512).
+    cut : float, optional
+        Number of bandwidths by which the KDE grid extends past the extreme values (default is 3).
+    bw_adjust : float, optional
+        Factor that multiplies the Scott's rule bandwidth (default is 1).
+
+    Returns
+    -------
+    dict
+        Dictionary with the keys 'count', 'mean', 'std', 'cv', 'quantiles' (Q1, Q2, Q3),
+        'bin_edges', 'counts', 'kde_grid' and 'kde'. The KDE is scaled to the histogram counts,
+        as in `sns.histplot(..., kde=True)`. 'kde_grid' and 'kde' are None if the KDE is undefined,
+        i.e., if there are less than two samples or all the values are equal.
+    """
+    values = np.asarray(values, dtype=float)
+    values = values[~np.isnan(values)]
+    n = values.size
+
+    # Descriptive statistics, matching pd.Series.describe()
+    mean = values.mean() if n > 0 else np.nan
+    std = values.std(ddof=1) if n > 1 else np.nan
+    quantiles = tuple(np.quantile(values, [0.25, 0.5, 0.75])) if n > 0 else (np.nan, np.nan, np.nan)
+
+    # Pre-aggregated histogram counts
+    counts, bin_edges = np.histogram(values, bins=bins)
+
+    statistics = {'count': n,
+                  'mean': mean,
+                  'std': std,
+                  'cv': std / mean,
+                  'quantiles': quantiles,
+                  'bin_edges': bin_edges,
+                  'counts': counts,
+                  'kde_grid': None,
+                  'kde': None}
+    if n < 2 or not std > 0:
+        return statistics
+
+    # Scott's rule bandwidth, as in scipy.stats.gaussian_kde
+    bandwidth = bw_adjust * std * n ** (-1 / 5)
+    kde_grid = np.linspace(values.min() - cut * bandwidth, values.max() + cut * bandwidth, kde_gridsize)
+    delta = kde_grid[1] - kde_grid[0]
+
+    # Linear binning: split the unit weight of each sample between its two neighbouring grid points
+    position = (values - kde_grid[0]) / delta
+    left = np.clip(np.floor(position).astype(np.int64), 0, kde_gridsize - 2)
+    right_weight = position - left
+    grid_counts = np.bincount(left, weights=1 - right_weight, minlength=kde_gridsize)
+    grid_counts += np.bincount(left + 1, weights=right_weight, minlength=kde_gridsize)
+
+    # Convolve the binned counts with the Gaussian kernel sampled on the same grid
+    offsets = np.arange(-(kde_gridsize - 1), kde_gridsize) * delta
+    kernel = np.exp(-0.5 * (offsets / bandwidth) ** 2) / (np.sqrt(2 * np.pi) * bandwidth)
+    density = fftconvolve(grid_counts, kernel, mode='same') / n
+    density = np.clip(density, 0, None)
+
+    # Scale the density to the histogram counts
+    statistics['kde_grid'] = kde_grid
+    statistics['kde'] = density * n * np.mean(np.diff(bin_edges))
+    return statistics
+
+
+def descriptive_statistics_summary(categories, dfs, biomarker_index, bins = 'auto'):
+    """
+    Compute the binned statistics of the given biomarker for each cancer type.
+
+    Parameters
+    ----------
+    categories : list
+        The list of cancer types.
+    dfs : list
+        The list of dataframes corresponding to each cancer type.
+    biomarker_index : int
+        The index of the biomarker.
+    bins : int, str or array-like, optional
+        The histogram bins (default is 'auto').
+
+    Returns
+    -------
+    tuple
+        The biomarker name, and the list of dictionaries returned by `binned_statistics`,
+        one for each cancer type.
+    """
+    biomarker = feature_label_split(dfs[0])[0].columns[biomarker_index]
+    summary = [binned_statistics(dfs[i][biomarker].to_numpy(), bins=bins) for i in range(len(categories))]
+    return biomarker, summary
+
+
+def descriptive_statistics(categories, dfs, biomarker_index, binned = True, show = True):   
     """
     Do descriptive statistics on the biomarkers for each cancer type.
 
@@ -18,34 +125,45 @@ def descriptive_statistics(categories, dfs, biomarker_index):
         The list of dataframes corresponding to each cancer type.
     biomarker_index : int
         The index of the biomarker to do the descriptive statistics on.
+    binned : bool, optional
+        If True (default), plot the pre-aggregated histogram counts and the binned FFT KDE
+        from `descriptive_statistics_summary`. If False, let seaborn compute the histogram
+        and a direct Gaussian KDE from the raw samples.
+    show : bool, optional
+        Whether to display the plot (default is True).
 
     Returns
     -------
-    None
+    matplotlib.figure.Figure
+        The figure.
     """
     
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+
     # Find the list of biomarkers and pick the biomarker with the given biomarker_index
-    biomarker_levels, _ = feature_label_split(dfs[0])
-    biomarkers = biomarker_levels.columns
-    biomarker = biomarkers[biomarker_index]
+    biomarker, summary = descriptive_statistics_summary(categories, dfs, biomarker_index)
 
     # Create a figure with 3 rows and 3 columns
     fig, axs = plt.subplots(3,3, figsize=(15, 15), constrained_layout=True)
     axs = axs.flatten()
 
     for i, cancer_type in enumerate(categories):
-        df = dfs[i]
-
-        # Do the descriptive statistics
-        desc_stats = df[biomarker].describe()
-        mean = desc_stats['mean']
-        std = desc_stats['std']
-        cv = std / mean
-        quantiles = desc_stats['25%'], desc_stats['50%'], desc_stats['75%']
+        statistics = summary[i]
+        mean = statistics['mean']
+        std = statistics['std']
+        cv = statistics['cv']
+        quantiles = statistics['quantiles']
 
         # Plot the histogram
         ax = axs[i]
-        ax = sns.histplot(df[biomarker].to_numpy(), ax=axs[i], kde = True)
+        if binned:
+            ax.stairs(statistics['counts'], statistics['bin_edges'], fill=True, alpha=0.5)
+            if statistics['kde'] is not None:
+                ax.plot(statistics['kde_grid'], statistics['kde'])
+            ax.set_ylabel('Count')
+        else:
+            ax = sns.histplot(dfs[i][biomarker].to_numpy(), ax=axs[i], kde = True)
 
         # Add text box with descriptive statistics: Mean, Std, CV, Q1, Q2, Q3
         ax.text(0.95,
@@ -60,8 +178,8 @@ def descriptive_statistics(categories, dfs, biomarker_index):
 
         # Add vertical lines corresponding to the quantiles Q1, Q2, and Q3
         colors = ['green', 'red', 'blue']
-        for i in range(3):
-            ax.axvline(quantiles[i], color=colors[i])
+        for j in range(3):
+            ax.axvline(quantiles[j], color=colors[j])
 
         # Set the title for each plot based on the cancer type
         ax.set_title(f"Cancer type: {cancer_type}")
@@ -70,7 +188,44 @@ def descriptive_statistics(categories, dfs, biomarker_index):
     fig.suptitle(f"Biomarker {biomarker_index}: {biomarker} ", size = 15)
     
     # Display the plot
-    plt.show()
+    if show:
+        plt.show()
+    return fig
+
+
+def descriptive_statistics_report(categories, dfs, biomarker_indices = None, file_path = "descriptive_statistics_report.pdf"):
+    """
+    Save the binned descriptive statistics plots of the given biomarkers into a multi-page PDF.
+
+    Parameters
+    ----------
+    categories : list
+        The list of cancer types.
+    dfs : list
+        The list of dataframes corresponding to each cancer type.
+    biomarker_indices : array-like, optional
+        The indices of the biomarkers, one page each (default is None, i.e., all the biomarkers).
+    file_path : str, optional
+        The path of the PDF file (default is "descriptive_statistics_report.pdf"). The report is
+        always a PDF; its resolution and rasterization follow the active output profile.
+
+    Returns
+    -------
+    None
+    """
+    import matplotlib.pyplot as plt
+    from matplotlib.backends.backend_pdf import PdfPages
+
+    if biomarker_indices is None:
+        biomarker_indices = range(number_of_biomarkers(dfs[0]))
+    profile = output_profiles[get_output_profile()]
+    with PdfPages(file_path) as pdf:
+        for biomarker_index in biomarker_indices:
+            fig = descriptive_statistics(categories, dfs, biomarker_index, binned=True, show=False)
+            if profile['rasterize_dense_layers']:
+                rasterize_dense_layers(fig)
+            pdf.savefig(fig, dpi=profile['dpi'])
+            plt.close(fig)
     
 
 def coefficient_of_variation(values):
@@ -112,6 +267,15 @@ def identify_outliers_mad(values, threshold_factor=69):
     return outlier_with_indices
 
 
+def biomarker_name(dfs, biomarker_index):
+    """
+    The name of a biomarker, from the dataframes or from the streaming statistics.
+    """
+    if isinstance(dfs, dict):
+        return dfs['biomarkers'][biomarker_index]
+    return feature_label_split(dfs[0])[0].columns[biomarker_index]
+
+
 def quantiles_across_categories(categories, dfs, biomarker_index, quantile_cut=0.5):
     """
     Calculate the quantiles for the given biomarker across all cancer types.
@@ -120,8 +284,11 @@ def quantiles_across_categories(categories, dfs, biomarker_index, quantile_cut=0
     ----------
     categories : list
         List of cancer types
-    dfs : list
-        List of DataFrames, each containing the features and labels for a particular cancer type
+    dfs : list or dict
+        List of DataFrames, each containing the features and labels for a particular cancer type,
+        or the streaming statistics of the cohort (see streaming_stats.py), whose quantiles are
+        approximate beyond the size of the sketches, within `kll_rank_error`, or a screening
+        state (see screening_state.py), whose quantiles are exact
     biomarker_index : int
         Index of the biomarker of interest in the feature DataFrames
     quantile_cut : float, optional
@@ -132,6 +299,10 @@ def quantiles_across_categories(categories, dfs, biomarker_index, quantile_cut=0
     list
         List of quantile values, one for each cancer type
     """
+    if isinstance(dfs, dict):
+        if 'levels' in dfs:
+            return [float(value) for value in state_quantiles(dfs, quantile_cut)[:, biomarker_index]]
+        return streaming_quantiles(dfs, biomarker_index, quantile_cut)
     Q_levels = []
     for df in dfs:
         features_df = feature_label_split(df)[0]
@@ -141,6 +312,32 @@ def quantiles_across_categories(categories, dfs, biomarker_index, quantile_cut=0
         Q_levels.append(float(Q_value))  # Append the median to the list
     return Q_levels
 
+def quantile_cube(categories, dfs, quantile_cuts = (0.25, 0.5, 0.75)):
+    """
+    Calculate the quantiles of all the biomarkers across all the categories.
+
+    Parameters
+    ----------
+    categories : list
+        List of cancer types
+    dfs : list
+        List of DataFrames, each containing the features and labels for a particular cancer type
+    quantile_cuts : tuple, optional
+        Quantiles to calculate (default is Q1, Q2 and Q3)
+
+    Returns
+    -------
+    pd.DataFrame
+        The quantile values in long format, with the columns Category, Biomarker, Quantile and Value
+    """
+    cube = []
+    for category, df in zip(categories, dfs):
+        quantiles_df = feature_label_split(df)[0].astype(float).quantile(list(quantile_cuts))
+        cube.append(quantiles_df.rename_axis('Quantile').reset_index()
+                                .melt(id_vars='Quantile', var_name='Biomarker', value_name='Value')
+                                .assign(Category=category))
+    return pd.concat(cube, ignore_index=True)[['Category', 'Biomarker', 'Quantile', 'Value']]
+
 def uniquely_high_level_identification(categories, dfs, biomarker_index):
     """
     Demo of outlier identification using the Median Absolute Deviation (MAD) approach
@@ -150,8 +347,9 @@ def uniquely_high_level_identification(categories, dfs, biomarker_index):
     ----------
     categories : list
         List of cancer types
-    dfs : list
-        List of DataFrames, each containing the features and labels for a particular cancer type
+    dfs : list or dict
+        List of DataFrames, each containing the features and labels for a particular cancer type,
+        or the streaming statistics of the cohort (see `quantiles_across_categories`)
     biomarker_index : int
         Index of the biomarker of interest in the feature DataFrames
 
@@ -164,7 +362,7 @@ def uniquely_high_level_identification(categories, dfs, biomarker_index):
     Q2_outliers_with_indices = []
     Q3_outliers_with_indices = []
     
-    biomarker = feature_label_split(dfs[0])[0].columns[biomarker_index]
+    biomarker = biomarker_name(dfs, biomarker_index)
     
     Q2_levels = quantiles_across_categories(categories, dfs, biomarker_index, quantile_cut=0.5)
     Q2_levels_with_categories = [(categories[index], Q2_value) for index, Q2_value in enumerate(Q2_levels)]
@@ -218,7 +416,7 @@ def uniquely_high_level_identification(categories, dfs, biomarker_index):
 
 def higher_side_filtering_identification(categories, dfs, biomarker_index, category_index, debug = True):
     Q3_levels = quantiles_across_categories(categories, dfs, biomarker_index, quantile_cut=0.75)
-    biomarker = feature_label_split(dfs[0])[0].columns[biomarker_index]
+    biomarker = biomarker_name(dfs, biomarker_index)
     higher_levels_in_categories = 0
     rank = None
     categories_indices_except_the_given_category_index = [c for c in range(len(categories)) if c not in [category_index]]
@@ -1,13 +1,25 @@
 import pandas as pd
 import re
 
+#  Project imports
+from table_reader import read_table
+
+# The identifiers, tumor types and stages of Table S6 are read as strings, without inference. The
+# levels are left to inference, since the levels below or above the limits of detection are
+# starred strings among the numbers.
+table_s6_dtypes = {'Patient ID #': str, 'Sample ID #': str, 'Tumor type': str, 'AJCC Stage': str}
+
 def load_data_and_extract_Table_S6(file_path, 
                                    sheet_name = "Table S6",
                                    rows_to_trim_from_above = 2,
-                                   rows_to_trim_from_bottom = 4):
-    
-    df = pd.read_excel(file_path, sheet_name=sheet_name, skiprows=rows_to_trim_from_above)
-    return df.iloc[:-rows_to_trim_from_bottom].reset_index(drop=True)
+                                   rows_to_trim_from_bottom = 4,
+                                   engine = None,
+                                   columns = None):
+    # The footnotes at the bottom are skipped while parsing, and with columns (names as in the
+    # header of the sheet), only these columns are kept. engine: see table_reader.read_table.
+    dtypes = {column: dtype for column, dtype in table_s6_dtypes.items() if columns is None or column in columns}
+    return read_table(file_path, sheet_name = sheet_name, engine = engine, columns = columns, dtypes = dtypes,
+                      skiprows = rows_to_trim_from_above, skipfooter = rows_to_trim_from_bottom)
 
 def strip_units(col):
     # Remove anything in parentheses and extra spaces
@@ -17,8 +29,8 @@ def strip_stars(df):
     # Remove '*' from all string values in the DataFrame
     return df.map(lambda x: x.replace('*', '') if isinstance(x, str) else x)
 
-def extract_blood_test_table(file_path = "data/aar3247_cohen_sm_tables-s1-s11.xlsx"):
-    df = load_data_and_extract_Table_S6(file_path)
+def extract_blood_test_table(file_path = "data/aar3247_cohen_sm_tables-s1-s11.xlsx", engine = None):
+    df = load_data_and_extract_Table_S6(file_path, engine = engine)
     df.columns = [strip_units(col) for col in df.columns]
     df = strip_stars(df)
     # Save to new Excel file
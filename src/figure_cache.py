@@ -0,0 +1,158 @@
+# Library imports
+import inspect
+import json
+import os
+
+#  Project imports
+from fingerprint import fingerprint, file_fingerprint, code_fingerprint
+from output_profiles import output_file_path
+
+
+def figure_spec_output(figure_spec):
+    """
+    The resolved keyword arguments and the output file path of a figure specification.
+
+    Parameters
+    ----------
+    figure_spec : tuple
+        A (function, kwargs) tuple, as in `figures.render_figures`.
+
+    Returns
+    -------
+    tuple
+        The keyword arguments with the defaults of the function applied (without `show`),
+        and the output file path.
+    """
+    function, kwargs = figure_spec
+    bound_arguments = inspect.signature(function).bind_partial(**kwargs)
+    bound_arguments.apply_defaults()
+    arguments = {name: value for name, value in bound_arguments.arguments.items() if name != 'show'}
+    return arguments, arguments['file_path']
+
+
+def figure_spec_fingerprint(figure_spec, extra = None):
+    """
+    Fingerprint of the input data, the styling parameters and the plotting function source of a
+    figure, together with the source of the project helpers the function calls (e.g., the
+    annotations and `output_profiles.save_figure`), but not of the other plotting functions.
+
+    Parameters
+    ----------
+    figure_spec : tuple
+        A (function, kwargs) tuple.
+    extra : object, optional
+        Anything else that affects the output, e.g., the output profile.
+
+    Returns
+    -------
+    str
+        The fingerprint.
+    """
+    function, _ = figure_spec
+    arguments, _ = figure_spec_output(figure_spec)
+    return fingerprint(function, arguments, extra, code_fingerprint(function))
+
+
+def load_figure_cache(cache_file = ".figure_cache.json"):
+    """
+    Load the figure cache manifest, mapping each output file path to the fingerprint of the
+    figure that produced it and to the hash of the file contents.
+    """
+    if not os.path.exists(cache_file):
+        return {}
+    with open(cache_file) as file:
+        return json.load(file)
+
+
+def save_figure_cache(manifest, cache_file = ".figure_cache.json"):
+    """
+    Save the figure cache manifest atomically.
+    """
+    temporary_file = cache_file + ".tmp"
+    with open(temporary_file, 'w') as file:
+        json.dump(manifest, file, indent=2, sort_keys=True)
+    os.replace(temporary_file, cache_file)
+
+
+def split_cached_figures(figure_specs, manifest, extra = None):
+    """
+    Split the figure specifications into cache hits and misses.
+
+    A figure is a hit if its fingerprint matches the one recorded for its output file, and the
+    output file still exists with the recorded contents.
+
+    Parameters
+    ----------
+    figure_specs : list
+        List of (function, kwargs) tuples.
+    manifest : dict
+        The figure cache manifest.
+    extra : object, optional
+        Anything else that affects the output, e.g., the output profile.
+
+    Returns
+    -------
+    tuple
+        The indices of the hits, the indices of the misses, and the fingerprints of all the figures.
+    """
+    hits, misses, fingerprints = [], [], []
+    for i, figure_spec in enumerate(figure_specs):
+        _, file_path = figure_spec_output(figure_spec)
+        file_path = output_file_path(file_path)
+        spec_fingerprint = figure_spec_fingerprint(figure_spec, extra)
+        fingerprints.append(spec_fingerprint)
+        entry = manifest.get(file_path)
+        if (entry is not None
+                and entry['fingerprint'] == spec_fingerprint
+                and entry['file_hash'] == file_fingerprint(file_path)):
+            hits.append(i)
+        else:
+            misses.append(i)
+    return hits, misses, fingerprints
+
+
+def record_rendered_figures(manifest, file_paths, fingerprints):
+    """
+    Record the fingerprints and the file hashes of freshly rendered figures in the manifest.
+    """
+    for file_path, spec_fingerprint in zip(file_paths, fingerprints):
+        manifest[file_path] = {'fingerprint': spec_fingerprint, 'file_hash': file_fingerprint(file_path)}
+    return manifest
+
+
+def report_figure_cache(figure_specs, hits, misses):
+    """
+    Print the cache hits and misses.
+    """
+    print(f"\nFigure cache: {len(hits)} hit(s), {len(misses)} miss(es)")
+    for label, indices in [('hit ', hits), ('miss', misses)]:
+        for i in indices:
+            print(f"  {label}  {output_file_path(figure_spec_output(figure_specs[i])[1])}")
+
+
+# Debug code: editing a helper of a plotting function, in another module, invalidates the figure
+if __name__ == "__main__":
+    import importlib
+    import sys
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as directory:
+        with open(os.path.join(directory, "helpers.py"), 'w') as file:
+            file.write("def annotation_offset():\n    return 0.1\n\ndef legend_offset():\n    return 0.5\n")
+        with open(os.path.join(directory, "plots.py"), 'w') as file:
+            file.write("import helpers\nfrom helpers import annotation_offset\n\n"
+                       "def plot(values, file_path = 'plot.pdf', show = False):\n    return annotation_offset()\n\n"
+                       "def other_plot(values, file_path = 'other_plot.pdf', show = False):\n    return helpers.legend_offset()\n")
+        sys.path.insert(0, directory)
+        plots = importlib.import_module("plots")
+        figure_spec = (plots.plot, dict(values = [1, 2, 3]))
+        other_figure_spec = (plots.other_plot, dict(values = [1, 2, 3]))
+        before, other_before = figure_spec_fingerprint(figure_spec), figure_spec_fingerprint(other_figure_spec)
+        assert figure_spec_fingerprint(figure_spec) == before
+        with open(os.path.join(directory, "helpers.py"), 'w') as file:
+            file.write("def annotation_offset():\n    return 0.25\n\ndef legend_offset():\n    return 0.5\n")
+        after, other_after = figure_spec_fingerprint(figure_spec), figure_spec_fingerprint(other_figure_spec)
+        print(f"Fingerprint before editing the helper: {before[:12]}, after: {after[:12]}")
+        assert after != before, "Editing a helper of the plotting function did not invalidate the figure."
+        assert other_after == other_before, "Editing a helper invalidated a figure which does not call it."
+        print("Editing a helper invalidates the figures calling it, and only them.")
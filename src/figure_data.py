@@ -0,0 +1,172 @@
+# Library imports
+import numpy as np
+import pandas as pd
+
+# Display names of the biomarkers in the figures. "★" marks the biomarkers with uniquely high levels.
+biomarker_display_names = {'sHER2/sEGFR2/sErbB2': 'sHER2', 'CA-125': 'CA-125 ★', 'CA19-9': 'CA19-9 ★', 'AFP': 'AFP ★'}
+
+# Biomarker groups sharing a y-axis range in FIG3
+biomarkers_0_to_200000_range = ['Prolactin', 'OPN', 'Myeloperoxidase', 'NSE', 'TIMP-1']
+biomarkers_0_to_10000_range = ['CYFRA 21-1', 'HE4', 'sEGFR', 'HGF', 'GDF15', 'sFas', 'sHER2', 'Midkine']
+biomarkers_TGFa = ['TGFa']
+biomarkers_0_to_200_range = ['IL-8', 'IL-6']
+biomarkers_AFP = ['AFP ★']
+
+
+def quartile_levels_dataframe(categories, dfs, importance_scores):
+    """
+    Q2 and Q3 levels of the biomarkers selected by the random forest classifiers, in every category.
+
+    Parameters
+    ----------
+    categories : list
+        The list of cancer types.
+    dfs : list
+        The list of dataframes corresponding to each cancer type.
+    importance_scores : list
+        The important biomarkers dataframes returned by `rf_normal_cancers`, one for each cancer type.
+
+    Returns
+    -------
+    pd.DataFrame
+        Long-format dataframe with the columns 'Biomarker' (display name), 'Level', 'Quartile' and 'Tumor_type'.
+    """
+    data_rows = []
+    rf_important_biomarkers = pd.concat(importance_scores, axis=0, ignore_index=True).iloc[:, 0].unique()
+    for biomarker in rf_important_biomarkers:
+        for i, cancer_type in enumerate(categories):
+            Q2, Q3 = dfs[i][biomarker].quantile([0.5, 0.75])
+            data_rows.append([biomarker, Q2, 'Q2', cancer_type])
+            data_rows.append([biomarker, Q3, 'Q3', cancer_type])
+            
+    columns = ['Biomarker', 'Level', 'Quartile', 'Tumor_type']
+    return pd.DataFrame(data_rows, columns=columns).replace(biomarker_display_names)
+
+
+def boxplot_dataframes(cv_boxplot_df):
+    """
+    Split the quartile levels into the six FIG3 panels, by the range of the biomarker levels.
+
+    Parameters
+    ----------
+    cv_boxplot_df : pd.DataFrame
+        The dataframe returned by `quartile_levels_dataframe`.
+
+    Returns
+    -------
+    list
+        The six dataframes, in panel order.
+    """
+    biomarker_sets_together = biomarkers_0_to_200000_range + biomarkers_0_to_10000_range + biomarkers_TGFa + biomarkers_0_to_200_range + biomarkers_AFP
+    cv_boxplot_df_1 = cv_boxplot_df[cv_boxplot_df['Biomarker'].isin(biomarkers_0_to_200000_range)]
+    cv_boxplot_df_2 = cv_boxplot_df[cv_boxplot_df['Biomarker'].isin(biomarkers_0_to_10000_range)]
+    cv_boxplot_df_TGFa = cv_boxplot_df[cv_boxplot_df['Biomarker'].isin(biomarkers_TGFa)]
+    cv_boxplot_df_added = cv_boxplot_df[cv_boxplot_df['Biomarker'].isin(biomarkers_0_to_200_range)]
+    cv_boxplot_df_3 = cv_boxplot_df[~cv_boxplot_df['Biomarker'].isin(biomarker_sets_together)]
+    cv_boxplot_df_4 = cv_boxplot_df[cv_boxplot_df['Biomarker'].isin(biomarkers_AFP)]
+    return [cv_boxplot_df_1, cv_boxplot_df_TGFa, cv_boxplot_df_added, cv_boxplot_df_3, cv_boxplot_df_2, cv_boxplot_df_4]
+
+
+def q3_rank_dataframe(categories, cv_boxplot_df, importance_scores):
+    """
+    Q3 ranks of the important biomarkers in their own tumor types, for the tumor types with the top 3 Q3 levels.
+
+    Parameters
+    ----------
+    categories : list
+        The list of cancer types.
+    cv_boxplot_df : pd.DataFrame
+        The dataframe returned by `quartile_levels_dataframe`.
+    importance_scores : list
+        The important biomarkers dataframes returned by `rf_normal_cancers`, one for each cancer type.
+
+    Returns
+    -------
+    pd.DataFrame
+        Dataframe with the columns 'Tumor_type', 'Biomarker', 'Q3_rank' and 'Weight' (4 - rank).
+    """
+    q3_df = cv_boxplot_df[cv_boxplot_df['Quartile']=='Q3'].reset_index(drop=True)
+    important_biomarkers = q3_df.Biomarker.unique()
+    biomarker_q3_rank_list = []
+    for biomarker in important_biomarkers:
+        biomarker_q3_df = q3_df[q3_df['Biomarker'] == biomarker].sort_values(by='Level', ascending=False).reset_index(drop=True)
+        row = [biomarker, (biomarker_q3_df.iloc[0].Tumor_type, biomarker_q3_df.iloc[1].Tumor_type, biomarker_q3_df.iloc[2].Tumor_type)]
+        biomarker_q3_rank_list.append(row)
+    biomarkers_q3_rank_df = pd.DataFrame(data=biomarker_q3_rank_list, columns=['Biomarker', 'Tumor_types_first_three_Q3']).set_index('Biomarker')
+
+    cancer_types = categories.copy()
+    cancer_types.remove('Normal')
+
+    higher_side_data_rows = []
+    for i, tumor_type in enumerate(cancer_types):
+        important_biomarkers_for_this_tumor_type = importance_scores[i].Biomarker.replace(biomarker_display_names)
+        for biomarker in important_biomarkers_for_this_tumor_type:
+            ranked_tumor_types_for_this_biomarker = list(biomarkers_q3_rank_df.loc[biomarker])[0]
+            if tumor_type in ranked_tumor_types_for_this_biomarker:
+                q3_rank = ranked_tumor_types_for_this_biomarker.index(tumor_type) + 1
+                row = [tumor_type, biomarker, q3_rank]
+                higher_side_data_rows.append(row)
+
+    columns = ['Tumor_type', 'Biomarker', 'Q3_rank']
+    higher_side_data_rows_df = pd.DataFrame(data=higher_side_data_rows, columns=columns)
+    higher_side_data_rows_df['Weight'] = 4-higher_side_data_rows_df['Q3_rank']
+    return higher_side_data_rows_df
+
+
+def normalized_quartile_levels(cv_boxplot_df, finalized_biomarkers):
+    """
+    Q2 and Q3 levels of the finalized biomarkers, min-max normalized within each biomarker.
+
+    Parameters
+    ----------
+    cv_boxplot_df : pd.DataFrame
+        The dataframe returned by `quartile_levels_dataframe`.
+    finalized_biomarkers : list
+        Display names of the finalized biomarkers.
+
+    Returns
+    -------
+    tuple
+        The normalized Q2 and Q3 levels, as biomarker x tumor type dataframes.
+    """
+    df = cv_boxplot_df[cv_boxplot_df['Biomarker'].isin(finalized_biomarkers)]
+
+    # Pivot the data for Q2 and Q3 separately
+    df_q2 = df[df["Quartile"] == "Q2"].pivot(index="Biomarker", columns="Tumor_type", values="Level")
+    df_q3 = df[df["Quartile"] == "Q3"].pivot(index="Biomarker", columns="Tumor_type", values="Level")
+
+    # Min-max normalization within each biomarker
+    df_q2_norm = df_q2.apply(lambda x: (x - x.min()) / (x.max() - x.min()), axis=1)
+    df_q3_norm = df_q3.apply(lambda x: (x - x.min()) / (x.max() - x.min()), axis=1)
+
+    df_q2_norm.rename(columns={'Normal':'Healthy'}, inplace=True)
+    df_q3_norm.rename(columns={'Normal':'Healthy'}, inplace=True)
+    return df_q2_norm, df_q3_norm
+
+
+def mdi_convergence(file_path = "feature_importance_list_Normal_Ovary.csv"):
+    """
+    Cumulative mean of the MDI scores over the iterations, and its mean change between successive iterations.
+
+    Parameters
+    ----------
+    file_path : str, optional
+        The feature importance list saved by `rf_normal_cancers` (default is the Normal + Ovary one).
+
+    Returns
+    -------
+    tuple
+        The cumulative mean dataframe (iterations x biomarkers) and the mean absolute change series.
+    """
+    # Load the CSV file, skipping the first row
+    df = pd.read_csv(file_path, skiprows=1)
+
+    # Convert columns to numeric (in case they are read as strings)
+    df = df.apply(pd.to_numeric)
+
+    # Compute cumulative mean for each biomarker (column-wise)
+    cumulative_mean = df.expanding().mean()
+
+    # Compute change in mean between successive iterations
+    delta_mean = cumulative_mean.diff().abs().mean(axis=1)
+    return cumulative_mean, delta_mean
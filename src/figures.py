@@ -0,0 +1,469 @@
+# Library imports
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+import matplotlib.pyplot as plt
+from matplotlib.gridspec import GridSpec
+import seaborn as sns
+
+#  Project imports
+from instrumentation import span, enable_tracing, tracing_enabled, reset_trace, trace_events, extend_trace
+from output_profiles import save_figure, get_output_profile, set_output_profile, output_file_path
+from figure_cache import figure_spec_output, load_figure_cache, save_figure_cache, split_cached_figures, record_rendered_figures, report_figure_cache
+
+# Colorblind-friendly colors, one for each cancer type
+cbf_colors = ['#0072B2', '#E69F00', '#009E73', '#D55E00', '#CC79A7', '#F0E442', '#56B4E9', '#999999']
+
+
+def finish_figure(fig, file_path, show = False):
+    """
+    Save the figure, then either display it or close it.
+
+    Parameters
+    ----------
+    fig : matplotlib.figure.Figure
+        The figure.
+    file_path : str
+        The path of the file. Its extension follows the active output profile.
+    show : bool, optional
+        Whether to display the figure (default is False). In batch mode the figure is closed instead.
+
+    Returns
+    -------
+    str
+        The path of the saved file.
+    """
+    file_path = save_figure(fig, file_path)
+    if show:
+        plt.show()
+    else:
+        plt.close(fig)
+    return file_path
+
+
+def plot_important_biomarkers_grid(importance_scores, categories, file_path = "FIG2.pDF", show = False):
+    """
+    FIG2: bar plots of the important biomarkers of each cancer type, based on the MDI scores.
+    """
+    fig, axs = plt.subplots(2, 4, figsize=(12, 6), sharey=True, constrained_layout=True)
+    for i, ax in enumerate(axs.flatten()):
+        sns.barplot(data=importance_scores[i], x="Biomarker", y="Importance", ax=ax, color=cbf_colors[i])
+        plt.setp(ax.get_xticklabels(), rotation=45, horizontalalignment='right')
+        ax.set_xlabel('')
+        ax.set_ylabel('Importance', fontsize=18)
+        ax.tick_params(axis='both', which='major', labelsize=14)
+        ax.tick_params(axis='both', which='minor', labelsize=12)
+        if i<5:
+            ax.set_title(f'{categories[i]}', fontsize=18)
+        else:
+            ax.set_title(f'{categories[i+1]}', fontsize=18)
+
+    # fig.suptitle(f"Important biomarkers in Random Forest classification based on MDI scores (cutoff 0.04)\n", fontsize=14)
+    return finish_figure(fig, file_path, show)
+
+
+# Offsets (in points) of the FIG3 outlier labels, by quartile, biomarker and tumor type.
+# None matches any biomarker or tumor type; the most specific matching rule wins.
+annotation_offsets = pd.DataFrame([
+    ('Q2', 'TGFa', 'Esophagus', -95, 5),
+    ('Q2', 'TGFa', None, -60, 14),
+    ('Q2', 'AFP ★', 'Liver', -55, 14),
+    ('Q2', 'AFP ★', None, -80, 6),
+    ('Q2', 'IL-6', None, -70, 5),
+    ('Q2', 'CA-125 ★', None, -55, 4),
+    ('Q2', 'NSE', None, -52, 6),
+    ('Q2', None, None, -35, 6),
+    ('Q3', 'Midkine', None, -28, 5),
+    ('Q3', 'AFP ★', None, 10, 5),
+    ('Q3', None, None, 1, 6),
+], columns=['Quartile', 'Biomarker', 'Tumor_type', 'dx', 'dy'])
+
+
+def outlier_annotations(boxplot_dfs, offsets_df = annotation_offsets):
+    """
+    Find the outlier tumor types of every (biomarker, quartile) box, i.e., the levels above the upper
+    fence Q3 + 1.5 IQR of the box, and look up their label offsets. All the groups of all the
+    panels are handled in one grouped, vectorized pass.
+
+    Parameters
+    ----------
+    boxplot_dfs : list
+        The FIG3 panel dataframes returned by `figure_data.boxplot_dataframes`.
+    offsets_df : pd.DataFrame, optional
+        The label offset rules (default is `annotation_offsets`).
+
+    Returns
+    -------
+    pd.DataFrame
+        One row per outlier, with the columns 'Panel', 'Biomarker', 'Quartile', 'Tumor_type',
+        'Level', 'dx' and 'dy'.
+    """
+    levels_df = pd.concat(boxplot_dfs, keys=range(len(boxplot_dfs)), names=['Panel']).reset_index(level='Panel')
+    grouped_levels = levels_df.groupby(['Panel', 'Biomarker', 'Quartile'], sort=False)['Level']
+    q1 = grouped_levels.transform('quantile', 0.25)
+    q3 = grouped_levels.transform('quantile', 0.75)
+    upper_bound = q3 + 1.5 * (q3 - q1)
+    outliers_df = levels_df.loc[levels_df['Level'] > upper_bound, ['Panel', 'Biomarker', 'Quartile', 'Tumor_type', 'Level']]
+    outliers_df = outliers_df.reset_index(drop=True)
+
+    # Look up the offsets, from the most specific rules to the least specific ones
+    outliers_df['dx'] = np.nan
+    outliers_df['dy'] = np.nan
+    for keys in [['Quartile', 'Biomarker', 'Tumor_type'], ['Quartile', 'Biomarker'], ['Quartile']]:
+        other_keys = [key for key in ['Biomarker', 'Tumor_type'] if key not in keys]
+        rules = offsets_df[offsets_df[keys].notna().all(axis=1) & offsets_df[other_keys].isna().all(axis=1)]
+        matched = outliers_df[keys].merge(rules[keys + ['dx', 'dy']], on=keys, how='left')
+        unset = outliers_df['dx'].isna().to_numpy()
+        outliers_df.loc[unset, ['dx', 'dy']] = matched.loc[unset, ['dx', 'dy']].to_numpy()
+    return outliers_df
+
+
+def thin_annotations(annotations_df, ax, min_separation = 0.03):
+    """
+    Drop the outlier labels that would overlap a higher label of the same box.
+
+    Parameters
+    ----------
+    annotations_df : pd.DataFrame
+        The outliers of one panel, as returned by `outlier_annotations`.
+    ax : matplotlib.axes.Axes
+        The axes of the panel, with its final y-limits.
+    min_separation : float, optional
+        Minimum vertical distance between two labels of the same box, as a fraction of the axes
+        height (default is 0.03).
+
+    Returns
+    -------
+    pd.DataFrame
+        The kept outliers.
+    """
+    bottom, top = ax.get_ylim()
+    annotations_df = annotations_df.sort_values(['Biomarker', 'Quartile', 'Level'], ascending=[True, True, False])
+    height = ((annotations_df['Level'] - bottom) / (top - bottom)).to_numpy()
+    box = (annotations_df['Biomarker'] + '|' + annotations_df['Quartile']).to_numpy()
+    keep = np.ones(len(annotations_df), dtype=bool)
+    last_kept = None
+    for j in range(len(annotations_df)):
+        if last_kept is not None and box[j] == box[last_kept] and height[last_kept] - height[j] < min_separation:
+            keep[j] = False
+        else:
+            last_kept = j
+    return annotations_df[keep]
+
+
+def annotate_outliers(ax, annotations_df, fontsize = 12, color = 'blue'):
+    """
+    Add the outlier labels of one panel.
+    """
+    for biomarker, level, tumor_type, dx, dy in zip(annotations_df['Biomarker'], annotations_df['Level'], annotations_df['Tumor_type'],
+                                                    annotations_df['dx'], annotations_df['dy']):
+        ax.annotate(f"{tumor_type}", 
+                    xy=(biomarker, level), 
+                    xytext=(dx, dy), 
+                    textcoords="offset points", 
+                    fontsize=fontsize, 
+                    color=color)
+
+
+def plot_quartile_boxplots(boxplot_dfs, file_path = "FIG3.pDF", min_label_separation = None, show = False):
+    """
+    FIG3: box plots of the Q2 and Q3 levels of the biomarkers across the cancer types, with the
+    outlier tumor types annotated. With `min_label_separation` (a fraction of the axes height),
+    overlapping outlier labels are thinned by `thin_annotations`.
+    """
+    # Create figure with flexible layout
+    fig = plt.figure(figsize=(12, 12), constrained_layout = True)
+    gs = GridSpec(3, 20, figure=fig)
+    text_font_size = 12
+
+    # Define subplots (6:4 width ratio for the first row, 8:2 width ratio for the second row)
+    ax1 = fig.add_subplot(gs[0, :13])  # First row, first subplot (occupying 6 columns)
+    ax2 = fig.add_subplot(gs[0, 14:])
+    ax3 = fig.add_subplot(gs[1, :8])
+    ax4 = fig.add_subplot(gs[1, 10:])  # First row, second subplot (occupying 4 columns)
+    ax5 = fig.add_subplot(gs[2, :13])  # Second row, first subplot (occupying 8 columns)
+    ax6 = fig.add_subplot(gs[2, 15:])  # Second row, second subplot (occupying 2 columns)
+
+    ax2.set_ylim(bottom=15, top=52)
+    ax4.set_ylim(top=550)
+    ax5.set_ylim(top=17500)
+    ax6.set_ylim(top=650000)
+
+    axs = [ax1, ax2, ax3, ax4, ax5, ax6]
+
+    for i, ax in enumerate(axs):
+        # sns.stripplot(data=boxplot_dfs[i], x = 'Biomarker', y = 'Level',  hue = 'Quartile', dodge=True, jitter=False, ax=ax)
+        sns.boxplot(data=boxplot_dfs[i], x = 'Biomarker', y = 'Level',  hue = 'Quartile', ax=ax)
+        ax.set_xlabel('')
+        ax.tick_params(axis='x', labelsize=12)
+        # ax.spines['top'].set_visible(False)
+
+    # Add outlier annotations, computed for all the panels in one grouped pass
+    annotations_df = outlier_annotations(boxplot_dfs)
+    for i, ax in enumerate(axs):
+        panel_annotations_df = annotations_df[annotations_df['Panel'] == i]
+        if min_label_separation is not None:
+            panel_annotations_df = thin_annotations(panel_annotations_df, ax, min_label_separation)
+        annotate_outliers(ax, panel_annotations_df, fontsize=text_font_size)
+
+    handles, labels = axs[0].get_legend_handles_labels()
+    fig.legend(handles, labels, loc='lower center', ncol=3, fontsize=12, bbox_to_anchor=(0.5, 0.04))
+    # Completely remove legends from all subplots
+    for ax in axs:
+        ax.get_legend().remove()  
+        
+    # Add explanatory text at the bottom to indicate what "★" means
+    fig.text(0.5, 0.02, f'★ indicates biomarkers with \"uniquely high levels\" in the corresponding tumor type,\n as determined by the MAD-based outlier detection criteria', ha='center', va='center', fontsize=12, color='black')
+    # fig.suptitle("Q2 and Q3 levels of the biomarkers across cancer types\n")
+
+
+    return finish_figure(fig, file_path, show)
+
+
+def plot_q3_rank_pies(higher_side_data_rows_df, file_path = "FIG4.pDF", show = False):
+    """
+    FIG4: pie charts of the Q3 level ranks of the biomarkers in their respective cancer types.
+    """
+    # Create your figure and axes
+    fig, axs = plt.subplots(2, 3, figsize=(12, 6), constrained_layout=True)
+    axs = axs.flatten()
+
+    # Get all unique tumor types
+    tumor_types = higher_side_data_rows_df.Tumor_type.unique()
+
+    # Get all unique Weight values and assign a color to each Weight for consistency
+    unique_ranks = sorted(higher_side_data_rows_df.Q3_rank.unique())
+    colors = plt.cm.Paired(np.linspace(0, 1, len(unique_ranks)))  # Generate colors
+    weight_color_map = dict(zip(unique_ranks, colors))  # Map Weight values to colors
+    rank_color_map = dict(zip(unique_ranks, colors[::-1]))
+
+    for i, tumor_type in enumerate(tumor_types):
+        tumor_type_filtered_df = higher_side_data_rows_df[
+            higher_side_data_rows_df['Tumor_type'] == tumor_type
+        ].reset_index(drop=True)
+        ax = axs[i]
+        
+        # Extract weights and assign colors based on the weight->color map
+        weights = tumor_type_filtered_df.Weight
+        pie_colors = [weight_color_map[w] for w in weights]
+
+        # Plot the pie chart
+        ax.pie(weights, 
+            labels=tumor_type_filtered_df.Biomarker, 
+            colors=pie_colors, 
+            wedgeprops={'edgecolor': 'black', 'linewidth': 0.5},
+            textprops = {'fontsize':14})
+        ax.set_title(tumor_type, fontsize=16, fontdict={'color':'indigo'})
+
+    # Create a shared legend for unique Weight values
+    legend_elements = [
+        plt.Line2D(
+            [0], [0], marker='o', color=rank_color_map[r], linestyle='', markersize=10, label=f"Rank {r}"
+        )
+        for r in unique_ranks
+    ]
+
+    # Add the legend to the figure
+    fig.legend(
+        handles=legend_elements, 
+        title="Q3 level rank",
+        title_fontsize=18, 
+        fontsize=16,
+        loc='upper center', 
+        bbox_to_anchor=(0.5, -0.05), 
+        ncol=3
+    )
+
+    # fig.suptitle("Q3 ranks of the biomarkers (tumor types with the top 3 Q3 levels are considered)\n")
+    return finish_figure(fig, file_path, show)
+
+
+def plot_shared_nature_heatmaps(heatmap_shared_natures, titles, file_path = "FIG5.pDF", show = False):
+    """
+    FIG5: heatmaps of the Yuen-Welch's test p-values of the selected biomarkers of six cancer types,
+    against all the other categories. The titles are the cancer types, since the `name` attribute
+    of the dataframes does not survive pickling to the rendering processes.
+    """
+    # Define threshold and colormap bounds
+    vmin = 0  # Minimum value
+    vmax = 1  # Maximum value
+    threshold = 0.05
+
+    # Enhanced colormap to emphasize threshold
+    cmap = sns.diverging_palette(250, 30, l=65, as_cmap=True)  # Custom continuous colormap
+
+    # Create figure with flexible layout
+    fig = plt.figure(figsize=(16, 12), constrained_layout=True)
+    gs = GridSpec(10, 2, figure=fig)
+
+    # Define subplots
+    ax1 = fig.add_subplot(gs[:4, 0])  # First col, first subplot
+    ax2 = fig.add_subplot(gs[4:8, 0])  # First col, second subplot
+    ax3 = fig.add_subplot(gs[8:, 0])  # First col, third subplot
+    ax4 = fig.add_subplot(gs[:3, 1])  # Second col, first subplot
+    ax5 = fig.add_subplot(gs[3:7, 1])  # Second col, second subplot
+    ax6 = fig.add_subplot(gs[7:, 1])  # Second col, third subplot
+
+    axs = [ax1, ax2, ax3, ax4, ax5, ax6]
+
+    # Plot heatmaps
+    for ax, df, title in zip(axs, heatmap_shared_natures, titles):
+        df = df.rename(index={'AFP':'AFP ★', 'CA19-9 ':'CA19-9 ★', 'CA-125':'CA-125 ★', 'sHER2/sEGFR2/sErbB2': 'sHER2 ', 'Myeloperoxidase':'MPO'},
+                       columns={'Normal':'Healthy'})
+        sns.heatmap(
+            df, 
+            # annot=True, # For including actual p-values in each cell 
+            annot=False, # For not having actual p-values in each cell
+            ax=ax, 
+            vmin=vmin, 
+            vmax=vmax, 
+            cmap=cmap, 
+            linewidths=0.1,
+            cbar=False  # Disable individual colorbars
+        )
+        ax.set_title(title, fontsize=18, fontdict={'fontweight':'heavy', 'color':'indigo'})
+        ax.tick_params(axis='x', labelsize=14, labelrotation=20)
+        ax.tick_params(axis='y', labelsize=16, labelrotation=60)
+
+    # Add shared colorbar
+    cbar_ax = fig.add_axes([1.02, 0.2, 0.03, 0.6])  # [left, bottom, width, height]
+    sm = plt.cm.ScalarMappable(cmap=cmap, norm=plt.Normalize(vmin=vmin, vmax=vmax))
+    cbar = fig.colorbar(sm, cax=cbar_ax)
+
+    # Customize the colorbar to mark the threshold
+    cbar.set_label("Shared Scale (Threshold: 0.05)", fontsize=16)
+    cbar.ax.tick_params(labelsize=16)
+
+    # Annotate the color legend to emphasize regions below/above the threshold
+    cbar.ax.hlines(y=threshold, xmin=0, xmax=1, colors="red", lw=2, label=f"Threshold \n {threshold}")
+    cbar.ax.legend(loc="lower left", frameon=False, fontsize=16)
+
+    # fig.suptitle("Shared nature of biomarkers indicated by p-values (threshold = 0.05)\n", fontsize=20)
+    return finish_figure(fig, file_path, show)
+
+
+def plot_quartile_heatmap(df_norm, file_path = "q2_heatmap.pdf", show = False):
+    """
+    Heatmap of the normalized Q2 (or Q3) levels of the finalized biomarkers across the tumor types.
+    """
+    fig, ax = plt.subplots()
+    sns.heatmap(df_norm,
+                cmap="coolwarm",
+                annot=False,
+                linewidths=0.5,
+                ax=ax)
+    ax.set_xlabel("Tumor type", fontsize=18)
+    ax.set_ylabel("Biomarker", fontsize=18)
+    ax.tick_params(axis='x', labelsize=14, labelrotation=90)
+    ax.tick_params(axis='y', labelsize=14)
+    # Customize the colorbar fontsize
+    colorbar = ax.collections[0].colorbar  # Access the colorbar
+    colorbar.ax.tick_params(labelsize=14)  # Set tick label size
+    fig.tight_layout()
+    return finish_figure(fig, file_path, show)
+
+
+def plot_mdi_convergence(cumulative_mean, biomarker_indices, biomarker_labels, file_path = "normal_ovary_convergence_of_MDI_scores.pDF", show = False):
+    """
+    Cumulative mean of the MDI scores of the given biomarkers over the iterations.
+    """
+    fig, ax = plt.subplots(figsize=(10, 6))
+    # Plot only the specified biomarkers
+    for index, label in zip(biomarker_indices, biomarker_labels):
+        col = cumulative_mean.columns[index]  # Get the column name corresponding to the index
+        ax.plot(cumulative_mean.index, cumulative_mean[col], label=label)
+
+    ax.set_xlabel("Iteration", fontsize=18)
+    ax.set_ylabel("Cumulative Mean MDI", fontsize=18)
+    # ax.set_title("Convergence of MDI Scores Over Iterations")
+    ax.legend(fontsize=12)
+    ax.grid(alpha=0.5)
+    return finish_figure(fig, file_path, show)
+
+
+def plot_mdi_stability(delta_mean, file_path = "normal_ovary_stability_of_cumulative_mean_MDI_scores.pDF", show = False):
+    """
+    Mean change of the cumulative mean MDI scores between successive iterations.
+    """
+    fig, ax = plt.subplots(figsize=(10, 6))
+    ax.plot(delta_mean, color="red", label="Mean Change Across Biomarkers")
+    ax.set_xlabel("Iteration", fontsize=18)
+    ax.set_ylabel("Change in Mean", fontsize=18)
+    # ax.set_title("Stability of Cumulative Mean MDI Scores")
+    ax.axhline(y=0.001, color="gray", linestyle="--", label="Threshold (0.001)")
+    ax.legend(fontsize=12)
+    ax.grid(alpha=0.5)
+    return finish_figure(fig, file_path, show)
+
+
+def _render_figure(figure_spec):
+    # Rendered in a worker process: the spans recorded there are returned to the parent process
+    function, kwargs = figure_spec
+    reset_trace()
+    with span(function.__name__, 'figure'):
+        file_path = function(**kwargs, show=False)
+    events = trace_events()
+    reset_trace()
+    return file_path, events
+
+
+def _use_headless_backend(output_profile, trace = False):
+    plt.switch_backend('Agg')
+    set_output_profile(output_profile)
+    enable_tracing(trace)
+
+
+def render_figures(figure_specs, batch = True, max_workers = None, cache = True, cache_file = ".figure_cache.json"):
+    """
+    Render the given figures.
+
+    Parameters
+    ----------
+    figure_specs : list
+        List of (function, kwargs) tuples. Each function is a module-level plotting function that
+        takes the prepared data in kwargs, plus `show`, saves its figure and returns the file path.
+    batch : bool, optional
+        If True (default), render all the figures concurrently in a process pool on the headless
+        Agg backend, without displaying them. If False, render them one by one and display each.
+    max_workers : int, optional
+        Number of worker processes in batch mode (default is the number of figures, capped at the
+        number of CPUs).
+    cache : bool, optional
+        If True (default), skip the figures whose input data, styling parameters and plotting
+        function are unchanged since the recorded rendering of their output file, provided the
+        output file is unchanged too. The hits and misses are reported.
+    cache_file : str, optional
+        The figure cache manifest (default is ".figure_cache.json").
+
+    Returns
+    -------
+    list
+        The paths of the output files, in the order of the figure specifications. The files are
+        written according to the active output profile (see `output_profiles`).
+    """
+    output_profile = get_output_profile()
+    file_paths = [output_file_path(figure_spec_output(figure_spec)[1]) for figure_spec in figure_specs]
+    if cache:
+        manifest = load_figure_cache(cache_file)
+        hits, misses, fingerprints = split_cached_figures(figure_specs, manifest, extra=output_profile)
+        report_figure_cache(figure_specs, hits, misses)
+    else:
+        misses = list(range(len(figure_specs)))
+    specs_to_render = [figure_specs[i] for i in misses]
+
+    if not batch:
+        for function, kwargs in specs_to_render:
+            with span(function.__name__, 'figure'):
+                function(**kwargs, show=True)
+    elif len(specs_to_render) > 0:
+        if max_workers is None:
+            max_workers = min(len(specs_to_render), os.cpu_count() or 1)
+        with ProcessPoolExecutor(max_workers=max_workers, initializer=_use_headless_backend, initargs=(output_profile, tracing_enabled())) as executor:
+            for _, events in executor.map(_render_figure, specs_to_render):
+                extend_trace(events)
+
+    if cache:
+        record_rendered_figures(manifest, [file_paths[i] for i in misses], [fingerprints[i] for i in misses])
+        save_figure_cache(manifest, cache_file)
+    return file_paths
@@ -0,0 +1,168 @@
+# Library imports
+import hashlib
+import inspect
+import linecache
+import os
+import pickle
+import sys
+import sysconfig
+import numpy as np
+import pandas as pd
+
+
+def _update(digest, obj):
+    # Feed a type tag and a canonical byte representation of obj into the digest
+    if isinstance(obj, pd.DataFrame):
+        digest.update(b'DataFrame')
+        _update(digest, [str(column) for column in obj.columns])
+        _update(digest, [str(dtype) for dtype in obj.dtypes])
+        digest.update(pd.util.hash_pandas_object(obj, index=True).to_numpy().tobytes())
+    elif isinstance(obj, pd.Series):
+        digest.update(b'Series')
+        _update(digest, [str(obj.name), str(obj.dtype)])
+        digest.update(pd.util.hash_pandas_object(obj, index=True).to_numpy().tobytes())
+    elif isinstance(obj, pd.Index):
+        digest.update(b'Index')
+        digest.update(pd.util.hash_pandas_object(obj).to_numpy().tobytes())
+    elif isinstance(obj, np.ndarray):
+        digest.update(b'ndarray')
+        digest.update(f"{obj.dtype.str}{obj.shape}".encode())
+        if obj.dtype.hasobject:
+            _update(digest, obj.tolist())
+        else:
+            digest.update(np.ascontiguousarray(obj).tobytes())
+    elif isinstance(obj, dict):
+        digest.update(b'dict')
+        for key in sorted(obj, key=repr):
+            _update(digest, key)
+            _update(digest, obj[key])
+    elif isinstance(obj, (list, tuple)):
+        digest.update(type(obj).__name__.encode())
+        digest.update(str(len(obj)).encode())
+        for item in obj:
+            _update(digest, item)
+    elif inspect.isfunction(obj):
+        # Functions are identified by their name and source code, so that editing
+        # a function (e.g., the styling of a figure) changes its fingerprint
+        digest.update(b'function')
+        digest.update(f"{obj.__module__}.{obj.__qualname__}".encode())
+        try:
+            digest.update(inspect.getsource(obj).encode())
+        except (OSError, TypeError):
+            pass
+    elif obj is None or isinstance(obj, (bool, int, float, str, bytes, np.generic)):
+        digest.update(type(obj).__name__.encode())
+        digest.update(repr(obj).encode())
+    else:
+        digest.update(type(obj).__name__.encode())
+        digest.update(pickle.dumps(obj))
+
+
+def fingerprint(*objs):
+    """
+    Content hash of the given objects.
+
+    DataFrames, Series and arrays are hashed by their values, dtypes and labels; containers
+    recursively; functions by their qualified name and source code; anything else by its pickle.
+
+    Parameters
+    ----------
+    *objs
+        The objects to hash.
+
+    Returns
+    -------
+    str
+        The hexadecimal SHA-256 digest.
+    """
+    digest = hashlib.sha256()
+    for obj in objs:
+        _update(digest, obj)
+    return digest.hexdigest()
+
+
+def file_fingerprint(file_path, chunk_size = 1 << 20):
+    """
+    SHA-256 digest of the contents of the given file, or None if it does not exist.
+    """
+    try:
+        with open(file_path, 'rb') as file:
+            digest = hashlib.sha256()
+            for chunk in iter(lambda: file.read(chunk_size), b''):
+                digest.update(chunk)
+    except FileNotFoundError:
+        return None
+    return digest.hexdigest()
+
+
+# The directories of the installed packages and of the standard library, whose functions are left
+# out of the code fingerprints
+_library_paths = tuple(os.path.realpath(path) + os.sep for path in {sysconfig.get_paths()[key] for key in ('stdlib', 'platstdlib', 'purelib', 'platlib')})
+
+
+# The module-level values hashed with the functions reading them
+_value_types = (type(None), bool, int, float, str, bytes, list, tuple, dict, np.ndarray, np.generic, pd.DataFrame, pd.Series, pd.Index)
+
+
+def _is_project_object(obj):
+    # Whether a function or module is defined in a source file of the project, as opposed to an
+    # installed package or the standard library
+    module = obj if inspect.ismodule(obj) else sys.modules.get(getattr(obj, '__module__', None))
+    file_path = getattr(module, '__file__', None)
+    return file_path is not None and file_path.endswith('.py') and not os.path.realpath(file_path).startswith(_library_paths)
+
+
+def _code_names(code):
+    # The global and attribute names used by a code object and by the functions, lambdas and
+    # comprehensions defined within it
+    names = set(code.co_names)
+    for const in code.co_consts:
+        if inspect.iscode(const):
+            names |= _code_names(const)
+    return names
+
+
+def _function_source(function):
+    # The source of a function as currently on disk, with its default arguments
+    linecache.checkcache(function.__code__.co_filename)
+    return fingerprint(function, function.__defaults__, function.__kwdefaults__)
+
+
+def code_fingerprint(*functions):
+    """
+    Content hash of the source of the given functions and of the project helpers they reference,
+    directly or not: the functions they call (e.g., the styling of an annotation called by a
+    plotting function, or `rf_normal_cancers` called by a screening stage) and the public
+    module-level values they read (e.g., the offsets of the annotations of a figure).
+
+    Only what a function references is hashed, not the rest of its module, so editing one
+    plotting function or one stage leaves the hash of the others unchanged. The functions of
+    installed packages, the modules and the private (underscore) module-level state, such as
+    caches, are left out, as are the module-level objects other than plain values (numbers,
+    strings, containers, arrays and dataframes).
+    """
+    pending = [function for function in functions if inspect.isfunction(function)]
+    digests = {}
+    while pending:
+        function = inspect.unwrap(pending.pop())
+        name = f"{function.__module__}.{function.__qualname__}"
+        if name in digests or not _is_project_object(function):
+            continue
+        digests[name] = _function_source(function)
+        names = _code_names(function.__code__)
+        # The namespaces in which the names are resolved: the globals of the function, and the
+        # project modules it uses, as `module.helper` or imported within the function
+        namespaces = [function.__globals__]
+        for module_name in names:
+            module = function.__globals__.get(module_name, sys.modules.get(module_name))
+            if inspect.ismodule(module) and _is_project_object(module):
+                namespaces.append(vars(module))
+        for namespace in namespaces:
+            module_name = namespace.get('__name__')
+            for referenced_name in names & namespace.keys():
+                value = namespace[referenced_name]
+                if inspect.isfunction(value):
+                    pending.append(value)
+                elif isinstance(value, _value_types) and not referenced_name.startswith('_'):
+                    digests.setdefault(f"{module_name}.{referenced_name}", fingerprint(value))
+    return fingerprint(sorted(digests.items()))
@@ -0,0 +1,306 @@
+# Library imports
+import json
+import zipfile
+import numpy as np
+
+# A compact format of the fitted random forests: the nodes of all the trees of a forest in a few
+# contiguous arrays (the feature, the threshold, the two children and the missing value direction
+# of every node, and the class probabilities of every leaf), with the leaves pointing to
+# themselves. The predictions are then a batched traversal of all the (tree, sample) pairs at
+# once in NumPy, with the same comparisons as scikit-learn, so they match `predict_proba`, without
+# its per-call dispatch of the trees to a thread pool, which dominates for small batches.
+#
+# Above this number of samples per call, the compiled traversal of scikit-learn is faster than
+# the batched traversal in NumPy, its dispatch overhead being amortized
+flat_max_samples = 1024
+
+# The forests are saved in an uncompressed .npz file, which can be memory-mapped: loading then
+# only reads the zip directory, and the pages of the arrays are read as the trees are traversed.
+
+
+def _round_down_to_float32(threshold):
+    # scikit-learn compares float32 levels with float64 thresholds: for a float32 level x,
+    # x <= threshold exactly when x is at most the largest float32 not above the threshold
+    rounded = threshold.astype(np.float32)
+    above = rounded.astype(np.float64) > threshold
+    rounded[above] = np.nextafter(rounded[above], np.float32(-np.inf))
+    return rounded
+
+
+def flatten_forest(model):
+    """
+    Flatten a fitted random forest (or a single decision tree) of scikit-learn into contiguous
+    arrays.
+
+    Parameters
+    ----------
+    model : RandomForestClassifier or DecisionTreeClassifier
+        The fitted classifier.
+
+    Returns
+    -------
+    dict
+        The arrays of the nodes of all the trees, in the order of the trees: 'feature' (int32),
+        'threshold' (float32), 'children' (int32, the right and the left child of every node,
+        the leaves pointing to themselves), 'missing_left' (bool), 'is_leaf' (bool) and 'value'
+        (the class probabilities of the leaves, float64), with the first node of every tree
+        ('roots'), the 'classes' and the number of features 'n_features'.
+    """
+    trees = [estimator.tree_ for estimator in getattr(model, 'estimators_', [model])]
+    offsets = np.concatenate([[0], np.cumsum([tree.node_count for tree in trees])]).astype(np.int32)
+    nodes = np.arange(offsets[-1], dtype=np.int32)
+    is_leaf = np.concatenate([tree.children_left == -1 for tree in trees])
+    # The right child of node i at 2 * i and the left one at 2 * i + 1, so that a comparison
+    # (True to the left) selects the child
+    children = np.stack([np.concatenate([tree.children_right + offset for tree, offset in zip(trees, offsets)]),
+                         np.concatenate([tree.children_left + offset for tree, offset in zip(trees, offsets)])], axis=1).astype(np.int32)
+    children[is_leaf] = nodes[is_leaf, np.newaxis]
+    feature = np.concatenate([tree.feature for tree in trees]).astype(np.int32)
+    feature[is_leaf] = 0
+    # Missing values go to the right child in the trees fitted before scikit-learn 1.3
+    missing_left = np.concatenate([getattr(tree, 'missing_go_to_left', np.zeros(tree.node_count, dtype=np.uint8)) for tree in trees]).astype(bool)
+    # The class probabilities of every leaf, normalized as in DecisionTreeClassifier.predict_proba
+    value = np.concatenate([tree.value[:, 0, :model.n_classes_] for tree in trees]).astype(np.float64)
+    normalizer = value.sum(axis=1)[:, np.newaxis]
+    normalizer[normalizer == 0.0] = 1.0
+    value /= normalizer
+    return {'feature': feature,
+            'threshold': _round_down_to_float32(np.concatenate([tree.threshold for tree in trees])),
+            'children': children,
+            'missing_left': missing_left,
+            'is_leaf': is_leaf,
+            'value': value,
+            'roots': offsets[:-1],
+            'classes': np.asarray(model.classes_),
+            'n_features': int(model.n_features_in_)}
+
+
+def flat_forest_proba(forest, X, chunk_size = 1024):
+    """
+    The class probabilities of the samples, averaged over the trees of a flattened forest, as
+    `predict_proba` of the forest.
+
+    Every (tree, sample) pair descends one level per step, all the pairs at once. The pairs at a
+    leaf stay there, and are set aside once they are the majority (checked every few steps), so
+    the work follows the total length of the paths without compacting the arrays at every step.
+
+    For a few samples, this is many times faster than `predict_proba`, whose dispatch of the
+    trees to a thread pool dominates. From several hundred samples on, the compiled traversal of
+    scikit-learn is faster (see `forest_proba`).
+
+    Parameters
+    ----------
+    forest : dict
+        The flattened forest, as returned by `flatten_forest` or `load_flat_forests`.
+    X : array-like
+        The samples (samples x features). NaN are the missing values.
+    chunk_size : int, optional
+        The samples traversed together, so that the (trees x chunk_size) arrays of the pairs stay
+        in the cache (default is 1024).
+
+    Returns
+    -------
+    np.ndarray
+        The probabilities (samples x classes), in the order of forest['classes'].
+    """
+    n_trees = len(forest['roots'])
+    return _flat_forest_tree_sums(forest, X, [0], chunk_size)[0] / n_trees
+
+
+def _flat_forest_tree_sums(forest, X, tree_starts, chunk_size = 1024):
+    # The class probabilities of the samples summed over the trees of every group of consecutive
+    # trees, starting at tree_starts (groups x samples x classes)
+    X = np.asarray(X, dtype=np.float32)
+    if X.ndim != 2 or X.shape[1] != forest['n_features']:
+        raise ValueError(f"Expected samples with {forest['n_features']} features, got the shape {X.shape}.")
+    # The indices as np.intp, which np.take would otherwise convert at every step, and the other
+    # arrays as plain ndarrays, since memory maps wrap the result of every operation (neither is
+    # copied if already so, as in a merged forest)
+    feature = np.asarray(forest['feature'], dtype=np.intp)
+    threshold, missing_left, is_leaf, value = [np.asarray(forest[key]) for key in ['threshold', 'missing_left', 'is_leaf', 'value']]
+    children = np.asarray(forest['children'], dtype=np.intp).ravel()
+    roots = np.asarray(forest['roots'], dtype=np.intp)
+    n_trees, n_features = len(roots), X.shape[1]
+    sums = np.empty((len(tree_starts), len(X), value.shape[1]))
+    for start in range(0, len(X), chunk_size):
+        X_chunk = X[start:start + chunk_size]
+        n_samples = len(X_chunk)
+        levels_flat = X_chunk.ravel()
+        has_missing = np.isnan(levels_flat).any()
+        # The (tree, sample) pairs, tree by tree: their node, the offset of their sample in the
+        # levels, and their position among all the pairs
+        nodes = np.repeat(roots, n_samples)
+        offsets = np.tile(np.arange(n_samples, dtype=np.intp) * n_features, n_trees)
+        positions = np.arange(n_trees * n_samples)
+        leaves = np.empty(n_trees * n_samples, dtype=np.intp)
+        step = 0
+        while nodes.size:
+            levels = np.take(levels_flat, offsets + np.take(feature, nodes))
+            go_left = levels <= np.take(threshold, nodes)
+            if has_missing:
+                go_left |= np.isnan(levels) & np.take(missing_left, nodes)
+            nodes = np.take(children, 2 * nodes + go_left)
+            step += 1
+            if step % 4:
+                continue
+            at_leaf = np.take(is_leaf, nodes)
+            if 2 * np.count_nonzero(at_leaf) >= nodes.size:
+                leaves[positions[at_leaf]] = nodes[at_leaf]
+                nodes, offsets, positions = nodes[~at_leaf], offsets[~at_leaf], positions[~at_leaf]
+        # Summed tree after tree, as predict_proba does
+        sums[:, start:start + n_samples] = np.add.reduceat(np.take(value, leaves, axis=0).reshape(n_trees, n_samples, -1), tree_starts, axis=0)
+    return sums
+
+
+def merge_flat_forests(forests, columns, n_features):
+    """
+    Merge flattened forests, each on some of the columns of the same samples, into one flattened
+    forest on all the columns, so that a single traversal scores the samples with all of them
+    (see `merged_forest_proba`). For a few samples, the cost of a traversal is mostly the
+    overhead of its steps, which is then paid once instead of once per forest.
+
+    Parameters
+    ----------
+    forests : list
+        The flattened forests, with the same classes.
+    columns : list
+        For every forest, the columns of its features among the columns of the samples.
+    n_features : int
+        The number of columns of the samples.
+
+    Returns
+    -------
+    dict
+        A flattened forest, with its indices already as np.intp, and the first tree of every
+        forest ('tree_starts') and their number of trees ('tree_counts').
+    """
+    node_offsets = np.concatenate([[0], np.cumsum([len(forest['feature']) for forest in forests])]).astype(np.intp)
+    tree_counts = np.array([len(forest['roots']) for forest in forests])
+    return {'feature': np.concatenate([np.asarray(column)[np.asarray(forest['feature'])] for forest, column in zip(forests, columns)]).astype(np.intp),
+            'threshold': np.concatenate([forest['threshold'] for forest in forests]),
+            'children': np.concatenate([np.asarray(forest['children'], dtype=np.intp) + offset for forest, offset in zip(forests, node_offsets)]),
+            'missing_left': np.concatenate([forest['missing_left'] for forest in forests]),
+            'is_leaf': np.concatenate([forest['is_leaf'] for forest in forests]),
+            'value': np.concatenate([forest['value'] for forest in forests]),
+            'roots': np.concatenate([np.asarray(forest['roots'], dtype=np.intp) + offset for forest, offset in zip(forests, node_offsets)]),
+            'classes': np.asarray(forests[0]['classes']),
+            'n_features': n_features,
+            'tree_starts': np.concatenate([[0], np.cumsum(tree_counts)[:-1]]),
+            'tree_counts': tree_counts}
+
+
+def merged_forest_proba(forest, X, chunk_size = 1024):
+    """
+    The class probabilities of the samples for every forest of a merged forest, as
+    `flat_forest_proba` of every forest on its columns of the samples.
+
+    Returns
+    -------
+    np.ndarray
+        The probabilities (forests x samples x classes).
+    """
+    return _flat_forest_tree_sums(forest, X, forest['tree_starts'], chunk_size) / forest['tree_counts'][:, np.newaxis, np.newaxis]
+
+
+def forest_proba(model, X, forest = None):
+    """
+    The class probabilities of the samples, as `predict_proba` of the forest, with the fastest
+    of the two traversals: the flattened forest for up to `flat_max_samples` samples, or
+    whenever the forest of scikit-learn is not at hand (model is None), and the forest of
+    scikit-learn otherwise.
+
+    Parameters
+    ----------
+    model : RandomForestClassifier or None
+        The fitted forest.
+    X : array-like
+        The samples (samples x features).
+    forest : dict, optional
+        The flattened forest (default is None, i.e., flattened from the model if needed).
+    """
+    if model is not None and len(X) > flat_max_samples:
+        return model.predict_proba(X)
+    return flat_forest_proba(flatten_forest(model) if forest is None else forest, X)
+
+
+def flat_forest_predict(forest, X):
+    """
+    The predicted classes of the samples, as `predict` of the forest.
+    """
+    return forest['classes'][np.argmax(flat_forest_proba(forest, X), axis=1)]
+
+
+def save_flat_forests(forests, file_path, metadata = None):
+    """
+    Save flattened forests in an uncompressed .npz file, which `load_flat_forests` can
+    memory-map.
+
+    Parameters
+    ----------
+    forests : dict
+        Name -> flattened forest.
+    file_path : str
+        The .npz file.
+    metadata : dict, optional
+        JSON-serializable metadata, saved along the forests (default is None).
+    """
+    arrays = {}
+    header = {'metadata': metadata or {}, 'forests': {}}
+    for name, forest in forests.items():
+        header['forests'][name] = {'classes': forest['classes'].tolist(), 'n_features': forest['n_features']}
+        for key in ['feature', 'threshold', 'children', 'missing_left', 'is_leaf', 'value', 'roots']:
+            arrays[f"{name}/{key}"] = forest[key]
+    arrays['header'] = np.frombuffer(json.dumps(header).encode(), dtype=np.uint8)
+    with open(file_path, 'wb') as file:
+        np.savez(file, **arrays)
+    return file_path
+
+
+def _memmap_npz(file_path):
+    # The arrays of an uncompressed .npz file, as read-only memory maps of the file
+    arrays = {}
+    with zipfile.ZipFile(file_path) as archive, open(file_path, 'rb') as file:
+        for info in archive.infolist():
+            if info.compress_type != zipfile.ZIP_STORED:
+                raise ValueError(f"{file_path} is compressed, and cannot be memory-mapped.")
+            # The data follows the local header of the member, whose extra field may differ from
+            # the one of the central directory
+            file.seek(info.header_offset + 26)
+            name_length, extra_length = np.frombuffer(file.read(4), dtype='<u2')
+            file.seek(info.header_offset + 30 + int(name_length) + int(extra_length))
+            version = np.lib.format.read_magic(file)
+            read_array_header = np.lib.format.read_array_header_1_0 if version == (1, 0) else np.lib.format.read_array_header_2_0
+            shape, fortran_order, dtype = read_array_header(file)
+            arrays[info.filename[:-len(".npy")]] = np.memmap(file_path, dtype=dtype, mode='r', offset=file.tell(), shape=shape,
+                                                              order='F' if fortran_order else 'C')
+    return arrays
+
+
+def load_flat_forests(file_path, mmap = True):
+    """
+    Load the flattened forests of a .npz file.
+
+    Parameters
+    ----------
+    file_path : str
+        The .npz file, saved by `save_flat_forests`.
+    mmap : bool, optional
+        Memory-map the arrays instead of reading them (default is True).
+
+    Returns
+    -------
+    tuple
+        Name -> flattened forest, and the metadata.
+    """
+    if mmap:
+        arrays = _memmap_npz(file_path)
+    else:
+        with np.load(file_path) as npz:
+            arrays = {key: npz[key] for key in npz.files}
+    header = json.loads(bytes(arrays.pop('header')).decode())
+    forests = {}
+    for name, forest_header in header['forests'].items():
+        forest = {key.split("/", 1)[1]: array for key, array in arrays.items() if key.split("/", 1)[0] == name}
+        forest.update(classes = np.asarray(forest_header['classes']), n_features = forest_header['n_features'])
+        forests[name] = forest
+    return forests, header['metadata']
@@ -0,0 +1,208 @@
+# Library imports
+import os
+import pandas as pd
+
+#  Project imports
+from data_preprocessing import save_data
+from fingerprint import fingerprint, file_fingerprint
+from pipeline import (topological_order, upstream_stages, stage_fingerprints, load_manifest, save_manifest, is_stage_clean,
+                      load_artifact, save_artifact)
+from scheduler import execute_stage
+from table_reader import read_table
+from screening_state import screening_state, add_samples, state_quantiles, pairwise_p_values, save_state, load_state
+from screening_stages import (rf_screening, roc_analysis, combined_rf, screening_summary, descriptive_filtering, yuen_welch_screening,
+                              p_value_matrices, quantile_statistics)
+
+# Incremental update of the screening when new samples are appended to the cohort. A change of the
+# data file makes every stage dirty for `run_pipeline`, although most of them only read some of the
+# categories: the random forest of a cancer type only reads the Normal samples and those of the
+# cancer type. Here, the new samples are added to the data file and to a screening state (see
+# screening_state.py), and every stage is
+#   - reused, if it reads none of the categories which received samples and none of its input
+#     artifacts changed: its artifact is recorded as up to date with the new data,
+#   - updated from the screening state, for the descriptive statistics filters, Yuen-Welch's tests,
+#     the p-values and the quantiles, without going through the samples of every category again,
+#   - or executed, as by the pipeline, for the random forests of the affected comparisons.
+# The manifest then holds the new fingerprints, so that a later `run_pipeline` reuses all of them.
+
+# The category of the Normal samples, read by every random forest
+normal_category_index = 5
+
+
+def stage_categories(stage):
+    """
+    The indices of the categories of the data read by a stage, or None for all of them.
+    """
+    function, params = stage['function'], stage['params']
+    if function in (rf_screening, roc_analysis):
+        return {normal_category_index, params['cancer_category_index']}
+    if function is combined_rf:
+        return {normal_category_index, *params['cancer_category_indices']}
+    if function is screening_summary:
+        # Only the names of the biomarkers
+        return set()
+    return None
+
+
+def filter_from_state(state, important_biomarkers, cancer_category_index):
+    """
+    `screening_stages.descriptive_filtering`, with the quantiles of the screening state.
+    """
+    return descriptive_filtering((state['categories'], state), important_biomarkers, cancer_category_index)
+
+
+def yuen_welch_from_state(state, selected_biomarkers, cancer_category_index, p_threshold = 0.05):
+    """
+    `screening_stages.yuen_welch_screening`, with the inputs of Yuen-Welch's test of the screening
+    state.
+    """
+    p_values = pairwise_p_values(state, 'ywtest')[cancer_category_index]
+    other_categories = [c for c in range(len(state['categories'])) if c != cancer_category_index]
+    shared_nature_of_biomarkers = []
+    for i in selected_biomarkers:
+        categories_where_p_greater_than_threshold = [state['categories'][c] for c in other_categories if p_values[c, i] > p_threshold]
+        if len(categories_where_p_greater_than_threshold) < 3:
+            shared_nature_of_biomarkers.append((i, categories_where_p_greater_than_threshold))
+    return shared_nature_of_biomarkers
+
+
+def p_values_from_state(state, cancer_category_indices, test_type = 'ywtest'):
+    """
+    `screening_stages.p_value_matrices`, from the screening state.
+    """
+    p_values = pairwise_p_values(state, test_type)
+    p_dfs = {}
+    for cancer_category_index in cancer_category_indices:
+        other_categories = [c for c in range(len(state['categories'])) if c != cancer_category_index]
+        p_df = pd.DataFrame(p_values[cancer_category_index, other_categories].T, index = state['biomarkers'],
+                            columns = [state['categories'][c] for c in other_categories])
+        p_df.name = state['categories'][cancer_category_index]
+        p_dfs[p_df.name] = p_df
+    return p_dfs
+
+
+def quantiles_from_state(state, quantile_cuts = (0.25, 0.5, 0.75)):
+    """
+    `screening_stages.quantile_statistics`, from the screening state.
+    """
+    cube = [pd.DataFrame({'Category': category,
+                          'Biomarker': [biomarker for biomarker in state['biomarkers'] for _ in quantile_cuts],
+                          'Quantile': list(quantile_cuts) * len(state['biomarkers']),
+                          'Value': [state_quantiles(state, quantile_cut)[category_index, j] for j in range(len(state['biomarkers'])) for quantile_cut in quantile_cuts]})
+            for category_index, category in enumerate(state['categories'])]
+    return pd.concat(cube, ignore_index=True)
+
+
+# The stage functions updated from the screening state: they take the state in place of the data
+state_functions = {descriptive_filtering: filter_from_state,
+                   yuen_welch_screening: yuen_welch_from_state,
+                   p_value_matrices: p_values_from_state,
+                   quantile_statistics: quantiles_from_state}
+
+
+def incremental_update(stages, samples, targets = None, artifact_dir = ".pipeline_artifacts", verbose = True):
+    """
+    Append new samples to the data of the screening, and bring the stages up to date by
+    recomputing only what the new samples can change.
+
+    Parameters
+    ----------
+    stages : list
+        The stages of the screening, with a 'data' stage loading the file given by its
+        'file_path' parameter.
+    samples : pd.DataFrame
+        The new samples, laid out as the sheets of the data file.
+    targets : list, optional
+        The names of the stages to bring up to date, together with their upstream stages
+        (default is all the stages). The other stages are left out of date.
+    artifact_dir : str, optional
+        The directory of the persisted artifacts (default is ".pipeline_artifacts"), where the
+        screening state is kept as well.
+    verbose : bool, optional
+        Whether to print what is done with every stage (default is True).
+
+    Returns
+    -------
+    tuple
+        The artifacts of the targets, by stage name, and a dataframe with, for every stage, what
+        was done ('reused', 'updated' from the screening state, or 'executed'), whether the new
+        samples could change its artifact ('Affected'), and whether they did ('Changed').
+
+    Raises
+    ------
+    ValueError
+        If the new samples do not fit the cohort (see `screening_state.add_samples`), e.g., when
+        they were already added by an earlier update. The data file is then left unchanged.
+    """
+    stages_by_name = {stage['name']: stage for stage in stages}
+    targets = list(stages_by_name) if targets is None else list(targets)
+    selected = upstream_stages(stages, targets)
+    order = [name for name in topological_order(stages) if name in selected]
+
+    # The stages up to date before the new samples
+    manifest = load_manifest(artifact_dir)
+    fingerprints = stage_fingerprints(stages)
+    clean = {name for name in order if is_stage_clean(stages_by_name[name], fingerprints[name], manifest, artifact_dir)}
+    data_stage = stages_by_name['data']
+    if 'data' in clean:
+        data = load_artifact('data', artifact_dir)
+    else:
+        data = execute_stage('data', data_stage['function'], [], {**data_stage['params'], **data_stage['runtime']})[0]
+
+    # The screening state, kept along the artifacts for the data it was computed from
+    state_file = os.path.join(artifact_dir, "screening_state.pkl")
+    state = load_state(state_file) if os.path.exists(state_file) else None
+    if state is None or state.get('data_fingerprint') != fingerprints['data']:
+        state = screening_state(*data)
+
+    data, updated_categories = add_samples(state, data, samples)
+    file_path = data_stage['params']['file_path']
+    all_samples = pd.concat([read_table(file_path, sheet_name=0), samples], ignore_index=True)
+    save_data(*data, file_path = file_path, all_samples = all_samples)
+    fingerprints = stage_fingerprints(stages)
+    if verbose:
+        print(f"[incremental] {len(samples)} samples added to {[data[0][c] for c in updated_categories]} in {file_path}")
+
+    artifacts, changed, report = {'data': data}, {'data'}, []
+
+    def artifact(name):
+        if name not in artifacts:
+            artifacts[name] = load_artifact(name, artifact_dir)
+        return artifacts[name]
+
+    for name in order:
+        stage = stages_by_name[name]
+        elapsed = None
+        if name == 'data':
+            status, affected = 'updated', True
+            save_artifact(data, name, artifact_dir)
+        else:
+            read_categories = stage_categories(stage) if 'data' in stage['inputs'] else set()
+            affected = (read_categories is None or bool(read_categories & set(updated_categories))
+                        or any(input_name in changed for input_name in stage['inputs'] if input_name != 'data'))
+            if not affected and name in clean:
+                status = 'reused'
+            else:
+                inputs = [state if input_name == 'data' and stage['function'] in state_functions else artifact(input_name)
+                          for input_name in stage['inputs']]
+                if stage['function'] in state_functions:
+                    status = 'updated'
+                    new_artifact, elapsed, _, _ = execute_stage(name, state_functions[stage['function']], inputs, stage['params'])
+                else:
+                    status = 'executed'
+                    new_artifact, elapsed, _, _ = execute_stage(name, stage['function'], inputs, {**stage['params'], **stage['runtime']})
+                if name not in clean or fingerprint(load_artifact(name, artifact_dir)) != fingerprint(new_artifact):
+                    changed.add(name)
+                artifacts[name] = new_artifact
+                save_artifact(new_artifact, name, artifact_dir)
+        manifest[name] = {'fingerprint': fingerprints[name],
+                          'output_hashes': {file_path: file_fingerprint(file_path) for file_path in stage['outputs']}}
+        save_manifest(manifest, artifact_dir)
+        report.append({'Stage': name, 'Status': status, 'Affected': affected, 'Changed': name in changed})
+        if verbose:
+            print(f"[incremental] {status:<9} {name}" + ("" if elapsed is None else f" in {elapsed:.1f} s")
+                  + (" (changed)" if name in changed and name != 'data' else ""))
+
+    state['data_fingerprint'] = fingerprints['data']
+    save_state(state, state_file)
+    return {name: artifact(name) for name in targets}, pd.DataFrame(report)
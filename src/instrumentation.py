@@ -0,0 +1,167 @@
+# Library imports
+import functools
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+# Tracing is off by default, and can be switched on with enable_tracing or the BIOMARKER_TRACE
+# environment variable. The recorded spans are Chrome trace "complete" events.
+_enabled = bool(os.environ.get('BIOMARKER_TRACE'))
+_events = []
+
+
+def enable_tracing(enabled = True):
+    """
+    Switch the recording of the spans on or off.
+    """
+    global _enabled
+    _enabled = enabled
+
+
+def tracing_enabled():
+    """
+    Whether the spans are recorded.
+    """
+    return _enabled
+
+
+def reset_trace():
+    """
+    Discard the recorded spans.
+    """
+    _events.clear()
+
+
+def trace_events():
+    """
+    The recorded spans, as Chrome trace events.
+    """
+    return list(_events)
+
+
+def extend_trace(events):
+    """
+    Add spans recorded elsewhere, e.g., in a worker process.
+    """
+    _events.extend(events)
+
+
+def peak_rss_mb():
+    """
+    The peak resident set size of the current process in MB, or None if it is unavailable.
+    """
+    try:
+        import resource
+    except ImportError:
+        # Windows: the peak working set, if psutil is installed
+        try:
+            import psutil
+        except ImportError:
+            return None
+        return psutil.Process().memory_info().peak_wset / 2**20
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kB elsewhere
+    return peak_rss / 2**20 if sys.platform == 'darwin' else peak_rss / 2**10
+
+
+@contextmanager
+def span(name, category = 'stage', **args):
+    """
+    Record the wall time, the CPU time and the peak RSS of the enclosed block, if tracing is on.
+
+    Parameters
+    ----------
+    name : str
+        The name of the span, e.g., "rf.fit".
+    category : str, optional
+        The category of the span, e.g., "rf", "io", "stats" or "figure" (default is "stage").
+    **args
+        Details shown with the span, e.g., the iteration or the file.
+    """
+    if not _enabled:
+        yield
+        return
+    start_peak_rss = peak_rss_mb()
+    start_timestamp = time.time_ns() // 1000
+    start_wall = time.perf_counter()
+    start_cpu = time.process_time()
+    try:
+        yield
+    finally:
+        wall = time.perf_counter() - start_wall
+        cpu = time.process_time() - start_cpu
+        end_peak_rss = peak_rss_mb()
+        _events.append({'name': name,
+                        'cat': category,
+                        'ph': 'X',
+                        'ts': start_timestamp,
+                        'dur': wall * 1e6,
+                        'pid': os.getpid(),
+                        'tid': threading.get_ident(),
+                        'args': {**{key: value if isinstance(value, (int, float, str, bool, type(None))) else str(value) for key, value in args.items()},
+                                 'cpu_ms': cpu * 1e3,
+                                 'peak_rss_mb': end_peak_rss,
+                                 'peak_rss_growth_mb': None if end_peak_rss is None else end_peak_rss - start_peak_rss}})
+
+
+def traced(name = None, category = 'stage'):
+    """
+    Decorator recording every call of the function as a span (named after the function by default).
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(name or function.__name__, category):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def export_chrome_trace(file_path = "trace.json"):
+    """
+    Save the recorded spans as a Chrome trace, to be opened in chrome://tracing or Perfetto.
+    """
+    with open(file_path, 'w') as file:
+        json.dump({'traceEvents': _events, 'displayTimeUnit': 'ms'}, file)
+    return file_path
+
+
+def trace_summary():
+    """
+    Summary of the recorded spans by name: number of calls, total and mean wall time, total CPU
+    time and the largest peak RSS, sorted by total wall time.
+
+    Returns
+    -------
+    pd.DataFrame
+        The summary table.
+    """
+    import pandas as pd
+
+    columns = ['Span', 'Category', 'Calls', 'Wall (s)', 'Mean wall (ms)', 'CPU (s)', 'Peak RSS (MB)']
+    if not _events:
+        return pd.DataFrame(columns=columns)
+    events_df = pd.DataFrame({'Span': [event['name'] for event in _events],
+                              'Category': [event['cat'] for event in _events],
+                              'wall': [event['dur'] / 1e6 for event in _events],
+                              'cpu': [event['args']['cpu_ms'] / 1e3 for event in _events],
+                              'rss': [event['args']['peak_rss_mb'] for event in _events]})
+    summary_df = events_df.groupby(['Span', 'Category'], sort=False).agg(Calls=('wall', 'size'),
+                                                                        wall=('wall', 'sum'),
+                                                                        mean_wall=('wall', 'mean'),
+                                                                        cpu=('cpu', 'sum'),
+                                                                        rss=('rss', 'max')).reset_index()
+    summary_df['mean_wall'] *= 1e3
+    summary_df.columns = columns
+    return summary_df.sort_values('Wall (s)', ascending=False, ignore_index=True)
+
+
+def print_trace_summary():
+    """
+    Print the summary table of the recorded spans.
+    """
+    print("\nTrace summary:")
+    print(trace_summary().to_string(index=False, float_format=lambda x: f"{x:.3f}"))
@@ -0,0 +1,96 @@
+# Library imports
+import os
+
+#  Project imports
+from instrumentation import span
+
+# Output profiles for the saved figures:
+# - publication: vector PDF at 600 dpi, the published figures.
+# - report: PDF with the dense layers (scatter points, heatmap cells, fliers, long lines) rasterized
+#   at 150 dpi inside an otherwise vector figure. Much smaller and faster to render and to open.
+# - preview: low-dpi PNG, for quick looks.
+output_profiles = {
+    'publication': {'format': 'pdf', 'dpi': 600, 'rasterize_dense_layers': False},
+    'report': {'format': 'pdf', 'dpi': 150, 'rasterize_dense_layers': True},
+    'preview': {'format': 'png', 'dpi': 100, 'rasterize_dense_layers': False},
+}
+
+# The active profile, which can also be chosen with the BIOMARKER_OUTPUT_PROFILE environment variable
+_active_output_profile = os.environ.get('BIOMARKER_OUTPUT_PROFILE', 'publication')
+
+
+def set_output_profile(name):
+    """
+    Set the active output profile: 'publication', 'report' or 'preview'.
+    """
+    global _active_output_profile
+    if name not in output_profiles:
+        raise ValueError(f"Unknown output profile '{name}'. Choose one of {list(output_profiles)}.")
+    _active_output_profile = name
+
+
+def get_output_profile():
+    """
+    The name of the active output profile.
+    """
+    return _active_output_profile
+
+
+def output_file_path(file_path, profile = None):
+    """
+    The path of the file actually written for the given path under the given profile
+    (default is the active profile), i.e., with the extension of the profile's format.
+    """
+    profile = output_profiles[profile or _active_output_profile]
+    root, extension = os.path.splitext(file_path)
+    if extension.lower().lstrip('.') == profile['format']:
+        return file_path
+    return f"{root}.{profile['format']}"
+
+
+def rasterize_dense_layers(fig, min_points = 100):
+    """
+    Mark the dense layers of the figure as rasterized: all the collections (scatter points, heatmap
+    cells, filled areas), the lines with markers (e.g., boxplot fliers) or with at least `min_points`
+    points, and the patches of axes with at least `min_points` patches. Text, axes and the other
+    artists stay vector.
+    """
+    for ax in fig.axes:
+        for collection in ax.collections:
+            collection.set_rasterized(True)
+        for line in ax.lines:
+            if len(line.get_xdata()) >= min_points or line.get_marker() not in (None, 'None', 'none', '', ' '):
+                line.set_rasterized(True)
+        if len(ax.patches) >= min_points:
+            for patch in ax.patches:
+                patch.set_rasterized(True)
+
+
+def save_figure(fig, file_path, profile = None, **kwargs):
+    """
+    Save the figure according to the given output profile (default is the active profile).
+
+    Parameters
+    ----------
+    fig : matplotlib.figure.Figure
+        The figure.
+    file_path : str
+        The path of the file. Its extension is replaced by the profile's format if they differ.
+    profile : str, optional
+        'publication', 'report' or 'preview' (default is the active profile).
+    **kwargs
+        Passed to `fig.savefig`.
+
+    Returns
+    -------
+    str
+        The path of the saved file.
+    """
+    profile_name = profile or _active_output_profile
+    profile = output_profiles[profile_name]
+    file_path = output_file_path(file_path, profile_name)
+    with span('savefig', 'figure', file=file_path, profile=profile_name):
+        if profile['rasterize_dense_layers']:
+            rasterize_dense_layers(fig)
+        fig.savefig(file_path, dpi=profile['dpi'], bbox_inches='tight', format=profile['format'], **kwargs)
+    return file_path
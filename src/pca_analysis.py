@@ -1,37 +1,135 @@
 # Library imports
+from types import SimpleNamespace
+from sklearn.base import clone
 from sklearn.preprocessing import StandardScaler
-from sklearn.decomposition import PCA
+from sklearn.decomposition import PCA, IncrementalPCA
+import numpy as np
 import pandas as pd
 
-import matplotlib.pyplot as plt
-from mpl_toolkits.mplot3d import Axes3D
-from matplotlib.patches import Patch
-
 #  Project imports
 from data_preprocessing import load_data, feature_label_split
 
 def number_of_correlated_columns(correlation_matrix, threshold = 0.9):
-    correlated_pairs = []
-    count = 0
-    for i in range(len(correlation_matrix.columns)):
-        for j in range(i):
-            if abs(correlation_matrix.iloc[i, j]) > threshold:
-                count += 1
-                correlated_pairs.append((i, j))
-                
-    return count, correlated_pairs
-
-
-def cancer_dataframe_PCA(features: pd.DataFrame,
-                         n_components = 3,
-                         scaler = StandardScaler()):
-    pca = PCA(n_components = n_components)
+    """
+    Count the pairs of columns in the lower triangle of the correlation matrix whose absolute
+    correlation exceeds the threshold. For large panels, use `correlation_screening.correlated_pairs`,
+    which works from the features without materializing the full correlation matrix.
+    """
+    values = np.abs(np.asarray(correlation_matrix))
+    rows, cols = np.tril_indices(len(values), k=-1)
+    mask = values[rows, cols] > threshold
+    correlated_pairs = list(zip(rows[mask].tolist(), cols[mask].tolist()))
+    return len(correlated_pairs), correlated_pairs
 
-    # Standardize the features before PCA
-    features_standardized = scaler.fit_transform(features)
-    
-    # Fit PCA to the standardized features
-    features_PCA_reduced = pca.fit_transform(features_standardized)
+
+def feature_chunks(features: pd.DataFrame, chunk_size = 10000):
+    """
+    Yield consecutive row chunks of the given features.
+
+    Parameters
+    ----------
+    features : pd.DataFrame
+        The feature matrix.
+    chunk_size : int, optional
+        Number of rows in each chunk (default is 10000).
+
+    Yields
+    ------
+    pd.DataFrame
+        The chunks, in row order.
+    """
+    for start in range(0, len(features), chunk_size):
+        yield features.iloc[start:start + chunk_size]
+
+
+def _merge_small_chunks(chunks, min_rows):
+    # IncrementalPCA.partial_fit needs at least as many rows per batch as components, so the
+    # rows are buffered from the first chunk on until there are enough, and a short chunk
+    # (typically the trailing one) is merged into its predecessor.
+    pending = None
+    for chunk in chunks:
+        chunk = np.asarray(chunk, dtype=float)
+        if pending is None:
+            pending = chunk
+        elif len(pending) < min_rows or len(chunk) < min_rows:
+            pending = np.vstack([pending, chunk])
+        else:
+            yield pending
+            pending = chunk
+    if pending is not None:
+        yield pending
+
+
+def cancer_dataframe_PCA(features,
+                         n_components = 3,
+                         scaler = None,
+                         svd_solver = 'auto',
+                         chunk_size = 10000,
+                         random_state = None):
+    """
+    Standardize the features and reduce them with PCA.
+
+    Parameters
+    ----------
+    features : pd.DataFrame or callable
+        The feature matrix. For cohorts that do not fit in memory, pass a callable with no
+        arguments that returns a fresh iterable of feature chunks (DataFrames or arrays) each
+        time it is called; it is iterated three times (scaling, fitting and transforming).
+    n_components : int, optional
+        Number of principal components (default is 3).
+    scaler : sklearn transformer, optional
+        Scaler applied before PCA. A fresh, unfitted clone is used on every call, so the passed
+        object is never modified and concurrent calls do not share state (default is StandardScaler).
+    svd_solver : str, optional
+        'auto', 'full', 'covariance_eigh' or 'randomized' for the in-memory PCA, or 'incremental'
+        for streaming the chunks through `partial_fit` of the scaler and of IncrementalPCA,
+        which keeps every component between the batches and matches the exact PCA
+        (default is 'auto'). A callable `features` always uses 'incremental'.
+    chunk_size : int, optional
+        Number of rows per chunk when `features` is a DataFrame and `svd_solver` is 'incremental'
+        (default is 10000).
+    random_state : int, optional
+        Seed for the 'randomized' solver (default is None).
+
+    Returns
+    -------
+    tuple
+        The PCA-reduced features, the explained variance of each component, and the
+        components dataframe with one column per component.
+    """
+    scaler = StandardScaler() if scaler is None else clone(scaler)
+
+    if callable(features) or svd_solver == 'incremental':
+        if callable(features):
+            chunks = features
+        else:
+            chunks = lambda: feature_chunks(features, chunk_size)
+
+        # Pass 1: running mean and variance of the features
+        for chunk in chunks():
+            scaler.partial_fit(np.asarray(chunk, dtype=float))
+
+        # Pass 2: fit IncrementalPCA to the standardized chunks. All the components are kept
+        # between the batches, so that the leading ones match the exact PCA; they are truncated below.
+        n_features = scaler.n_features_in_
+        incremental_pca = IncrementalPCA(n_components = n_features)
+        for chunk in _merge_small_chunks(chunks(), n_features):
+            incremental_pca.partial_fit(scaler.transform(chunk))
+        pca = SimpleNamespace(components_ = incremental_pca.components_[:n_components],
+                              explained_variance_ = incremental_pca.explained_variance_[:n_components],
+                              explained_variance_ratio_ = incremental_pca.explained_variance_ratio_[:n_components])
+
+        # Pass 3: project the standardized chunks
+        features_PCA_reduced = np.vstack([(scaler.transform(np.asarray(chunk, dtype=float)) - incremental_pca.mean_) @ pca.components_.T
+                                          for chunk in chunks()])
+    else:
+        pca = PCA(n_components = n_components, svd_solver = svd_solver, random_state = random_state)
+
+        # Standardize the features before PCA
+        features_standardized = scaler.fit_transform(features)
+        
+        # Fit PCA to the standardized features
+        features_PCA_reduced = pca.fit_transform(features_standardized)
 
     # Explained variance
     explained_variance_ratio = pca.explained_variance_ratio_
@@ -65,6 +163,10 @@ def visualize_dataset_3d(points_df_3D: pd.DataFrame,
     Returns:
         fig, ax.
     """
+    import matplotlib.pyplot as plt
+    from mpl_toolkits.mplot3d import Axes3D
+    from matplotlib.patches import Patch
+
     levels, categories = pd.factorize(labels_df)
     colors = [plt.cm.tab10(custom_index_function(i)) for i in levels] # using the "tab10" colormap
     handles = [Patch(color=plt.cm.tab10(custom_index_function(i)), label=c) for i, c in enumerate(categories)]
@@ -101,4 +203,5 @@ if __name__ == "__main__":
     visualize_dataset_3d(points_df_3D = features_PCA_reduced, 
                          labels_df = labels,
                          reduction_name = 'PCA')
+    import matplotlib.pyplot as plt
     plt.show()
\ No newline at end of file
@@ -0,0 +1,214 @@
+# Library imports
+import os
+import numpy as np
+import pandas as pd
+from scipy.stats import chi2
+
+#  Project imports
+from data_preprocessing import load_data, feature_label_split
+from pca_analysis import cancer_dataframe_PCA
+from output_profiles import save_figure
+
+# Short biomarker names for the biplot labels
+biomarker_name_mapping = {'sHER2/sEGFR2/sErbB2': 'sHER2'}
+
+
+def confidence_ellipse(points, ax, level = 0.95, **kwargs):
+    """
+    Draw the normal-theory confidence ellipse of the given 2D points.
+
+    Parameters
+    ----------
+    points : np.ndarray
+        Array of shape (n_samples, 2).
+    ax : matplotlib.axes.Axes
+        The axes to draw on.
+    level : float, optional
+        The confidence level (default is 0.95).
+    **kwargs
+        Passed to `matplotlib.patches.Ellipse`.
+
+    Returns
+    -------
+    matplotlib.patches.Ellipse
+        The ellipse.
+    """
+    from matplotlib.patches import Ellipse
+
+    center = points.mean(axis=0)
+    eigenvalues, eigenvectors = np.linalg.eigh(np.cov(points, rowvar=False))
+    width, height = 2 * np.sqrt(eigenvalues[::-1] * chi2.ppf(level, df=2))
+    angle = np.degrees(np.arctan2(eigenvectors[1, -1], eigenvectors[0, -1]))
+    ellipse = Ellipse(center, width, height, angle=angle, **kwargs)
+    ax.add_patch(ellipse)
+    return ellipse
+
+
+def pca_biplot(categories,
+               dfs,
+               cancer_category_index,
+               n_top_biomarkers = 10,
+               arrow_scaling_factor = 30,
+               random_state = 12,
+               ax = None):
+    """
+    PCA biplot of equally sized random subsamples of Normal and the given cancer type, showing
+    the biomarkers with the largest contributions (squared loadings) to PC1 and PC2.
+
+    Parameters
+    ----------
+    categories : list
+        The list of cancer types.
+    dfs : list
+        The list of dataframes corresponding to each cancer type.
+    cancer_category_index : int
+        Index of the cancer type.
+    n_top_biomarkers : int, optional
+        Number of biomarker arrows to draw (default is 10).
+    arrow_scaling_factor : float, optional
+        Factor by which the loadings are scaled to draw the arrows (default is 30).
+    random_state : int, optional
+        Seed for the subsampling (default is 12).
+    ax : matplotlib.axes.Axes, optional
+        The axes to draw on. A new figure is created if None.
+
+    Returns
+    -------
+    matplotlib.axes.Axes
+        The axes.
+    """
+    if ax is None:
+        import matplotlib.pyplot as plt
+        fig, ax = plt.subplots(figsize=(8, 6))
+
+    # Equal numbers of Normal and cancer samples
+    normal_df = dfs[5]
+    cancer_df = dfs[cancer_category_index]
+    n_samples = min(len(normal_df), len(cancer_df))
+    combined_df = pd.concat([normal_df.sample(n=n_samples, random_state=random_state),
+                             cancer_df.sample(n=n_samples, random_state=random_state)],
+                            ignore_index=True)
+    features, labels = feature_label_split(combined_df)
+    complete_rows = features.notna().all(axis=1)
+    features = features[complete_rows].rename(columns=biomarker_name_mapping)
+    labels = labels[complete_rows].replace('Normal', 'Healthy')
+
+    # All the components are kept, so that the explained variance ratios are exact
+    scores, explained_variance, components_df = cancer_dataframe_PCA(features, n_components=features.shape[1])
+    percentage = 100 * explained_variance / explained_variance.sum()
+    components_df.index = features.columns
+
+    # Top contributing biomarkers in PC1 and PC2
+    contribution = components_df['PC1'] ** 2 + components_df['PC2'] ** 2
+    top_components_df = components_df.loc[contribution.sort_values(ascending=False).index[:n_top_biomarkers]]
+
+    # Samples and their 95% confidence ellipses
+    groups = sorted(labels.unique())
+    group_colors = dict(zip(groups, ['#00BFC4', '#F8766D']))
+    for group in groups:
+        group_scores = scores[(labels == group).to_numpy(), :2]
+        ax.scatter(group_scores[:, 0], group_scores[:, 1], s=12, alpha=0.6, color=group_colors[group], label=group)
+        confidence_ellipse(group_scores, ax, facecolor=group_colors[group], edgecolor='none', alpha=0.2)
+
+    # Biomarker arrows
+    for biomarker, row in top_components_df.iterrows():
+        x, y = row['PC1'] * arrow_scaling_factor, row['PC2'] * arrow_scaling_factor
+        ax.annotate('', xy=(x, y), xytext=(0, 0),
+                    arrowprops=dict(arrowstyle='->', color='blue', alpha=0.3, lw=1))
+        ax.text(x, y, biomarker, color='blue', fontsize=14,
+                ha='left' if x >= 0 else 'right', va='bottom' if y >= 0 else 'top')
+
+    ax.set_xlabel(f"PC1 ({percentage[0]:.2f}%)", fontsize=16)
+    ax.set_ylabel(f"PC2 ({percentage[1]:.2f}%)", fontsize=16)
+    ax.tick_params(axis='both', which='major', labelsize=12)
+    ax.legend(title='Group', fontsize=14, title_fontsize=16)
+    ax.grid(alpha=0.5)
+    return ax
+
+
+def plot_pca_biplot(categories, dfs, cancer_category_index, file_path, show = False):
+    """
+    Render the PCA biplot of Normal + the given cancer type and save it.
+
+    Parameters
+    ----------
+    categories : list
+        The list of cancer types.
+    dfs : list
+        The list of dataframes corresponding to each cancer type.
+    cancer_category_index : int
+        Index of the cancer type.
+    file_path : str
+        The path of the file. Its extension follows the active output profile.
+    show : bool, optional
+        Whether to display the plot (default is False).
+
+    Returns
+    -------
+    str
+        The path of the saved file.
+    """
+    import matplotlib.pyplot as plt
+
+    fig, ax = plt.subplots(figsize=(8, 6))
+    pca_biplot(categories, dfs, cancer_category_index, ax=ax)
+    file_path = save_figure(fig, file_path)
+    if show:
+        plt.show()
+    else:
+        plt.close(fig)
+    return file_path
+
+
+def pca_biplot_specs(categories, dfs, cancer_category_indices = (3, 6, 7), output_dir = "pca_biplots"):
+    """
+    Figure specifications of the PCA biplots, for `figures.render_figures`.
+
+    Returns
+    -------
+    list
+        List of (function, kwargs) tuples, one for each cancer type.
+    """
+    return [(plot_pca_biplot, dict(categories = categories,
+                                   dfs = dfs,
+                                   cancer_category_index = cancer_category_index,
+                                   file_path = os.path.join(output_dir, f"{categories[cancer_category_index]}_PCA_biplot_top_biomarkers.pdf")))
+            for cancer_category_index in cancer_category_indices]
+
+
+def render_pca_biplots(categories,
+                       dfs,
+                       cancer_category_indices = (3, 6, 7),
+                       output_dir = "pca_biplots",
+                       show = False):
+    """
+    Render and save the PCA biplots of Normal + each given cancer type, in one process,
+    from the already loaded dataset.
+
+    Parameters
+    ----------
+    categories : list
+        The list of cancer types.
+    dfs : list
+        The list of dataframes corresponding to each cancer type.
+    cancer_category_indices : iterable, optional
+        Indices of the cancer types (default is Liver, Ovary and Pancreas).
+    output_dir : str, optional
+        Directory of the PDF files (default is "pca_biplots").
+    show : bool, optional
+        Whether to display the plots (default is False).
+
+    Returns
+    -------
+    list
+        The paths of the saved PDF files.
+    """
+    return [function(**kwargs, show=show) for function, kwargs in pca_biplot_specs(categories, dfs, cancer_category_indices, output_dir)]
+
+
+# Debug code
+if __name__ == "__main__":
+    categories, dfs = load_data()
+    pca_biplot(categories, dfs, cancer_category_index = 7)
+    import matplotlib.pyplot as plt
+    plt.show()
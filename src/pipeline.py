@@ -0,0 +1,294 @@
+# Library imports
+import json
+import os
+import pickle
+
+#  Project imports
+from fingerprint import fingerprint, file_fingerprint, code_fingerprint
+from scheduler import schedule_stages
+
+
+def stage(name, function, inputs = (), params = None, files = (), outputs = (), runtime = None):
+    """
+    A stage of a pipeline.
+
+    The stage is computed as `function(*[artifacts of the inputs], **params, **runtime)`, and its
+    return value is the artifact of the stage.
+
+    Parameters
+    ----------
+    name : str
+        The name of the stage.
+    function : callable
+        The function computing the artifact of the stage.
+    inputs : sequence, optional
+        The names of the upstream stages whose artifacts are passed to the function, in order.
+    params : dict, optional
+        The parameters of the stage. They are part of its fingerprint.
+    files : sequence, optional
+        The paths of the files read by the stage. Their contents are part of its fingerprint.
+    outputs : sequence, optional
+        The paths of the files written by the stage. The stage is re-executed if any of them
+        is missing or modified.
+    runtime : dict, optional
+        Runtime keyword arguments (e.g., number of jobs, verbosity), which do not affect the
+        artifact and are not part of the fingerprint.
+
+    Returns
+    -------
+    dict
+        The stage.
+    """
+    return {'name': name,
+            'function': function,
+            'inputs': list(inputs),
+            'params': dict(params or {}),
+            'files': list(files),
+            'outputs': list(outputs),
+            'runtime': dict(runtime or {})}
+
+
+def topological_order(stages):
+    """
+    The names of the stages, ordered so that every stage comes after its inputs. Among the stages
+    that are ready at the same time, the order of declaration is kept.
+
+    Raises
+    ------
+    ValueError
+        If a stage name is duplicated, an input is not a stage, or the stages form a cycle.
+    """
+    names = [stage['name'] for stage in stages]
+    if len(set(names)) != len(names):
+        raise ValueError("Duplicate stage names.")
+    inputs = {stage['name']: stage['inputs'] for stage in stages}
+    for name, stage_inputs in inputs.items():
+        for input_name in stage_inputs:
+            if input_name not in inputs:
+                raise ValueError(f"Unknown input '{input_name}' of stage '{name}'.")
+
+    order, done = [], set()
+    while len(order) < len(names):
+        ready = [name for name in names if name not in done and all(input_name in done for input_name in inputs[name])]
+        if not ready:
+            raise ValueError(f"The stages {[name for name in names if name not in done]} form a cycle.")
+        order += ready
+        done.update(ready)
+    return order
+
+
+def upstream_stages(stages, names):
+    """
+    The given stages together with all the stages they depend on.
+    """
+    inputs = {stage['name']: stage['inputs'] for stage in stages}
+    selected, pending = set(), list(names)
+    while pending:
+        name = pending.pop()
+        if name not in selected:
+            selected.add(name)
+            pending += inputs[name]
+    return selected
+
+
+def downstream_stages(stages, names):
+    """
+    The given stages together with all the stages depending on them.
+    """
+    inputs = {stage['name']: stage['inputs'] for stage in stages}
+    selected = set(names)
+    for name in topological_order(stages):
+        if any(input_name in selected for input_name in inputs[name]):
+            selected.add(name)
+    return selected
+
+
+def stage_fingerprints(stages):
+    """
+    The fingerprint of every stage: the hash of its function source and of the source of the project
+    helpers it calls (e.g., `rf_normal_cancers` for a random forest stage, see
+    `fingerprint.code_fingerprint`), its parameters, the contents of the files it reads and the
+    fingerprints of its inputs. A change anywhere upstream of a stage, in its data or its code,
+    thus changes its fingerprint, and a change in the code of other stages does not.
+    """
+    stages_by_name = {stage['name']: stage for stage in stages}
+    fingerprints = {}
+    for name in topological_order(stages):
+        fingerprints[name] = stage_fingerprint(stages_by_name[name], fingerprints)
+    return fingerprints
+
+
+def stage_fingerprint(stage, fingerprints):
+    """
+    The fingerprint of a stage, given the fingerprints of its inputs.
+    """
+    return fingerprint(stage['function'],
+                       code_fingerprint(stage['function']),
+                       stage['params'],
+                       [(file_path, file_fingerprint(file_path)) for file_path in stage['files']],
+                       [fingerprints[input_name] for input_name in stage['inputs']])
+
+
+def load_manifest(artifact_dir = ".pipeline_artifacts"):
+    """
+    Load the artifact manifest, mapping each stage name to the fingerprint of its artifact and to
+    the hashes of the files it wrote.
+    """
+    manifest_file = os.path.join(artifact_dir, "manifest.json")
+    if not os.path.exists(manifest_file):
+        return {}
+    with open(manifest_file) as file:
+        return json.load(file)
+
+
+def save_manifest(manifest, artifact_dir = ".pipeline_artifacts"):
+    """
+    Save the artifact manifest atomically.
+    """
+    os.makedirs(artifact_dir, exist_ok=True)
+    manifest_file = os.path.join(artifact_dir, "manifest.json")
+    with open(manifest_file + ".tmp", 'w') as file:
+        json.dump(manifest, file, indent=2, sort_keys=True)
+    os.replace(manifest_file + ".tmp", manifest_file)
+
+
+def artifact_path(name, artifact_dir = ".pipeline_artifacts"):
+    """
+    The path of the persisted artifact of a stage.
+    """
+    return os.path.join(artifact_dir, f"{name}.pkl")
+
+
+def save_artifact(artifact, name, artifact_dir = ".pipeline_artifacts"):
+    """
+    Persist the artifact of a stage atomically.
+    """
+    os.makedirs(artifact_dir, exist_ok=True)
+    file_path = artifact_path(name, artifact_dir)
+    with open(file_path + ".tmp", 'wb') as file:
+        pickle.dump(artifact, file, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(file_path + ".tmp", file_path)
+
+
+def load_artifact(name, artifact_dir = ".pipeline_artifacts"):
+    """
+    Load the persisted artifact of a stage.
+    """
+    with open(artifact_path(name, artifact_dir), 'rb') as file:
+        return pickle.load(file)
+
+
+def is_stage_clean(stage, stage_fingerprint, manifest, artifact_dir = ".pipeline_artifacts"):
+    """
+    Whether the persisted artifact of the stage is up to date: its recorded fingerprint matches,
+    the artifact exists, and the files written by the stage still have the recorded contents.
+    """
+    entry = manifest.get(stage['name'])
+    return (entry is not None
+            and entry['fingerprint'] == stage_fingerprint
+            and os.path.exists(artifact_path(stage['name'], artifact_dir))
+            and all(entry['output_hashes'].get(file_path) == file_fingerprint(file_path) for file_path in stage['outputs']))
+
+
+def dirty_stages(stages, artifact_dir = ".pipeline_artifacts", force = ()):
+    """
+    The names of the stages that have to be re-executed: the stages whose persisted artifacts are
+    out of date, the forced stages, and everything downstream of them.
+    """
+    manifest = load_manifest(artifact_dir)
+    fingerprints = stage_fingerprints(stages)
+    dirty = {stage['name'] for stage in stages
+             if not is_stage_clean(stage, fingerprints[stage['name']], manifest, artifact_dir)}
+    return downstream_stages(stages, dirty | set(force))
+
+
+def run_pipeline(stages, targets = None, artifact_dir = ".pipeline_artifacts", force = (), max_workers = 1, verbose = True):
+    """
+    Run the pipeline, re-executing only the dirty stages.
+
+    A stage is dirty if its function, its parameters, the files it reads or any upstream stage
+    changed since its artifact was persisted, or if a file it wrote is missing or modified. The
+    clean stages are not executed, and their artifacts are loaded from disk only when a dirty
+    stage or a target needs them. With max_workers > 1, the independent dirty stages run
+    concurrently (see `scheduler.schedule_stages`).
+
+    Parameters
+    ----------
+    stages : list
+        The stages, as returned by `stage`.
+    targets : list, optional
+        The names of the stages to bring up to date, together with their upstream stages
+        (default is all the stages).
+    artifact_dir : str, optional
+        The directory of the persisted artifacts (default is ".pipeline_artifacts").
+    force : sequence, optional
+        The names of the stages to re-execute regardless of their artifacts.
+    max_workers : int, optional
+        The number of processes executing the stages (default is 1).
+    verbose : bool, optional
+        Whether to print the executed and the reused stages (default is True).
+
+    Returns
+    -------
+    dict
+        The artifacts of the targets, by stage name.
+    """
+    stages_by_name = {stage['name']: stage for stage in stages}
+    targets = list(stages_by_name) if targets is None else list(targets)
+    selected = upstream_stages(stages, targets)
+    order = [name for name in topological_order(stages) if name in selected]
+
+    manifest = load_manifest(artifact_dir)
+    fingerprints = stage_fingerprints(stages)
+    dirty = {name for name in order
+             if not is_stage_clean(stages_by_name[name], fingerprints[name], manifest, artifact_dir)}
+    dirty = downstream_stages(stages, dirty | set(force)) & selected
+
+    # The clean stages whose artifacts are actually needed
+    needed = set(targets) | {input_name for name in dirty for input_name in stages_by_name[name]['inputs']}
+
+    artifacts = {}
+    for name in order:
+        if name not in dirty:
+            if name in needed:
+                artifacts[name] = load_artifact(name, artifact_dir)
+            if verbose:
+                print(f"[pipeline] reused    {name}")
+
+    for name, artifact, elapsed, output in schedule_stages(stages_by_name, order, dirty, artifacts, max_workers = max_workers, verbose = verbose):
+        stage = stages_by_name[name]
+        save_artifact(artifact, name, artifact_dir)
+        # The files read by the stage may have been written by an upstream stage during this run
+        fingerprints[name] = stage_fingerprint(stage, fingerprints)
+        manifest[name] = {'fingerprint': fingerprints[name],
+                          'output_hashes': {file_path: file_fingerprint(file_path) for file_path in stage['outputs']}}
+        save_manifest(manifest, artifact_dir)
+        if output:
+            print(output, end='')
+        if verbose:
+            print(f"[pipeline] executed  {name} in {elapsed:.1f} s")
+    return {name: artifacts[name] for name in targets}
+
+
+def override_params(stages, overrides):
+    """
+    Update the parameters of the stages in place.
+
+    Parameters
+    ----------
+    stages : list
+        The stages.
+    overrides : dict
+        Stage name -> dict of parameters to update.
+
+    Returns
+    -------
+    list
+        The stages.
+    """
+    stages_by_name = {stage['name']: stage for stage in stages}
+    for name, params in (overrides or {}).items():
+        if name not in stages_by_name:
+            raise ValueError(f"Unknown stage '{name}'.")
+        stages_by_name[name]['params'].update(params)
+    return stages
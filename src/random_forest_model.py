@@ -4,14 +4,16 @@ import pandas as pd
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.model_selection import train_test_split
 from sklearn.metrics import accuracy_score, roc_curve, auc
-import matplotlib.pyplot as plt
-import seaborn as sns
 
 # Permutation importance calculation
 from sklearn.inspection import permutation_importance
 
 # Project imports
 from data_preprocessing import load_data, feature_label_split
+from output_profiles import save_figure
+from instrumentation import span
+from flat_forest import forest_proba
+from shared_dataset import rf_resampling_in_workers
 
 def rf_normal_cancers(categories, 
                       dfs, 
@@ -24,7 +26,23 @@ def rf_normal_cancers(categories,
                       threshold = 0.05,
                       debug = True,
                       roc = False,
-                      save_feature_importances_list = False):
+                      save_feature_importances_list = False,
+                      plot_roc = True,
+                      return_roc_curves = False,
+                      n_jobs = None,
+                      workers = None,
+                      covariates = None):
+    # covariates: for every category, covariates of its samples aligned with its dataframe (see
+    # supplementary_tables.join_covariates(..., encode = True)), added to the biomarkers as features
+    if covariates is not None and workers is not None and workers > 1:
+        raise ValueError("The covariates are only used by the iterations run in this process (workers = None or 1).")
+
+    def features(subsampled_df, category_index):
+        biomarkers, labels = feature_label_split(subsampled_df, selected_biomarkers = selected_biomarkers)
+        if covariates is not None:
+            biomarkers = pd.concat([biomarkers, covariates[category_index].loc[subsampled_df.index]], axis=1)
+        return biomarkers, labels
+
     # Initialize variables for resampling
     feature_importance_list = []  # To store feature importance scores
     accuracies = []  # To store accuracies
@@ -55,85 +73,118 @@ def rf_normal_cancers(categories,
     else:
         sample_size = len(cancer_1_df)
 
-    # Loop through the specified number of iterations
-    for i in range(iterations):
-        # Step 1: Randomly sample from Normal dataset to match the minimum sample size
-        normal_subsampled_df = normal_df.sample(n=sample_size, random_state=i)
-        normal_biomarkers, normal_labels = feature_label_split(normal_subsampled_df, selected_biomarkers = selected_biomarkers)
-
-        # Step 2: Randomly sample from Cancer1 dataset to match the minimum sample size
-        cancer_1_subsampled_df = cancer_1_df.sample(n=sample_size, random_state=i)
-        cancer_1_biomarkers, cancer_1_labels = feature_label_split(cancer_1_subsampled_df, selected_biomarkers = selected_biomarkers)
-
-        # Step 3: Randomly sample from Cancer2 dataset (if present) to match the minimum sample size
-        if cancer2_category_index is not None:
-            cancer_2_subsampled_df = cancer_2_df.sample(n=sample_size, random_state=i)
-            cancer_2_biomarkers, cancer_2_labels = feature_label_split(cancer_2_subsampled_df, selected_biomarkers = selected_biomarkers)
-            
-        # Step 4: Randomly sample from Cancer3 dataset (if present) to match the minimum sample size
-        if cancer3_category_index is not None:
-            cancer_3_subsampled_df = cancer_3_df.sample(n=sample_size, random_state=i)
-            cancer_3_biomarkers, cancer_3_labels = feature_label_split(cancer_3_subsampled_df, selected_biomarkers = selected_biomarkers)
-
-        # Step 4: Combine Normal, Cancer1, Cancer2 (if present) and  Cancer3 (if present) samples
-        if cancer2_category_index is not None:
-            if cancer3_category_index is not None:
-                X = pd.concat([normal_biomarkers, cancer_1_biomarkers, cancer_2_biomarkers, cancer_3_biomarkers], ignore_index=True)
-                y = pd.concat([normal_labels, cancer_1_labels, cancer_2_labels, cancer_3_labels], ignore_index=True)
-            else:
-                X = pd.concat([normal_biomarkers, cancer_1_biomarkers, cancer_2_biomarkers], ignore_index=True)
-                y = pd.concat([normal_labels, cancer_1_labels, cancer_2_labels], ignore_index=True)
-        else:
-            X = pd.concat([normal_biomarkers, cancer_1_biomarkers], ignore_index=True)
-            y = pd.concat([normal_labels, cancer_1_labels], ignore_index=True)
-
-        # Step 5: Train-test split
-        if roc == True:
-            X_train, X_test, y_train, y_test = train_test_split(X, y, test_size = test_size, random_state = i, stratify=y)
-        else:
-            X_train, X_test, y_train, y_test = train_test_split(X, y, test_size = test_size, random_state = i)
-
-        # Step 6: Train RandomForestClassifier
-        rf_normal_ovary_pancreas = RandomForestClassifier(random_state=i)
-        rf_normal_ovary_pancreas.fit(X_train, y_train)
-
-        # Step 7: Make predictions on the test set
-        y_pred = rf_normal_ovary_pancreas.predict(X_test)
-        accuracy = accuracy_score(y_test, y_pred)
-        accuracies.append(accuracy)  # Store accuracy for this iteration
-        
-        # Step 8: Calculate AUC for this iteration
+    if workers is not None and workers > 1:
+        # The iterations run in worker processes, which read the samples from shared memory
+        category_indices = [c for c in [cancer1_category_index, cancer2_category_index, cancer3_category_index] if c is not None]
+        results, biomarker_names = rf_resampling_in_workers(categories, dfs, category_indices,
+                                                            selected_biomarkers = selected_biomarkers,
+                                                            iterations = iterations,
+                                                            test_size = test_size,
+                                                            roc_pos_label = categories[cancer1_category_index] if roc else None,
+                                                            workers = workers,
+                                                            n_jobs = n_jobs)
+        feature_importance_list = [result['importance'] for result in results]
+        accuracies = [result['accuracy'] for result in results]
         if roc:
-            pos_label = categories[cancer1_category_index]
-            # Predicted probabilities of the positive class
-            if cancer1_category_index > 5: 
-                y_pred_proba = rf_normal_ovary_pancreas.predict_proba(X_test)[:, 1]
-            else:
-                y_pred_proba = rf_normal_ovary_pancreas.predict_proba(X_test)[:, 0] 
-            fpr, tpr, _ = roc_curve(y_test, y_pred_proba, pos_label=pos_label)
-            roc_auc = auc(fpr, tpr)
-            auc_scores.append(roc_auc)  # Store AUC for this iteration
-            # Interpolate TPR values to align with mean FPR
-            fpr_values.append(fpr)
-            tpr_values.append(tpr)
-
-        # Step 8: Get feature importance scores and store them
-        # Permutation importance
-        # result = permutation_importance(rf_normal_ovary_pancreas, X_test, y_test, n_repeats=10, random_state=i, n_jobs=-1)
-        # importance = result.importances_mean
-        # MDI importance
-        importance = rf_normal_ovary_pancreas.feature_importances_
-        feature_importance_list.append(importance)
+            auc_scores = [result['auc'] for result in results]
+            fpr_values = [result['fpr'] for result in results]
+            tpr_values = [result['tpr'] for result in results]
+        model_classes = results[-1]['classes']
+    else:
+        # Loop through the specified number of iterations
+        for i in range(iterations):
+            with span('rf.sample', 'rf', iteration=i):
+                # Step 1: Randomly sample from Normal dataset to match the minimum sample size
+                normal_subsampled_df = normal_df.sample(n=sample_size, random_state=i)
+                normal_biomarkers, normal_labels = features(normal_subsampled_df, 5)
+
+                # Step 2: Randomly sample from Cancer1 dataset to match the minimum sample size
+                cancer_1_subsampled_df = cancer_1_df.sample(n=sample_size, random_state=i)
+                cancer_1_biomarkers, cancer_1_labels = features(cancer_1_subsampled_df, cancer1_category_index)
+
+                # Step 3: Randomly sample from Cancer2 dataset (if present) to match the minimum sample size
+                if cancer2_category_index is not None:
+                    cancer_2_subsampled_df = cancer_2_df.sample(n=sample_size, random_state=i)
+                    cancer_2_biomarkers, cancer_2_labels = features(cancer_2_subsampled_df, cancer2_category_index)
+                
+                # Step 4: Randomly sample from Cancer3 dataset (if present) to match the minimum sample size
+                if cancer3_category_index is not None:
+                    cancer_3_subsampled_df = cancer_3_df.sample(n=sample_size, random_state=i)
+                    cancer_3_biomarkers, cancer_3_labels = features(cancer_3_subsampled_df, cancer3_category_index)
+
+                # Step 4: Combine Normal, Cancer1, Cancer2 (if present) and  Cancer3 (if present) samples
+                if cancer2_category_index is not None:
+                    if cancer3_category_index is not None:
+                        X = pd.concat([normal_biomarkers, cancer_1_biomarkers, cancer_2_biomarkers, cancer_3_biomarkers], ignore_index=True)
+                        y = pd.concat([normal_labels, cancer_1_labels, cancer_2_labels, cancer_3_labels], ignore_index=True)
+                    else:
+                        X = pd.concat([normal_biomarkers, cancer_1_biomarkers, cancer_2_biomarkers], ignore_index=True)
+                        y = pd.concat([normal_labels, cancer_1_labels, cancer_2_labels], ignore_index=True)
+                else:
+                    X = pd.concat([normal_biomarkers, cancer_1_biomarkers], ignore_index=True)
+                    y = pd.concat([normal_labels, cancer_1_labels], ignore_index=True)
+
+            # Step 5: Train-test split
+            with span('rf.split', 'rf', iteration=i):
+                if roc == True:
+                    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size = test_size, random_state = i, stratify=y)
+                else:
+                    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size = test_size, random_state = i)
+
+            # Step 6: Train RandomForestClassifier
+            with span('rf.fit', 'rf', iteration=i):
+                rf_normal_ovary_pancreas = RandomForestClassifier(random_state=i, n_jobs=n_jobs)
+                rf_normal_ovary_pancreas.fit(X_train, y_train)
+
+            with span('rf.predict', 'rf', iteration=i):
+                # Step 7: Make predictions on the test set, from the probabilities, which also
+                # give the ROC curve
+                proba = forest_proba(rf_normal_ovary_pancreas, X_test)
+                y_pred = rf_normal_ovary_pancreas.classes_[np.argmax(proba, axis=1)]
+                accuracy = accuracy_score(y_test, y_pred)
+                accuracies.append(accuracy)  # Store accuracy for this iteration
+            
+                # Step 8: Calculate AUC for this iteration
+                if roc:
+                    pos_label = categories[cancer1_category_index]
+                    # Predicted probabilities of the positive class
+                    if cancer1_category_index > 5: 
+                        y_pred_proba = proba[:, 1]
+                    else:
+                        y_pred_proba = proba[:, 0] 
+                    fpr, tpr, _ = roc_curve(y_test, y_pred_proba, pos_label=pos_label)
+                    roc_auc = auc(fpr, tpr)
+                    auc_scores.append(roc_auc)  # Store AUC for this iteration
+                    # Interpolate TPR values to align with mean FPR
+                    fpr_values.append(fpr)
+                    tpr_values.append(tpr)
+
+            # Step 8: Get feature importance scores and store them
+            with span('rf.importance', 'rf', iteration=i):
+                # Permutation importance
+                # result = permutation_importance(rf_normal_ovary_pancreas, X_test, y_test, n_repeats=10, random_state=i, n_jobs=-1)
+                # importance = result.importances_mean
+                # MDI importance
+                importance = rf_normal_ovary_pancreas.feature_importances_
+                feature_importance_list.append(importance)
     
+        biomarker_names = X.columns
+        model_classes = rf_normal_ovary_pancreas.classes_
+
     if save_feature_importances_list:
         feature_importance_list_df = pd.DataFrame(feature_importance_list)
         feature_importance_list_df.to_csv(f"feature_importance_list_{categories[5]}_{categories[cancer1_category_index]}.csv", index=False)
+        # The accuracy (and AUC) of every iteration, alongside
+        iteration_metrics_df = pd.DataFrame({'Iteration': np.arange(iterations), 'Accuracy': accuracies})
+        if roc:
+            iteration_metrics_df['AUC'] = auc_scores
+        iteration_metrics_df.to_csv(f"rf_iteration_metrics_{categories[5]}_{categories[cancer1_category_index]}.csv", index=False)
         
     # Step 9: Average feature importance scores across all iterations
     average_importance = np.mean(feature_importance_list, axis=0)
 
     # Step 10: Rank biomarkers by average importance
-    feature_importance_df = pd.DataFrame({'Biomarker': X.columns, 'Importance': average_importance})
+    feature_importance_df = pd.DataFrame({'Biomarker': biomarker_names, 'Importance': average_importance})
     feature_importance_df = feature_importance_df.sort_values(by='Importance', ascending=False)
 
     # Step 11: Filter biomarkers with average importance >= 0.05
@@ -152,47 +203,86 @@ def rf_normal_cancers(categories,
         print(f"\nBiomarkers with Importance >= {threshold}:")
         print(important_biomarkers)
     
-    # Step 10: Plot 5 ROC curves
+    # Step 10: Plot 10 ROC curves
     if roc:
-        print(f"Model classes: {rf_normal_ovary_pancreas.classes_}")
-        # Select specific iterations to display ROC curves
-        selected_iterations = [0, 10, 20, 30, 40, 50, 60, 70, 80, 90]  # Iteration indices to plot
-
-        plt.figure(figsize=(12, 12))
-        for idx in selected_iterations:
-            if idx < len(fpr_values):  # Ensure the selected index is within bounds
-                fpr = fpr_values[idx]
-                tpr = tpr_values[idx]
-                roc_auc = auc(fpr, tpr)
-                plt.plot(fpr, tpr, lw=2, label=f"Iteration {idx} (AUC = {roc_auc:.3f})")
-            else:
-                print(f"Iteration {idx} is out of bounds and will be skipped.")
-
-        # Plot the random guess diagonal line
-        plt.plot([0, 1], [0, 1], linestyle="--", color="grey", label="Random Guess (AUC = 0.500)", lw=2)
-        
-        # Customize plot
-        plt.xlabel('False Positive Rate (FPR)', fontsize=18)
-        plt.ylabel('True Positive Rate (TPR)', fontsize=18)
-        plt.tick_params(axis='both', which='major', labelsize=14)
-        plt.tick_params(axis='both', which='minor', labelsize=12)
-        # plt.title('ROC Curves for Selected Iterations '+pos_label, fontsize=15)
-        plt.legend(loc="lower right", fontsize=12)
-        plt.grid(alpha=0.5)
-        plt.savefig(f"ROC_curves_{categories[5]}_{categories[cancer1_category_index]}.pdf", dpi = 600, bbox_inches='tight', format='pdf')
-        plt.show()
+        print(f"Model classes: {model_classes}")
+        if plot_roc:
+            plot_roc_curves(fpr_values, tpr_values, file_path = f"ROC_curves_{categories[5]}_{categories[cancer1_category_index]}.pdf", show = True)
         
+    if return_roc_curves:
+        return important_biomarkers, fpr_values, tpr_values
 
     return important_biomarkers
 
 
 
 
+def plot_roc_curves(fpr_values, 
+                    tpr_values, 
+                    file_path, 
+                    selected_iterations = [0, 10, 20, 30, 40, 50, 60, 70, 80, 90],
+                    show = False):
+    """
+    Plot the ROC curves of the selected iterations of `rf_normal_cancers` and save them.
+
+    Parameters
+    ----------
+    fpr_values : list
+        False positive rates, one array for each iteration.
+    tpr_values : list
+        True positive rates, one array for each iteration.
+    file_path : str
+        The path of the file. Its extension follows the active output profile.
+    selected_iterations : list, optional
+        Iteration indices to plot (default is every tenth of the first 100 iterations).
+    show : bool, optional
+        Whether to display the plot (default is False).
+
+    Returns
+    -------
+    str
+        The path of the saved file.
+    """
+    import matplotlib.pyplot as plt
+
+    fig = plt.figure(figsize=(12, 12))
+    for idx in selected_iterations:
+        if idx < len(fpr_values):  # Ensure the selected index is within bounds
+            fpr = fpr_values[idx]
+            tpr = tpr_values[idx]
+            roc_auc = auc(fpr, tpr)
+            plt.plot(fpr, tpr, lw=2, label=f"Iteration {idx} (AUC = {roc_auc:.3f})")
+        else:
+            print(f"Iteration {idx} is out of bounds and will be skipped.")
+
+    # Plot the random guess diagonal line
+    plt.plot([0, 1], [0, 1], linestyle="--", color="grey", label="Random Guess (AUC = 0.500)", lw=2)
+    
+    # Customize plot
+    plt.xlabel('False Positive Rate (FPR)', fontsize=18)
+    plt.ylabel('True Positive Rate (TPR)', fontsize=18)
+    plt.tick_params(axis='both', which='major', labelsize=14)
+    plt.tick_params(axis='both', which='minor', labelsize=12)
+    # plt.title('ROC Curves for Selected Iterations '+pos_label, fontsize=15)
+    plt.legend(loc="lower right", fontsize=12)
+    plt.grid(alpha=0.5)
+    file_path = save_figure(fig, file_path)
+    if show:
+        plt.show()
+    else:
+        plt.close(fig)
+    return file_path
+
+
+
 def plot_important_biomarkers(important_biomarkers, 
                               datasets = ['Normal', 'Ovary', 'Pancreas'], 
                               ax = None, 
                               color = 'goldenrod',
                               threshold = 0.05):
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+
     if ax is None:
         fig, ax = plt.subplots(figsize=(12, 6))
     sns.barplot(x='Importance', y='Biomarker', data=important_biomarkers, color = color, ax=ax)
@@ -0,0 +1,212 @@
+# Library imports
+import datetime
+import json
+import os
+import sqlite3
+import subprocess
+import numpy as np
+import pandas as pd
+
+# A results database in SQLite, recording every run of the screening: the importance tables and
+# the metrics of every random forest iteration, the selected biomarkers, the p-value matrices of
+# the Yuen-Welch's tests and the quantiles of every biomarker in every category. Every table is
+# indexed on (run, cancer, biomarker) and on (cancer, biomarker), so that the queries within a run
+# and across runs do not scan the tables.
+
+schema = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    created TEXT NOT NULL,
+    label TEXT,
+    data_file TEXT,
+    data_fingerprint TEXT,
+    git_commit TEXT,
+    params TEXT
+);
+CREATE TABLE IF NOT EXISTS importances (
+    run_id INTEGER NOT NULL REFERENCES runs(run_id) ON DELETE CASCADE,
+    cancer TEXT NOT NULL,
+    biomarker TEXT NOT NULL,
+    importance REAL,
+    selected INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS iteration_importances (
+    run_id INTEGER NOT NULL REFERENCES runs(run_id) ON DELETE CASCADE,
+    cancer TEXT NOT NULL,
+    biomarker TEXT NOT NULL,
+    iteration INTEGER NOT NULL,
+    importance REAL
+);
+CREATE TABLE IF NOT EXISTS iteration_metrics (
+    run_id INTEGER NOT NULL REFERENCES runs(run_id) ON DELETE CASCADE,
+    cancer TEXT NOT NULL,
+    iteration INTEGER NOT NULL,
+    accuracy REAL,
+    auc REAL
+);
+CREATE TABLE IF NOT EXISTS selections (
+    run_id INTEGER NOT NULL REFERENCES runs(run_id) ON DELETE CASCADE,
+    cancer TEXT NOT NULL,
+    biomarker TEXT NOT NULL,
+    step TEXT NOT NULL,
+    shared_with TEXT
+);
+CREATE TABLE IF NOT EXISTS p_values (
+    run_id INTEGER NOT NULL REFERENCES runs(run_id) ON DELETE CASCADE,
+    cancer TEXT NOT NULL,
+    biomarker TEXT NOT NULL,
+    other_category TEXT NOT NULL,
+    test TEXT NOT NULL,
+    p_value REAL
+);
+CREATE TABLE IF NOT EXISTS quantiles (
+    run_id INTEGER NOT NULL REFERENCES runs(run_id) ON DELETE CASCADE,
+    category TEXT NOT NULL,
+    biomarker TEXT NOT NULL,
+    quantile REAL NOT NULL,
+    value REAL
+);
+CREATE INDEX IF NOT EXISTS importances_run ON importances (run_id, cancer, biomarker);
+CREATE INDEX IF NOT EXISTS importances_cancer ON importances (cancer, biomarker);
+CREATE INDEX IF NOT EXISTS iteration_importances_run ON iteration_importances (run_id, cancer, biomarker, iteration);
+CREATE INDEX IF NOT EXISTS iteration_importances_cancer ON iteration_importances (cancer, biomarker);
+CREATE INDEX IF NOT EXISTS iteration_metrics_run ON iteration_metrics (run_id, cancer, iteration);
+CREATE INDEX IF NOT EXISTS selections_run ON selections (run_id, cancer, biomarker);
+CREATE INDEX IF NOT EXISTS selections_cancer ON selections (cancer, biomarker);
+CREATE INDEX IF NOT EXISTS p_values_run ON p_values (run_id, cancer, biomarker);
+CREATE INDEX IF NOT EXISTS p_values_cancer ON p_values (cancer, biomarker);
+CREATE INDEX IF NOT EXISTS quantiles_run ON quantiles (run_id, category, biomarker);
+CREATE INDEX IF NOT EXISTS quantiles_category ON quantiles (category, biomarker);
+"""
+
+
+def open_results_store(db_path = "results.sqlite"):
+    """
+    Open the results database, creating its tables and indexes if needed.
+
+    Returns
+    -------
+    sqlite3.Connection
+        The connection, in WAL mode, so that dashboards can read while a run is recorded.
+    """
+    connection = sqlite3.connect(db_path)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA foreign_keys=ON")
+    connection.executescript(schema)
+    return connection
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output = True, text = True, check = True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def record_run(connection, label = None, data_file = None, data_fingerprint = None, params = None):
+    """
+    Add a run, and return its run_id.
+    """
+    cursor = connection.execute("INSERT INTO runs (created, label, data_file, data_fingerprint, git_commit, params) VALUES (?, ?, ?, ?, ?, ?)",
+                                (datetime.datetime.now().isoformat(timespec='seconds'), label, data_file, data_fingerprint, _git_commit(),
+                                 json.dumps(params or {}, sort_keys=True, default=lambda obj: obj.tolist() if isinstance(obj, np.ndarray) else str(obj))))
+    return cursor.lastrowid
+
+
+def record_importances(connection, run_id, cancer, importance_df, selected_biomarkers = ()):
+    """
+    Record an importance table, with the columns Biomarker and Importance. The biomarkers in
+    `selected_biomarkers` are flagged as selected by the random forest.
+    """
+    selected_biomarkers = set(selected_biomarkers)
+    connection.executemany("INSERT INTO importances VALUES (?, ?, ?, ?, ?)",
+                           [(run_id, cancer, biomarker, float(importance), int(biomarker in selected_biomarkers))
+                            for biomarker, importance in zip(importance_df['Biomarker'], importance_df['Importance'])])
+
+
+def record_iterations(connection, run_id, cancer, iteration_importances_df = None, iteration_metrics_df = None):
+    """
+    Record the importance scores of every iteration (iterations x biomarkers), and the metrics
+    of every iteration (the columns Iteration, Accuracy and optionally AUC).
+    """
+    if iteration_importances_df is not None:
+        connection.executemany("INSERT INTO iteration_importances VALUES (?, ?, ?, ?, ?)",
+                               [(run_id, cancer, biomarker, int(iteration), float(importance))
+                                for biomarker in iteration_importances_df.columns
+                                for iteration, importance in iteration_importances_df[biomarker].items()])
+    if iteration_metrics_df is not None:
+        aucs = iteration_metrics_df['AUC'] if 'AUC' in iteration_metrics_df else [None] * len(iteration_metrics_df)
+        connection.executemany("INSERT INTO iteration_metrics VALUES (?, ?, ?, ?, ?)",
+                               [(run_id, cancer, int(iteration), float(accuracy), None if auc is None else float(auc))
+                                for iteration, accuracy, auc in zip(iteration_metrics_df['Iteration'], iteration_metrics_df['Accuracy'], aucs)])
+
+
+def record_selections(connection, run_id, cancer, step, biomarkers):
+    """
+    Record the biomarkers selected at a step of the screening of a cancer type, each given by
+    its name or as a (name, shared nature) tuple.
+    """
+    rows = []
+    for biomarker in biomarkers:
+        biomarker, shared_with = biomarker if isinstance(biomarker, tuple) else (biomarker, None)
+        rows.append((run_id, cancer, biomarker, step, None if shared_with is None else json.dumps(list(shared_with))))
+    connection.executemany("INSERT INTO selections VALUES (?, ?, ?, ?, ?)", rows)
+
+
+def record_p_values(connection, run_id, cancer, p_df, test = 'ywtest'):
+    """
+    Record a p-value matrix (biomarkers x other categories), as returned by `stats_tests.p_value_matrix`.
+    """
+    connection.executemany("INSERT INTO p_values VALUES (?, ?, ?, ?, ?, ?)",
+                           [(run_id, cancer, biomarker, other_category, test, float(p_value))
+                            for biomarker, row in p_df.iterrows() for other_category, p_value in row.items()])
+
+
+def record_quantiles(connection, run_id, quantiles_df):
+    """
+    Record a quantile cube, as returned by `desc_stats.quantile_cube`.
+    """
+    connection.executemany("INSERT INTO quantiles VALUES (?, ?, ?, ?, ?)",
+                           [(run_id, category, biomarker, float(quantile), float(value))
+                            for category, biomarker, quantile, value in quantiles_df[['Category', 'Biomarker', 'Quantile', 'Value']].itertuples(index=False)])
+
+
+def query_results(connection, sql, params = ()):
+    """
+    Run a query on the results database.
+
+    Returns
+    -------
+    pd.DataFrame
+        The rows of the query.
+    """
+    return pd.read_sql_query(sql, connection, params = params)
+
+
+def importances_across_runs(connection, cancer, biomarker = None):
+    """
+    The average importance of the biomarkers (or of one biomarker) of a cancer type in every run.
+    """
+    sql = ("SELECT runs.run_id, runs.created, runs.label, importances.biomarker, importances.importance, importances.selected "
+           "FROM importances JOIN runs USING (run_id) WHERE importances.cancer = ?")
+    params = [cancer]
+    if biomarker is not None:
+        sql += " AND importances.biomarker = ?"
+        params.append(biomarker)
+    return query_results(connection, sql + " ORDER BY runs.run_id, importances.importance DESC", params)
+
+
+def p_values_across_runs(connection, cancer, biomarker):
+    """
+    The p-values of a biomarker of a cancer type versus the other categories, in every run.
+    """
+    return query_results(connection,
+                         "SELECT run_id, other_category, test, p_value FROM p_values WHERE cancer = ? AND biomarker = ? ORDER BY run_id, other_category",
+                         (cancer, biomarker))
+
+
+def list_runs(connection):
+    """
+    The recorded runs.
+    """
+    return query_results(connection, "SELECT run_id, created, label, data_file, git_commit FROM runs ORDER BY run_id")
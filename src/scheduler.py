@@ -0,0 +1,125 @@
+# Library imports
+import io
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from contextlib import redirect_stdout, nullcontext
+
+#  Project imports
+from instrumentation import span, enable_tracing, tracing_enabled, reset_trace, trace_events, extend_trace
+
+
+def split_worker_budget(workers = None, n_chains = 8):
+    """
+    Split a budget of workers between concurrent chains of stages and the threads of each
+    random forest.
+
+    Parameters
+    ----------
+    workers : int, optional
+        The total number of workers (default is the number of CPUs).
+    n_chains : int, optional
+        The number of independent chains that can run concurrently (default is 8, the number of
+        cancer types).
+
+    Returns
+    -------
+    tuple
+        The number of stage processes and the number of random forest threads per process.
+    """
+    workers = workers or os.cpu_count() or 1
+    stage_workers = max(1, min(n_chains, workers))
+    rf_jobs = max(1, workers // stage_workers)
+    return stage_workers, rf_jobs
+
+
+def execute_stage(name, function, args, kwargs, capture_output = False, trace = None):
+    """
+    Execute a stage function, within a span named after the stage.
+
+    With `trace` (True or False, default is None), the function is executed in a worker process:
+    tracing is switched on or off as in the parent process, and the spans recorded during the
+    stage are returned instead of being kept.
+
+    Returns
+    -------
+    tuple
+        The artifact, the elapsed time in seconds, the printed output if `capture_output` is True
+        (otherwise None, and the output is printed as it comes), and the recorded spans if
+        `trace` is given (otherwise None).
+    """
+    if trace is not None:
+        enable_tracing(trace)
+        reset_trace()
+    start = time.perf_counter()
+    buffer = io.StringIO() if capture_output else None
+    with span(name, 'stage'), redirect_stdout(buffer) if capture_output else nullcontext():
+        artifact = function(*args, **kwargs)
+    elapsed = time.perf_counter() - start
+    events = None
+    if trace is not None:
+        events = trace_events()
+        reset_trace()
+    return artifact, elapsed, None if buffer is None else buffer.getvalue(), events
+
+
+def schedule_stages(stages_by_name, order, dirty, artifacts, max_workers = 1, verbose = True):
+    """
+    Execute the dirty stages, each as soon as the artifacts of its inputs are available.
+
+    With max_workers > 1, the independent stages (e.g., the chains of the different cancer types)
+    run concurrently in a process pool, and the printed output of each stage is collected and
+    returned as a block instead of being interleaved.
+
+    Parameters
+    ----------
+    stages_by_name : dict
+        The stages, by name.
+    order : list
+        The names of the stages in topological order.
+    dirty : set
+        The names of the stages to execute.
+    artifacts : dict
+        The artifacts available so far, by stage name. It is updated with the executed stages.
+    max_workers : int, optional
+        The number of stage processes (default is 1, i.e., the stages are executed in order in
+        the current process).
+    verbose : bool, optional
+        Whether to print the stages as they are started (default is True).
+
+    Yields
+    ------
+    tuple
+        The name, the artifact, the elapsed time and the printed output of every executed stage,
+        in order of completion.
+    """
+    pending = [name for name in order if name in dirty]
+    if max_workers == 1:
+        for name in pending:
+            stage = stages_by_name[name]
+            if verbose:
+                print(f"[pipeline] executing {name}")
+            artifact, elapsed, output, _ = execute_stage(name, stage['function'], [artifacts[input_name] for input_name in stage['inputs']],
+                                                         {**stage['params'], **stage['runtime']})
+            artifacts[name] = artifact
+            yield name, artifact, elapsed, output
+        return
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        running = {}
+        while pending or running:
+            for name in [name for name in pending if all(input_name in artifacts for input_name in stages_by_name[name]['inputs'])]:
+                stage = stages_by_name[name]
+                if verbose:
+                    print(f"[pipeline] executing {name}")
+                future = executor.submit(execute_stage, name, stage['function'], [artifacts[input_name] for input_name in stage['inputs']],
+                                         {**stage['params'], **stage['runtime']}, True, tracing_enabled())
+                running[future] = name
+                pending.remove(name)
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                artifact, elapsed, output, events = future.result()
+                extend_trace(events)
+                artifacts[name] = artifact
+                yield name, artifact, elapsed, output
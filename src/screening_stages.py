@@ -0,0 +1,358 @@
+# Library imports
+import numpy as np
+import pandas as pd
+
+#  Project imports
+from extract_blood_test_table import extract_blood_test_table
+from append_sheets_by_tumor_type import append_sheets_by_tumor_type
+from data_preprocessing import load_data, feature_label_split, number_of_biomarkers
+from random_forest_model import rf_normal_cancers
+from desc_stats import cancer_biomarkers_uniquely_high, cancer_biomarkers_higher_side_filtering, quantile_cube
+from stats_tests import find_shared_nature_of_biomarkers, heatmap_shared_nature, p_value_matrix
+from figure_data import quartile_levels_dataframe, boxplot_dataframes, q3_rank_dataframe, normalized_quartile_levels, mdi_convergence
+from pipeline import stage
+from fingerprint import file_fingerprint
+from results_store import (open_results_store, record_run, record_importances, record_iterations, record_selections,
+                           record_p_values, record_quantiles)
+
+# The stage functions of the biomarker screening pipeline. Every stage function takes the artifacts
+# of its input stages as positional arguments and its parameters as keyword arguments.
+
+
+def extract_cohort(file_path = "data/aar3247_cohen_sm_tables-s1-s11.xlsx"):
+    """
+    Extract the blood test table from the supplementary tables and split it by tumor type
+    into "data/clinical_cancer_data.xlsx".
+    """
+    extract_blood_test_table(file_path)
+    append_sheets_by_tumor_type()
+
+
+def load_cohort(*upstream, file_path = "data/clinical_cancer_data.xlsx"):
+    """
+    Load the categories and the dataframes of the cohort. The upstream artifacts (if any) only
+    order the stage after the extraction of the data.
+    """
+    return load_data(file_path)
+
+
+def collect(*artifacts):
+    """
+    Collect the artifacts of the input stages into a list.
+    """
+    return list(artifacts)
+
+
+def rf_screening(data, cancer_category_index, iterations = 100, threshold = 0.04, selected_biomarkers = None, debug = True, n_jobs = None):
+    """
+    Random forest classification of Normal + cancer samples, with the MDI importance of every
+    iteration saved to "feature_importance_list_Normal_<cancer>.csv", and its accuracy to
+    "rf_iteration_metrics_Normal_<cancer>.csv".
+
+    Returns
+    -------
+    pd.DataFrame
+        The biomarkers with average importance >= threshold, sorted by importance, indexed by
+        their biomarker indices. With `selected_biomarkers` (default is None, i.e., all the
+        biomarkers), only the given biomarker indices are used.
+    """
+    categories, dfs = data
+    selected_biomarkers = np.arange(number_of_biomarkers(dfs[0])) if selected_biomarkers is None else np.asarray(selected_biomarkers)
+    important_biomarkers = rf_normal_cancers(categories = categories,
+                                             dfs = dfs,
+                                             cancer1_category_index = cancer_category_index,
+                                             selected_biomarkers = selected_biomarkers,
+                                             iterations = iterations,
+                                             threshold = threshold,
+                                             debug = debug,
+                                             save_feature_importances_list = True,
+                                             n_jobs = n_jobs)
+    # The importance scores are indexed by position among the selected biomarkers
+    important_biomarkers.index = selected_biomarkers[important_biomarkers.index]
+    return important_biomarkers
+
+
+def descriptive_filtering(data, important_biomarkers, cancer_category_index):
+    """
+    Filter the biomarkers selected by the random forest through the uniquely high level and the
+    higher side filtering criteria.
+
+    Returns
+    -------
+    list
+        The indices of the biomarkers with uniquely high levels, followed by the indices of the
+        biomarkers passing the higher side filtering.
+    """
+    categories, dfs = data
+    important_biomarker_indices_in_RF = list(important_biomarkers.index)
+    biomarkers_uniquely_high = cancer_biomarkers_uniquely_high(categories = categories,
+                                                               dfs = dfs,
+                                                               cancer_important_biomarker_indices_in_RF = important_biomarker_indices_in_RF)
+
+    candidates_for_higher_side_filtering = important_biomarker_indices_in_RF.copy()
+    if len(biomarkers_uniquely_high) != 0:
+        candidates_for_higher_side_filtering.remove(biomarkers_uniquely_high[0])
+
+    biomarkers_higher_side = cancer_biomarkers_higher_side_filtering(categories = categories,
+                                                                     dfs = dfs,
+                                                                     cancer_category_index = cancer_category_index,
+                                                                     cancer_candidates_for_higher_side_filtering = candidates_for_higher_side_filtering)
+    return biomarkers_uniquely_high + biomarkers_higher_side
+
+
+def yuen_welch_screening(data, selected_biomarkers, cancer_category_index, p_threshold = 0.05, debug = True):
+    """
+    Yuen-Welch's test of the selected biomarkers' levels in the cancer samples versus all the
+    other cancer types.
+
+    Returns
+    -------
+    list
+        (biomarker index, shared nature) tuples of the finalized biomarkers.
+    """
+    categories, dfs = data
+    return find_shared_nature_of_biomarkers(categories = categories,
+                                            dfs = dfs,
+                                            cancer_category_index = cancer_category_index,
+                                            cancer_selected_biomarkers = selected_biomarkers,
+                                            p_threshold = p_threshold,
+                                            debug = debug)
+
+
+def roc_analysis(data, shared_nature_of_biomarkers, cancer_category_index, test_size = 0.4, iterations = 100, threshold = 0.01, debug = True, n_jobs = None):
+    """
+    Stratified random forest classification of Normal + cancer samples with the finalized biomarkers.
+
+    Returns
+    -------
+    tuple
+        The false positive rates and the true positive rates of every iteration.
+    """
+    categories, dfs = data
+    finalized_biomarkers = [i for i, _ in shared_nature_of_biomarkers]
+    _, fpr_values, tpr_values = rf_normal_cancers(categories = categories,
+                                                  dfs = dfs,
+                                                  cancer1_category_index = cancer_category_index,
+                                                  selected_biomarkers = np.array(finalized_biomarkers),
+                                                  test_size = test_size,
+                                                  iterations = iterations,
+                                                  threshold = threshold,
+                                                  debug = debug,
+                                                  roc = True,
+                                                  plot_roc = False,
+                                                  return_roc_curves = True,
+                                                  n_jobs = n_jobs)
+    return fpr_values, tpr_values
+
+
+def combined_rf(data, *shared_natures_of_biomarkers, cancer_category_indices = (3, 6, 7), test_size = 0.4, iterations = 100, threshold = 0.05, debug = True, n_jobs = None):
+    """
+    Random forest classification of Normal + all the given cancer types together, with the union
+    of their finalized biomarkers.
+    """
+    categories, dfs = data
+    finalized_biomarkers = [i for shared_nature_of_biomarkers in shared_natures_of_biomarkers for i, _ in shared_nature_of_biomarkers]
+    cancer1_category_index, cancer2_category_index, cancer3_category_index = (list(cancer_category_indices) + [None, None])[:3]
+    return rf_normal_cancers(categories = categories,
+                             dfs = dfs,
+                             cancer1_category_index = cancer1_category_index,
+                             cancer2_category_index = cancer2_category_index,
+                             cancer3_category_index = cancer3_category_index,
+                             selected_biomarkers = np.array(finalized_biomarkers),
+                             test_size = test_size,
+                             iterations = iterations,
+                             threshold = threshold,
+                             debug = debug,
+                             n_jobs = n_jobs)
+
+
+def screening_summary(data, *shared_natures_of_biomarkers, cancer_category_indices):
+    """
+    The finalized biomarkers of every cancer type, by name, with their shared nature.
+
+    Returns
+    -------
+    dict
+        Cancer type -> list of (biomarker, shared nature) tuples.
+    """
+    categories, dfs = data
+    biomarkers = feature_label_split(dfs[0])[0].columns
+    return {categories[cancer_category_index]: [(biomarkers[i], shared) for i, shared in shared_nature_of_biomarkers]
+            for cancer_category_index, shared_nature_of_biomarkers in zip(cancer_category_indices, shared_natures_of_biomarkers)}
+
+
+def quantile_statistics(data, quantile_cuts = (0.25, 0.5, 0.75)):
+    """
+    The quantiles of all the biomarkers in all the categories (see `desc_stats.quantile_cube`).
+    """
+    categories, dfs = data
+    return quantile_cube(categories, dfs, quantile_cuts)
+
+
+def p_value_matrices(data, cancer_category_indices, test_type = 'ywtest'):
+    """
+    The p-values of all the biomarkers' levels in every given cancer type versus the other categories.
+
+    Returns
+    -------
+    dict
+        Cancer type -> p-value matrix (biomarkers x other categories).
+    """
+    categories, dfs = data
+    return {categories[cancer_category_index]: p_value_matrix(categories, dfs, cancer_category_index, test_type = test_type)
+            for cancer_category_index in cancer_category_indices}
+
+
+def record_screening_results(db_path, stages, artifacts, label = None):
+    """
+    Record the results of a run of the screening stages in the results database: the importance
+    table and the iterations of every random forest stage (read from the files written by the
+    stage), the biomarkers selected at every step, the p-value matrices and the quantile cube.
+    Only the stages whose artifacts are given are recorded.
+
+    Parameters
+    ----------
+    db_path : str
+        The results database.
+    stages : list
+        The stages of the run.
+    artifacts : dict
+        The artifacts of the run, by stage name (they must include 'data').
+    label : str, optional
+        A label of the run (default is None).
+
+    Returns
+    -------
+    int
+        The run_id of the recorded run.
+    """
+    categories, dfs = artifacts['data']
+    biomarkers = feature_label_split(dfs[0])[0].columns
+    stages_by_name = {stage['name']: stage for stage in stages}
+    data_file = stages_by_name['data']['params']['file_path']
+
+    connection = open_results_store(db_path)
+    with connection:
+        run_id = record_run(connection, label = label, data_file = data_file, data_fingerprint = file_fingerprint(data_file),
+                            params = {stage['name']: stage['params'] for stage in stages})
+        for name, artifact in artifacts.items():
+            function, params = stages_by_name[name]['function'], stages_by_name[name]['params']
+            if function is rf_screening:
+                cancer = categories[params['cancer_category_index']]
+                selected_biomarkers = np.arange(len(biomarkers)) if params.get('selected_biomarkers') is None else np.asarray(params['selected_biomarkers'])
+                importance_file, metrics_file = stages_by_name[name]['outputs']
+                iteration_importances_df = pd.read_csv(importance_file)
+                iteration_importances_df.columns = biomarkers[selected_biomarkers]
+                record_importances(connection, run_id, cancer,
+                                   pd.DataFrame({'Biomarker': iteration_importances_df.columns, 'Importance': iteration_importances_df.mean().to_numpy()}),
+                                   selected_biomarkers = artifact['Biomarker'])
+                record_iterations(connection, run_id, cancer, iteration_importances_df, pd.read_csv(metrics_file))
+                record_selections(connection, run_id, cancer, 'rf', list(artifact['Biomarker']))
+            elif function is combined_rf:
+                cancer = "+".join(categories[c] for c in params['cancer_category_indices'])
+                record_importances(connection, run_id, cancer, artifact, selected_biomarkers = artifact['Biomarker'])
+            elif function is descriptive_filtering:
+                record_selections(connection, run_id, categories[params['cancer_category_index']], 'filter', [biomarkers[i] for i in artifact])
+            elif function is yuen_welch_screening:
+                record_selections(connection, run_id, categories[params['cancer_category_index']], 'yuen_welch',
+                                  [(biomarkers[i], shared) for i, shared in artifact])
+            elif function is p_value_matrices:
+                for cancer, p_df in artifact.items():
+                    record_p_values(connection, run_id, cancer, p_df, test = params.get('test_type', 'ywtest'))
+            elif function is quantile_statistics:
+                record_quantiles(connection, run_id, artifact)
+    connection.close()
+    return run_id
+
+
+def screening_figure_specs(data,
+                           importance_scores,
+                           selected_biomarkers,
+                           roc_curves,
+                           roc_category_indices = (3, 6, 7),
+                           heatmap_category_indices = (2, 3, 4, 6, 7, 8),
+                           removed_biomarkers = ('TGFa', 'IL-8', 'CYFRA 21-1', 'sFas', 'sEGFR', 'NSE', 'TIMP-1'),
+                           biplot_category_indices = (3, 6, 7),
+                           mdi_file_path = "feature_importance_list_Normal_Ovary.csv",
+                           mdi_biomarker_indices = (3, 29, 18, 35, 31, 37, 16),
+                           p_threshold = 0.05):
+    """
+    The data of every figure, as (function, kwargs) specifications for `figures.render_figures`.
+
+    Parameters
+    ----------
+    data : tuple
+        The categories and the dataframes of the cohort.
+    importance_scores : list
+        The random forest importance scores of the eight cancer types, in category order.
+    selected_biomarkers : list
+        The biomarkers selected by the descriptive statistics filtering, one list for each of
+        `heatmap_category_indices`.
+    roc_curves : list
+        The (fpr_values, tpr_values) tuples, one for each of `roc_category_indices`.
+
+    Returns
+    -------
+    list
+        The figure specifications.
+    """
+    # The plotting modules are imported only when the figures are prepared
+    from figures import (plot_important_biomarkers_grid, plot_quartile_boxplots, plot_q3_rank_pies, plot_shared_nature_heatmaps,
+                         plot_quartile_heatmap, plot_mdi_convergence, plot_mdi_stability)
+    from random_forest_model import plot_roc_curves
+    from pca_biplot import pca_biplot_specs
+
+    categories, dfs = data
+    biomarkers = feature_label_split(dfs[0])[0].columns
+    figure_specs = [(plot_important_biomarkers_grid, dict(importance_scores = importance_scores, categories = categories, file_path = "FIG2.pDF"))]
+
+    # ROC curves of the finalized biomarkers
+    figure_specs += [(plot_roc_curves, dict(fpr_values = fpr_values, tpr_values = tpr_values, file_path = f"ROC_curves_{categories[5]}_{categories[i]}.pdf"))
+                     for i, (fpr_values, tpr_values) in zip(roc_category_indices, roc_curves)]
+
+    # Descriptive statistics based filtering: uniquely high levels and higher side filtering
+    cv_boxplot_df = quartile_levels_dataframe(categories = categories, dfs = dfs, importance_scores = importance_scores)
+    figure_specs.append((plot_quartile_boxplots, dict(boxplot_dfs = boxplot_dataframes(cv_boxplot_df), file_path = "FIG3.pDF")))
+    higher_side_data_rows_df = q3_rank_dataframe(categories = categories, cv_boxplot_df = cv_boxplot_df, importance_scores = importance_scores)
+    figure_specs.append((plot_q3_rank_pies, dict(higher_side_data_rows_df = higher_side_data_rows_df, file_path = "FIG4.pDF")))
+
+    # Yuen-Welch's test
+    heatmap_shared_natures = [heatmap_shared_nature(categories = categories, dfs = dfs, cancer_category_index = i, cancer_selected_biomarkers = cancer_selected_biomarkers, p_threshold = p_threshold)
+                              for i, cancer_selected_biomarkers in zip(heatmap_category_indices, selected_biomarkers)]
+    figure_specs.append((plot_shared_nature_heatmaps, dict(heatmap_shared_natures = heatmap_shared_natures, titles = [categories[i] for i in heatmap_category_indices], file_path = "FIG5.pDF")))
+
+    # Heatmaps of the selected biomarkers
+    random_forest_biomarkers = list(cv_boxplot_df.Biomarker.unique())
+    finalized_biomarkers = [biomarker for biomarker in random_forest_biomarkers if biomarker not in removed_biomarkers]
+    df_q2_norm, df_q3_norm = normalized_quartile_levels(cv_boxplot_df = cv_boxplot_df, finalized_biomarkers = finalized_biomarkers)
+    figure_specs += [(plot_quartile_heatmap, dict(df_norm = df_q2_norm, file_path = "q2_heatmap.pdf")),
+                     (plot_quartile_heatmap, dict(df_norm = df_q3_norm, file_path = "q3_heatmap.pdf"))]
+
+    # PCA biplots
+    figure_specs += pca_biplot_specs(categories = categories, dfs = dfs, cancer_category_indices = list(biplot_category_indices))
+
+    # Limitations: convergence and stability of the MDI importance scores
+    cumulative_mean, delta_mean = mdi_convergence(mdi_file_path)
+    figure_specs += [(plot_mdi_convergence, dict(cumulative_mean = cumulative_mean, biomarker_indices = list(mdi_biomarker_indices), biomarker_labels = [biomarkers[i] for i in mdi_biomarker_indices])),
+                     (plot_mdi_stability, dict(delta_mean = delta_mean))]
+    return figure_specs
+
+
+def cancer_screening_stages(cancer, cancer_category_index, yuen_welch = True, rf_threshold = 0.04, iterations = 100, p_threshold = 0.05, debug = True, n_jobs = None):
+    """
+    The chain of stages screening one cancer type: random forest classification, descriptive
+    statistics filtering and (optionally) Yuen-Welch's test. The stages are named
+    "rf_<cancer>", "filter_<cancer>" and "yuen_welch_<cancer>", with the cancer type in lower case.
+    n_jobs is the number of threads of each random forest.
+    """
+    stages = [stage(f"rf_{cancer.lower()}", rf_screening, inputs = ['data'],
+                    params = dict(cancer_category_index = cancer_category_index, iterations = iterations, threshold = rf_threshold),
+                    outputs = [f"feature_importance_list_Normal_{cancer}.csv", f"rf_iteration_metrics_Normal_{cancer}.csv"],
+                    runtime = dict(debug = debug, n_jobs = n_jobs)),
+              stage(f"filter_{cancer.lower()}", descriptive_filtering, inputs = ['data', f"rf_{cancer.lower()}"],
+                    params = dict(cancer_category_index = cancer_category_index))]
+    if yuen_welch:
+        stages.append(stage(f"yuen_welch_{cancer.lower()}", yuen_welch_screening, inputs = ['data', f"filter_{cancer.lower()}"],
+                            params = dict(cancer_category_index = cancer_category_index, p_threshold = p_threshold),
+                            runtime = dict(debug = debug)))
+    return stages
@@ -0,0 +1,212 @@
+# Library imports
+import os
+import pickle
+import numpy as np
+import pandas as pd
+from scipy.stats import t as student_t, mannwhitneyu
+
+#  Project imports
+from data_preprocessing import feature_label_split
+from streaming_stats import running_moments, chunk_moments, merge_moments
+
+# The inputs of the screening tests and filters, kept up to date as new samples arrive: for every
+# category, the levels of every biomarker sorted (NaN last), their running moments, their exact
+# quantiles, and the trimmed means and Winsorized variances of Yuen-Welch's test. New samples only
+# update the categories they belong to. A Yuen-Welch test of two categories is then computed from
+# their inputs in constant time, and a U-test from their sorted levels, only for the pairs of
+# categories of which one received samples.
+#
+# A screening state can stand for the dataframes of the cohort in the descriptive statistics
+# filters (see `desc_stats.quantiles_across_categories`).
+
+
+def _category_inputs(state, category_index):
+    # Update the quantiles and the inputs of Yuen-Welch's test of a category from its sorted levels
+    levels = state['levels'][category_index]
+    counts = len(levels) - state['moments'][category_index]['missing'].astype(int)
+    for quantile_cut, quantiles in state['quantiles'].items():
+        quantiles[category_index] = [np.quantile(levels[:count, j], quantile_cut) if count > 0 else np.nan
+                                     for j, count in enumerate(counts)]
+
+    # The trimmed mean and the Winsorized variance, as in scipy.stats.ttest_ind(..., trim=trim);
+    # with missing values, the test is NaN, as in scipy
+    n = len(levels)
+    g = int(n * state['trim'])
+    h = n - 2 * g
+    winsorized = levels.copy()
+    if g > 0:
+        winsorized[:g] = levels[g]
+        winsorized[n - g:] = levels[n - g - 1]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = levels[g:n - g].mean(axis=0)
+        variance = winsorized.var(axis=0, ddof=2 * g + 1) / h
+    missing = counts < n
+    state['yuen']['mean'][category_index] = np.where(missing, np.nan, mean)
+    state['yuen']['variance'][category_index] = np.where(missing, np.nan, variance)
+    state['yuen']['h'][category_index] = h
+
+
+def screening_state(categories, dfs, quantile_cuts = (0.25, 0.5, 0.75), trim = 0.1):
+    """
+    The screening state of a cohort.
+
+    Parameters
+    ----------
+    categories : list
+        The categories.
+    dfs : list
+        The dataframes of the categories.
+    quantile_cuts : tuple, optional
+        The quantiles kept for every category and biomarker (default is Q1, Q2 and Q3). Others
+        are added by `state_quantiles` when first needed.
+    trim : float, optional
+        The trimming of Yuen-Welch's test (default is 0.1).
+
+    Returns
+    -------
+    dict
+        The categories, the biomarkers and the columns of the cohort, and for every category the
+        sorted levels, the running moments, the quantiles and the inputs of Yuen-Welch's test.
+    """
+    biomarkers = list(feature_label_split(dfs[0])[0].columns)
+    n_categories, n_biomarkers = len(categories), len(biomarkers)
+    state = {'categories': list(categories),
+             'biomarkers': biomarkers,
+             'columns': list(dfs[0].columns),
+             'trim': trim,
+             'levels': [],
+             'moments': [],
+             'quantiles': {quantile_cut: np.full((n_categories, n_biomarkers), np.nan) for quantile_cut in quantile_cuts},
+             'yuen': {key: np.full((n_categories, n_biomarkers), np.nan) for key in ['mean', 'variance', 'h']},
+             # The p-values of the U-tests, computed when first needed
+             'utest': np.full((n_categories, n_categories, n_biomarkers), np.nan),
+             'utest_stale': np.ones((n_categories, n_categories), dtype=bool)}
+    for category_index, df in enumerate(dfs):
+        levels = feature_label_split(df)[0].apply(pd.to_numeric, errors='coerce').to_numpy(dtype=float)
+        state['levels'].append(np.sort(levels, axis=0))
+        state['moments'].append(merge_moments(running_moments(n_biomarkers), chunk_moments(levels)))
+        _category_inputs(state, category_index)
+    return state
+
+
+def add_samples(state, data, samples):
+    """
+    Add new samples to the screening state, in place, and to the data of the cohort.
+
+    Parameters
+    ----------
+    state : dict
+        The screening state of the cohort.
+    data : tuple
+        The categories and the dataframes of the cohort.
+    samples : pd.DataFrame
+        The new samples, with the columns of the cohort (laid out as Table S6).
+
+    Returns
+    -------
+    tuple
+        The data of the cohort with the new samples appended to their categories, and the
+        indices of the categories which received samples.
+
+    Raises
+    ------
+    ValueError
+        If the columns of the samples differ from those of the cohort, a sample belongs to none
+        of the categories, or the ID of a sample (`Sample ID #`) is already in the cohort or
+        repeated among the new samples, e.g., when the same samples are added again.
+    """
+    categories, dfs = data
+    if [str(column) for column in samples.columns] != [str(column) for column in state['columns']]:
+        raise ValueError("The columns of the new samples differ from those of the cohort.")
+    labels = samples.iloc[:, 2]
+    unknown = sorted(set(labels) - set(categories))
+    if unknown:
+        raise ValueError(f"Unknown categories {unknown} of the new samples. Choose among {list(categories)}.")
+    sample_ids = samples.iloc[:, 1].astype(str).str.strip()
+    cohort_ids = set(pd.concat([df.iloc[:, 1] for df in dfs]).astype(str).str.strip())
+    duplicates = sorted(set(sample_ids[sample_ids.duplicated()]) | (set(sample_ids) & cohort_ids))
+    if duplicates:
+        raise ValueError(f"Sample IDs {duplicates[:5]} of the new samples are already in the cohort or repeated.")
+
+    dfs, updated = list(dfs), []
+    for category_index, category in enumerate(categories):
+        category_samples = samples[labels == category]
+        if len(category_samples) == 0:
+            continue
+        dfs[category_index] = pd.concat([dfs[category_index], category_samples], ignore_index=True)
+        levels = feature_label_split(category_samples)[0].apply(pd.to_numeric, errors='coerce').to_numpy(dtype=float)
+        state['levels'][category_index] = np.sort(np.concatenate([state['levels'][category_index], levels]), axis=0)
+        state['moments'][category_index] = merge_moments(state['moments'][category_index], chunk_moments(levels))
+        _category_inputs(state, category_index)
+        state['utest_stale'][category_index, :] = True
+        state['utest_stale'][:, category_index] = True
+        updated.append(category_index)
+    return (categories, dfs), updated
+
+
+def state_quantiles(state, quantile_cut = 0.5):
+    """
+    The exact quantile of every biomarker in every category (categories x biomarkers), with the
+    linear interpolation of pd.Series.quantile.
+    """
+    if quantile_cut not in state['quantiles']:
+        state['quantiles'][quantile_cut] = np.full((len(state['categories']), len(state['biomarkers'])), np.nan)
+        for category_index in range(len(state['categories'])):
+            _category_inputs(state, category_index)
+    return state['quantiles'][quantile_cut]
+
+
+def pairwise_p_values(state, test_type = 'ywtest'):
+    """
+    The p-values of the two-sided tests of every biomarker's levels in every category versus
+    every other category.
+
+    Parameters
+    ----------
+    state : dict
+        The screening state.
+    test_type : str, optional
+        'ywtest' for Yuen-Welch's test, 'utest' for the Mann-Whitney U-test (default is 'ywtest').
+
+    Returns
+    -------
+    np.ndarray
+        The p-values (categories x categories x biomarkers), NaN on the diagonal.
+    """
+    if test_type == 'ywtest':
+        mean, variance, h = state['yuen']['mean'], state['yuen']['variance'], state['yuen']['h']
+        v1, v2 = variance[:, np.newaxis], variance[np.newaxis]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            df = (v1 + v2) ** 2 / (v1 ** 2 / (h[:, np.newaxis] - 1) + v2 ** 2 / (h[np.newaxis] - 1))
+            t = (mean[:, np.newaxis] - mean[np.newaxis]) / np.sqrt(v1 + v2)
+        # An undefined number of degrees of freedom (both variances zero) does not matter, as in scipy
+        df = np.where(np.isnan(df), 1.0, df)
+        p_values = 2 * student_t.sf(np.abs(t), df)
+    elif test_type == 'utest':
+        p_values = state['utest']
+        for i, j in zip(*np.nonzero(np.triu(state['utest_stale'], k=1))):
+            p_values[i, j] = p_values[j, i] = mannwhitneyu(state['levels'][i], state['levels'][j], alternative='two-sided', axis=0).pvalue
+        state['utest_stale'][:] = False
+    else:
+        raise ValueError(f"Unknown test type '{test_type}'. Choose among ['ywtest', 'utest'].")
+    p_values = p_values.copy()
+    p_values[np.arange(len(p_values)), np.arange(len(p_values))] = np.nan
+    return p_values
+
+
+def save_state(state, file_path):
+    """
+    Save the screening state atomically.
+    """
+    with open(file_path + ".tmp", 'wb') as file:
+        pickle.dump(state, file, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(file_path + ".tmp", file_path)
+    return file_path
+
+
+def load_state(file_path):
+    """
+    Load a screening state saved by `save_state`.
+    """
+    with open(file_path, 'rb') as file:
+        return pickle.load(file)
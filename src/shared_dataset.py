@@ -0,0 +1,286 @@
+# Library imports
+import os
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from multiprocessing import shared_memory
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.model_selection import train_test_split
+from sklearn.metrics import accuracy_score, roc_curve, auc
+
+#  Project imports
+from data_preprocessing import feature_label_split
+from flat_forest import forest_proba
+from instrumentation import span, enable_tracing, tracing_enabled, reset_trace, trace_events, extend_trace
+
+# The datasets attached in the current process, by shared memory name. A worker attaches a
+# dataset once, and every task then reads it without copying.
+_attached = {}
+
+
+def _open_shared_memory(name):
+    # Attaching must not register the block with the resource tracker of the worker, which would
+    # otherwise unlink it when the worker exits (the `track` argument is new in Python 3.13)
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        from multiprocessing import resource_tracker
+        shm = shared_memory.SharedMemory(name=name)
+        resource_tracker.unregister(shm._name, 'shared_memory')
+        return shm
+
+
+@contextmanager
+def shared_dataset(categories, dfs, selected_biomarkers = None):
+    """
+    Place the biomarker levels of all the categories in shared memory, once, for the worker
+    processes.
+
+    The levels are stored as a single (samples x biomarkers) float64 matrix, the categories one
+    after the other, together with the category code of every sample. The yielded handle is
+    small, and is all that has to be sent to a worker: `attach_dataset` gives read-only,
+    zero-copy views of the matrix and the labels. The shared memory is released on exit.
+
+    Parameters
+    ----------
+    categories : list
+        The names of the categories.
+    dfs : list
+        The dataframes of the categories, as returned by `load_data`.
+    selected_biomarkers : array-like, optional
+        The indices of the biomarkers to share (default is None, i.e., all the biomarkers).
+
+    Yields
+    ------
+    dict
+        The handle: the name of the shared memory, the shape of the matrix, the categories,
+        the biomarkers, and the first row of every category.
+    """
+    features = [feature_label_split(df, selected_biomarkers)[0] for df in dfs]
+    sizes = [len(category_features) for category_features in features]
+    shape = (sum(sizes), features[0].shape[1])
+    shm = shared_memory.SharedMemory(create=True, size=max(1, 8 * shape[0] * shape[1] + 2 * shape[0]))
+    try:
+        levels = np.ndarray(shape, dtype=np.float64, buffer=shm.buf)
+        labels = np.ndarray(shape[0], dtype=np.int16, buffer=shm.buf, offset=8 * shape[0] * shape[1])
+        offsets = np.concatenate([[0], np.cumsum(sizes)])
+        for c, category_features in enumerate(features):
+            levels[offsets[c]:offsets[c + 1]] = category_features.to_numpy(dtype=np.float64)
+            labels[offsets[c]:offsets[c + 1]] = c
+        del levels, labels
+        yield {'name': shm.name,
+               'shape': shape,
+               'categories': list(categories),
+               'biomarkers': list(features[0].columns),
+               'offsets': offsets.tolist()}
+    finally:
+        _attached.pop(shm.name, None)
+        shm.close()
+        shm.unlink()
+
+
+def save_dataset(categories, dfs, directory, selected_biomarkers = None):
+    """
+    Save the biomarker levels and the category codes of all the samples as .npy files, to be
+    memory-mapped by worker processes that cannot share memory with the coordinator, e.g., on
+    other hosts reading a shared filesystem (see work_queue.py).
+
+    Returns
+    -------
+    dict
+        The handle, as for `shared_dataset`, with the path of the directory instead of the name
+        of the shared memory.
+    """
+    features = [feature_label_split(df, selected_biomarkers)[0] for df in dfs]
+    sizes = [len(category_features) for category_features in features]
+    os.makedirs(directory, exist_ok=True)
+    levels = np.concatenate([category_features.to_numpy(dtype=np.float64) for category_features in features])
+    labels = np.repeat(np.arange(len(features), dtype=np.int16), sizes)
+    for file_name, array in [("levels.npy", levels), ("labels.npy", labels)]:
+        with open(os.path.join(directory, file_name + ".tmp"), 'wb') as file:
+            np.save(file, array)
+        os.replace(os.path.join(directory, file_name + ".tmp"), os.path.join(directory, file_name))
+    return {'path': directory,
+            'shape': levels.shape,
+            'categories': list(categories),
+            'biomarkers': list(features[0].columns),
+            'offsets': np.concatenate([[0], np.cumsum(sizes)]).tolist()}
+
+
+def attach_dataset(handle):
+    """
+    Attach to a shared dataset (once per process): to the shared memory of `shared_dataset`, or
+    to the memory-mapped files of `save_dataset`.
+
+    Returns
+    -------
+    tuple
+        Read-only views of the biomarker levels (samples x biomarkers) and of the category code
+        of every sample.
+    """
+    key = handle.get('name') or handle['path']
+    if key not in _attached:
+        if 'path' in handle:
+            _attached[key] = (None,
+                              np.load(os.path.join(handle['path'], "levels.npy"), mmap_mode='r'),
+                              np.load(os.path.join(handle['path'], "labels.npy"), mmap_mode='r'))
+        else:
+            shm = _open_shared_memory(handle['name'])
+            rows, columns = handle['shape']
+            levels = np.ndarray((rows, columns), dtype=np.float64, buffer=shm.buf)
+            labels = np.ndarray(rows, dtype=np.int16, buffer=shm.buf, offset=8 * rows * columns)
+            levels.flags.writeable = False
+            labels.flags.writeable = False
+            _attached[key] = (shm, levels, labels)
+    return _attached[key][1:]
+
+
+def category_rows(handle, category_index):
+    """
+    The rows of a category in the shared matrix, as a slice.
+    """
+    return slice(handle['offsets'][category_index], handle['offsets'][category_index + 1])
+
+
+def sample_positions(n_rows, sample_size, random_state):
+    """
+    The positions drawn by `df.sample(n=sample_size, random_state=random_state)` from a
+    dataframe with n_rows rows, so that a resampling plan reproduces the dataframe code.
+    """
+    return np.random.RandomState(random_state).choice(n_rows, size=sample_size, replace=False)
+
+
+def rf_resampling_plan(handle, category_indices, iterations = 100, normal_category_index = 5):
+    """
+    The rows of every iteration of `rf_normal_cancers`: in iteration i, as many Normal samples
+    as in the smallest of the given cancer types and as many samples of each cancer type,
+    drawn with random state i.
+
+    Returns
+    -------
+    list
+        One array of row indices into the shared matrix per iteration.
+    """
+    sample_size = min(handle['offsets'][c + 1] - handle['offsets'][c] for c in category_indices)
+    plan = []
+    for i in range(iterations):
+        rows = []
+        for c in [normal_category_index, *category_indices]:
+            rows.append(handle['offsets'][c] + sample_positions(handle['offsets'][c + 1] - handle['offsets'][c], sample_size, i))
+        plan.append(np.concatenate(rows))
+    return plan
+
+
+def rf_resampling_iteration(handle, rows, iteration, biomarker_columns = None, test_size = 0.2, roc_pos_label = None, n_jobs = None):
+    """
+    Fit the random forest of one iteration of `rf_normal_cancers` on the given rows of the
+    shared dataset. The function only reads the shared memory, so it can run in any worker.
+
+    Parameters
+    ----------
+    handle : dict
+        The handle of the shared dataset.
+    rows : np.ndarray
+        The rows of the iteration, as planned by `rf_resampling_plan`.
+    iteration : int
+        The iteration, which seeds the split and the forest.
+    biomarker_columns : array-like, optional
+        The columns of the shared matrix to use (default is None, i.e., all the columns).
+    test_size : float, optional
+        The fraction of test samples (default is 0.2).
+    roc_pos_label : str, optional
+        The positive class of the ROC curve. If given, the split is stratified and the ROC curve
+        is computed (default is None).
+    n_jobs : int, optional
+        The threads of the random forest (default is None).
+
+    Returns
+    -------
+    dict
+        The MDI importance scores, the accuracy, the classes of the forest, and with
+        roc_pos_label, the false and true positive rates and the AUC.
+    """
+    levels, labels = attach_dataset(handle)
+    with span('rf.sample', 'rf', iteration=iteration):
+        X = levels[rows] if biomarker_columns is None else levels[np.ix_(rows, np.asarray(biomarker_columns))]
+        y = np.asarray(handle['categories'], dtype=object)[labels[rows]]
+
+    with span('rf.split', 'rf', iteration=iteration):
+        X_train, X_test, y_train, y_test = train_test_split(X, y, test_size = test_size, random_state = iteration, stratify = None if roc_pos_label is None else y)
+
+    with span('rf.fit', 'rf', iteration=iteration):
+        rf = RandomForestClassifier(random_state=iteration, n_jobs=n_jobs)
+        rf.fit(X_train, y_train)
+
+    with span('rf.predict', 'rf', iteration=iteration):
+        # The probabilities, for both the predictions and the ROC curve
+        proba = forest_proba(rf, X_test)
+        result = {'importance': rf.feature_importances_,
+                  'accuracy': accuracy_score(y_test, rf.classes_[np.argmax(proba, axis=1)]),
+                  'classes': rf.classes_}
+        if roc_pos_label is not None:
+            # Predicted probabilities of the positive class
+            y_pred_proba = proba[:, list(rf.classes_).index(roc_pos_label)]
+            fpr, tpr, _ = roc_curve(y_test, y_pred_proba, pos_label=roc_pos_label)
+            result.update(fpr=fpr, tpr=tpr, auc=auc(fpr, tpr))
+    return result
+
+
+def _rf_resampling_task(trace, *args, **kwargs):
+    # Run an iteration in a worker, with tracing switched on or off as in the parent process,
+    # and return the recorded spans along with the result
+    enable_tracing(trace)
+    reset_trace()
+    result = rf_resampling_iteration(*args, **kwargs)
+    events = trace_events()
+    reset_trace()
+    return result, events
+
+
+def rf_resampling_in_workers(categories, dfs, category_indices, selected_biomarkers = None, iterations = 100, test_size = 0.2,
+                             roc_pos_label = None, workers = None, n_jobs = None):
+    """
+    Run the iterations of `rf_normal_cancers` in a pool of worker processes.
+
+    The dataset is placed in shared memory once, and every worker attaches to it once, so a task
+    carries only the rows of its iteration and the parameters, instead of the dataframes.
+
+    Parameters
+    ----------
+    categories : list
+        The names of the categories.
+    dfs : list
+        The dataframes of the categories.
+    category_indices : list
+        The category indices of the cancer types, classified against Normal.
+    selected_biomarkers : array-like, optional
+        The indices of the biomarkers (default is None, i.e., all the biomarkers).
+    iterations : int, optional
+        The number of iterations (default is 100).
+    test_size : float, optional
+        The fraction of test samples (default is 0.2).
+    roc_pos_label : str, optional
+        The positive class of the ROC curves, if they are computed (default is None).
+    workers : int, optional
+        The number of worker processes (default is the number of CPUs).
+    n_jobs : int, optional
+        The threads of each random forest (default is None).
+
+    Returns
+    -------
+    tuple
+        The results of `rf_resampling_iteration`, in the order of the iterations, and the names
+        of the biomarkers.
+    """
+    with shared_dataset(categories, dfs, selected_biomarkers) as handle:
+        plan = rf_resampling_plan(handle, category_indices, iterations)
+        with ProcessPoolExecutor(max_workers=workers, initializer=attach_dataset, initargs=(handle,)) as executor:
+            futures = [executor.submit(_rf_resampling_task, tracing_enabled(), handle, rows, i,
+                                       test_size = test_size, roc_pos_label = roc_pos_label, n_jobs = n_jobs)
+                       for i, rows in enumerate(plan)]
+            results = []
+            for future in futures:
+                result, events = future.result()
+                extend_trace(events)
+                results.append(result)
+        return results, handle['biomarkers']
@@ -0,0 +1,320 @@
+# Library imports
+import numpy as np
+import pandas as pd
+from scipy.stats import ttest_ind, mannwhitneyu, norm, rankdata
+
+#  Project imports
+from data_preprocessing import feature_label_split
+from instrumentation import span
+
+# Screening by AJCC stage. The levels of all the categories are grouped by category and stage once,
+# in a single matrix sorted by (category, stage), where every group is a contiguous block of rows.
+# The quantiles, the tests of every stage of a cancer type versus the other categories and the
+# trend test across the stages are then computed on these blocks, for all the biomarkers at once,
+# instead of filtering the dataframes by stage (as `feature_label_split_stage_I`) and rerunning
+# every screen on every subset.
+
+# The order of the AJCC stages; other labels follow, sorted
+ajcc_stages = ['0', 'I', 'II', 'III', 'IV']
+
+
+def stage_groups(categories, dfs, selected_biomarkers = None):
+    """
+    Group the biomarker levels of the cohort by category and AJCC stage.
+
+    Parameters
+    ----------
+    categories : list
+        The categories.
+    dfs : list
+        The dataframes of the categories, with the AJCC stage in the fourth column (as Table S6).
+    selected_biomarkers : array-like, optional
+        The indices of the biomarkers (default is None, i.e., all the biomarkers).
+
+    Returns
+    -------
+    dict
+        The categories, the stages (in AJCC order), the biomarkers, the levels of all the samples
+        sorted by category and stage (samples x biomarkers), the row of every sample in the
+        dataframe of its category, and (category index, stage) -> the slice of the rows of its
+        samples. The samples without a stage, e.g., the Normal ones, have the stage None.
+    """
+    with span('stage_groups', 'stats'):
+        levels = [feature_label_split(df, selected_biomarkers)[0].apply(pd.to_numeric, errors='coerce').to_numpy(dtype=float)
+                  for df in dfs]
+        stage_labels = [df.iloc[:, 3].astype(object).where(df.iloc[:, 3].notna(), None).map(lambda stage: stage if stage is None else str(stage).strip())
+                        for df in dfs]
+        labels = {stage for category_stages in stage_labels for stage in category_stages if stage is not None}
+        stages = [stage for stage in ajcc_stages if stage in labels] + sorted(labels - set(ajcc_stages))
+        stage_codes = {stage: code for code, stage in enumerate(stages)}
+
+        category_codes = np.concatenate([np.full(len(df), c) for c, df in enumerate(dfs)])
+        codes = np.concatenate([np.array([stage_codes.get(stage, len(stages)) for stage in category_stages], dtype=int)
+                                for category_stages in stage_labels])
+        rows = np.concatenate([np.arange(len(df)) for df in dfs])
+        order = np.lexsort((rows, codes, category_codes))
+
+        category_codes, codes = category_codes[order], codes[order]
+        starts = np.flatnonzero(np.r_[True, (np.diff(category_codes) != 0) | (np.diff(codes) != 0)])
+        ends = np.r_[starts[1:], len(order)]
+        groups = {(int(category_codes[start]), stages[codes[start]] if codes[start] < len(stages) else None): slice(int(start), int(end))
+                  for start, end in zip(starts, ends)}
+        return {'categories': list(categories),
+                'stages': stages,
+                'biomarkers': list(feature_label_split(dfs[0], selected_biomarkers)[0].columns),
+                'levels': np.concatenate(levels)[order],
+                'rows': rows[order],
+                'groups': groups}
+
+
+def category_levels(groups, category_index, stage = 'all'):
+    """
+    The levels of the samples of a category (samples x biomarkers): those of a stage, or all of
+    them ('all'). All the samples of a category without stages (e.g., Normal) are in every stage.
+    """
+    category_groups = {group_stage: rows for (c, group_stage), rows in groups['groups'].items() if c == category_index}
+    if not category_groups:
+        return np.empty((0, len(groups['biomarkers'])))
+    if stage != 'all' and set(category_groups) != {None}:
+        return groups['levels'][category_groups.get(stage, slice(0, 0))]
+    # The groups of a category are contiguous
+    slices = list(category_groups.values())
+    return groups['levels'][slices[0].start:slices[-1].stop]
+
+
+def stage_subsets(dfs, groups, stage):
+    """
+    The dataframes of the categories restricted to the samples of a stage, as the rows of
+    `category_levels`; the categories without stages (e.g., Normal) are kept whole.
+    """
+    subsets = []
+    for c, df in enumerate(dfs):
+        category_stages = {group_stage for (category, group_stage) in groups['groups'] if category == c}
+        if category_stages and category_stages != {None}:
+            subsets.append(df.iloc[groups['rows'][groups['groups'].get((c, stage), slice(0, 0))]])
+        else:
+            subsets.append(df)
+    return subsets
+
+
+def stage_quantile_cube(groups, quantile_cuts = (0.25, 0.5, 0.75)):
+    """
+    The quantiles of all the biomarkers in every stage of every category (see
+    `desc_stats.quantile_cube`).
+
+    Returns
+    -------
+    pd.DataFrame
+        The quantile values in long format, with the columns Category, Stage, Biomarker, Quantile
+        and Value. The Stage of the samples without a stage is None.
+    """
+    cube = []
+    for (c, stage), rows in groups['groups'].items():
+        # All the quantiles of all the biomarkers of a group at once (quantiles x biomarkers),
+        # ignoring the missing levels as pd.DataFrame.quantile
+        with np.errstate(invalid='ignore'):
+            values = np.nanquantile(groups['levels'][rows], list(quantile_cuts), axis=0) if rows.stop > rows.start else \
+                np.full((len(quantile_cuts), len(groups['biomarkers'])), np.nan)
+        cube.append(pd.DataFrame({'Category': groups['categories'][c],
+                                  'Stage': stage,
+                                  'Biomarker': np.repeat(groups['biomarkers'], len(quantile_cuts)),
+                                  'Quantile': np.tile(list(quantile_cuts), len(groups['biomarkers'])),
+                                  'Value': values.T.ravel()}))
+    return pd.concat(cube, ignore_index=True)
+
+
+def _utest_p_values(x, y):
+    # The p-values of the two-sided U-tests of the columns of x and y, as the tests of the columns
+    # one by one: scipy chooses the exact distribution of small samples for all the columns at once,
+    # only when none of them has ties, so the columns with and without ties are tested apart
+    p_values = np.full(x.shape[1], np.nan)
+    sorted_levels = np.sort(np.concatenate([x, y]), axis=0)
+    ties = np.any(np.diff(sorted_levels, axis=0) == 0, axis=0)
+    for columns in (ties, ~ties):
+        if columns.any():
+            p_values[columns] = mannwhitneyu(x[:, columns], y[:, columns], alternative='two-sided', axis=0).pvalue
+    return p_values
+
+
+def stage_p_values(groups, cancer_category_index, test_type = 'ywtest'):
+    """
+    The p-values of the two-sided tests of the biomarkers' levels in every stage of a cancer type
+    versus the same stage of every other category (all the samples of a category without stages,
+    e.g., Normal), as `stats_tests.p_value_matrix` on the samples of the stage (see
+    `stage_subsets`).
+
+    Parameters
+    ----------
+    groups : dict
+        The cohort grouped by `stage_groups`.
+    cancer_category_index : int
+        The cancer type.
+    test_type : str, optional
+        'ywtest' for Yuen-Welch's test, 'utest' for the Mann-Whitney U-test (default is 'ywtest').
+
+    Returns
+    -------
+    pd.DataFrame
+        One row per stage and biomarker and one column per other category, NaN for a group with
+        less than two samples.
+    """
+    if test_type not in ('ywtest', 'utest'):
+        raise ValueError(f"Unknown test type '{test_type}'. Choose among ['ywtest', 'utest'].")
+    categories = groups['categories']
+    other_categories = [c for c in range(len(categories)) if c != cancer_category_index]
+    stages = [stage for (c, stage) in groups['groups'] if c == cancer_category_index]
+    p_dfs = {}
+    with span(f"stats.stage_{test_type}", 'stats', cancer=categories[cancer_category_index]):
+        for stage in stages:
+            stage_levels = category_levels(groups, cancer_category_index, stage)
+            p_values = np.full((len(groups['biomarkers']), len(other_categories)), np.nan)
+            for k, c in enumerate(other_categories):
+                # Every test of a pair of groups covers all the biomarkers at once
+                other_levels = category_levels(groups, c, stage)
+                if len(stage_levels) < 2 or len(other_levels) < 2:
+                    continue
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    if test_type == 'ywtest':
+                        p_values[:, k] = ttest_ind(stage_levels, other_levels, equal_var=False, trim=0.1, axis=0).pvalue
+                    else:
+                        p_values[:, k] = _utest_p_values(stage_levels, other_levels)
+            p_dfs[stage] = pd.DataFrame(p_values, index = groups['biomarkers'], columns = [categories[c] for c in other_categories])
+    p_df = pd.concat(p_dfs, names = ['Stage', 'Biomarker'])
+    p_df.name = categories[cancer_category_index]
+    return p_df
+
+
+def _tie_sums(levels):
+    # For every column, the sums over the groups of tied values (of sizes t) of t(t - 1)(2t + 5),
+    # t(t - 1)(t - 2) and t(t - 1), without the missing values
+    sorted_levels = np.sort(levels, axis=0).T
+    valid = ~np.isnan(sorted_levels)
+    columns = np.broadcast_to(np.arange(sorted_levels.shape[0])[:, np.newaxis], sorted_levels.shape)[valid]
+    values = sorted_levels[valid]
+    starts = np.r_[True, (np.diff(values) != 0) | (np.diff(columns) != 0)] if len(values) else np.zeros(0, dtype=bool)
+    run_ids = np.cumsum(starts) - 1
+    t = np.bincount(run_ids).astype(float)
+    run_columns = columns[starts]
+    n_columns = sorted_levels.shape[0]
+    return [np.bincount(run_columns, weights = term, minlength = n_columns)
+            for term in (t * (t - 1) * (2 * t + 5), t * (t - 1) * (t - 2), t * (t - 1))]
+
+
+def jonckheere_terpstra(samples, alternative = 'increasing'):
+    """
+    Jonckheere-Terpstra's test of a monotone trend of the levels across ordered groups, for all the
+    biomarkers at once, with the normal approximation corrected for ties.
+
+    Parameters
+    ----------
+    samples : list
+        The levels of the groups, in their order (samples x biomarkers each). The missing levels
+        are left out, biomarker by biomarker.
+    alternative : str, optional
+        'increasing', 'decreasing' or 'two-sided' (default is 'increasing').
+
+    Returns
+    -------
+    tuple
+        The statistic J (the pairs of samples of two groups in the order of the groups, ties
+        counting half), its z-score and the p-value, one per biomarker.
+    """
+    if alternative not in ('increasing', 'decreasing', 'two-sided'):
+        raise ValueError(f"Unknown alternative '{alternative}'. Choose among ['increasing', 'decreasing', 'two-sided'].")
+    samples = [np.asarray(sample, dtype=float) for sample in samples]
+    sizes = np.array([np.sum(~np.isnan(sample), axis=0) for sample in samples], dtype=float)
+
+    # J is the sum over the pairs of groups of the Mann-Whitney U statistics of the later group,
+    # from the ranks of the levels of the two groups
+    statistic = np.zeros(samples[0].shape[1])
+    for i in range(len(samples)):
+        for j in range(i + 1, len(samples)):
+            ranks = rankdata(np.concatenate([samples[i], samples[j]]), axis=0, nan_policy='omit')
+            statistic += np.nansum(ranks[len(samples[i]):], axis=0) - sizes[j] * (sizes[j] + 1) / 2
+
+    n = sizes.sum(axis=0)
+    mean = (n ** 2 - np.sum(sizes ** 2, axis=0)) / 4
+    ties_5, ties_2, ties_1 = _tie_sums(np.concatenate(samples))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        variance = ((n * (n - 1) * (2 * n + 5) - np.sum(sizes * (sizes - 1) * (2 * sizes + 5), axis=0) - ties_5) / 72
+                    + np.sum(sizes * (sizes - 1) * (sizes - 2), axis=0) * ties_2 / (36 * n * (n - 1) * (n - 2))
+                    + np.sum(sizes * (sizes - 1), axis=0) * ties_1 / (8 * n * (n - 1)))
+        z = (statistic - mean) / np.sqrt(variance)
+    if alternative == 'increasing':
+        p_value = norm.sf(z)
+    elif alternative == 'decreasing':
+        p_value = norm.cdf(z)
+    else:
+        p_value = 2 * norm.sf(np.abs(z))
+    return statistic, z, p_value
+
+
+def stage_trend_test(groups, cancer_category_index, reference_category_index = 5, alternative = 'increasing'):
+    """
+    Jonckheere-Terpstra's test of a monotone progression of every biomarker across the stages of a
+    cancer type, from the reference samples (by default the Normal ones) to the latest stage.
+
+    Parameters
+    ----------
+    groups : dict
+        The cohort grouped by `stage_groups`.
+    cancer_category_index : int
+        The cancer type.
+    reference_category_index : int, optional
+        The category preceding the first stage (default is 5, Normal), or None for the stages only.
+    alternative : str, optional
+        'increasing', 'decreasing' or 'two-sided' (default is 'increasing').
+
+    Returns
+    -------
+    pd.DataFrame
+        One row per biomarker, with the medians of the groups in their order, J, its z-score and
+        the p-value, sorted by p-value.
+    """
+    stages = [stage for stage in groups['stages'] if (cancer_category_index, stage) in groups['groups']]
+    samples = [category_levels(groups, cancer_category_index, stage) for stage in stages]
+    names = [f"Stage {stage}" for stage in stages]
+    if reference_category_index is not None:
+        samples.insert(0, category_levels(groups, reference_category_index))
+        names.insert(0, groups['categories'][reference_category_index])
+    with span('stats.jonckheere_terpstra', 'stats', cancer=groups['categories'][cancer_category_index]):
+        statistic, z, p_value = jonckheere_terpstra(samples, alternative = alternative)
+    with np.errstate(invalid='ignore'):
+        trend_df = pd.DataFrame({f"Median {name}": np.nanmedian(sample, axis=0) if len(sample) else np.nan
+                                 for name, sample in zip(names, samples)}, index = groups['biomarkers'])
+    trend_df['J'], trend_df['z'], trend_df['p-value'] = statistic, z, p_value
+    trend_df.index.name = 'Biomarker'
+    trend_df.name = groups['categories'][cancer_category_index]
+    return trend_df.sort_values('p-value')
+
+
+def stage_rf_screening(categories, dfs, groups, cancer_category_index, stages = None, min_samples = 10, **rf_options):
+    """
+    `random_forest_model.rf_normal_cancers` of the Normal samples versus the samples of every stage
+    of a cancer type, taken from the groups without filtering the dataframes again.
+
+    Parameters
+    ----------
+    stages : list, optional
+        The stages (default is None, i.e., all the stages of the cancer type).
+    min_samples : int, optional
+        The stages with fewer samples are left out (default is 10).
+    rf_options
+        The other arguments of `rf_normal_cancers`, e.g., iterations or threshold.
+
+    Returns
+    -------
+    dict
+        Stage -> the important biomarkers, as returned by `rf_normal_cancers`.
+    """
+    from random_forest_model import rf_normal_cancers
+
+    if stages is None:
+        stages = [stage for stage in groups['stages'] if (cancer_category_index, stage) in groups['groups']]
+    important_biomarkers = {}
+    for stage in stages:
+        rows = groups['groups'].get((cancer_category_index, stage), slice(0, 0))
+        if rows.stop - rows.start < min_samples:
+            continue
+        important_biomarkers[stage] = rf_normal_cancers(categories, stage_subsets(dfs, groups, stage), cancer_category_index, **rf_options)
+    return important_biomarkers
@@ -1,10 +1,22 @@
 # Library imports
+import warnings
+import numpy as np
 import pandas as pd
 from scipy.stats import ttest_ind, mannwhitneyu
-from IPython.display import display
 
 # Project imports
 from data_preprocessing import load_data, feature_label_split
+from instrumentation import span
+
+def _display(df):
+    # IPython is imported only when a debug table is displayed; without it, the table is printed
+    try:
+        from IPython.display import display
+    except ImportError:
+        print(df)
+    else:
+        display(df)
+
 
 def ywtest(cancer_1_features, cancer_2_features, biomarker_index):
     
@@ -50,11 +62,12 @@ def full_ywtest(cancer_category_index, biomarker_index, categories, dfs, test_ty
     p_df.name = biomarker
     
     main_cancer_features = feature_label_split(dfs[cancer_category_index])[0]
-    for i in range(9):
-        if i != cancer_category_index:
-            other_type_features = feature_label_split(dfs[i])[0]
-            p_value = testfunction(main_cancer_features, other_type_features, biomarker_index = biomarker_index)
-            p_df[categories[i]] = [p_value]
+    with span(f"stats.{test_type}_batch", 'stats', cancer=categories[cancer_category_index], biomarker=biomarker):
+        for i in range(len(dfs)):
+            if i != cancer_category_index:
+                other_type_features = feature_label_split(dfs[i])[0]
+                p_value = testfunction(main_cancer_features, other_type_features, biomarker_index = biomarker_index)
+                p_df[categories[i]] = [p_value]
     
     # Find columns where the value in the first row is greater than 0.05
     categories_where_p_greater_than_threshold = list(p_df.columns[p_df.iloc[0] > p_threshold])
@@ -88,7 +101,7 @@ def find_shared_nature_of_biomarkers(categories, dfs, cancer_category_index, can
                 print(f"\nBiomarker {i}: {biomarkers[i]} didn't pass the p-value cutoff for one or two categories.")
             else:
                 print(f"\nBiomarker {i}: {biomarkers[i]} didn't pass the p-value cutoff for three or more categories. It is dropped.")
-            display(p_df)
+            _display(p_df)
         
     return cancer_shared_nature_of_biomarkers
 
@@ -106,11 +119,12 @@ def heatmap_full_ywtest(cancer_category_index, biomarker_index, categories, dfs,
     p_df = pd.DataFrame(index = [biomarker])
     
     main_cancer_features = feature_label_split(dfs[cancer_category_index])[0]
-    for i in range(9):
-        if i != cancer_category_index:
-            other_type_features = feature_label_split(dfs[i])[0]
-            p_value = testfunction(main_cancer_features, other_type_features, biomarker_index = biomarker_index)
-            p_df[categories[i]] = [p_value]
+    with span(f"stats.{test_type}_batch", 'stats', cancer=categories[cancer_category_index], biomarker=biomarker):
+        for i in range(len(dfs)):
+            if i != cancer_category_index:
+                other_type_features = feature_label_split(dfs[i])[0]
+                p_value = testfunction(main_cancer_features, other_type_features, biomarker_index = biomarker_index)
+                p_df[categories[i]] = [p_value]
     
     # Find columns where the value in the first row is greater than 0.05
     categories_where_p_greater_than_threshold = list(p_df.columns[p_df.iloc[0] > p_threshold])
@@ -152,6 +166,62 @@ def heatmap_shared_nature(categories, dfs, cancer_category_index, cancer_selecte
 
 
 
+def p_value_matrix(categories, dfs, cancer_category_index, biomarker_indices = None, test_type = 'ywtest'):
+    """
+    The p-values of the given biomarkers' levels in a cancer type versus every other category.
+
+    Returns
+    -------
+    pd.DataFrame
+        One row per biomarker and one column per other category.
+    """
+    if biomarker_indices is None:
+        biomarker_indices = range(feature_label_split(dfs[0])[0].shape[1])
+    p_dfs = [heatmap_full_ywtest(cancer_category_index, biomarker_index, categories, dfs, test_type = test_type)[1]
+             for biomarker_index in biomarker_indices]
+    p_df = pd.concat(p_dfs, axis = 0)
+    p_df.name = categories[cancer_category_index]
+    return p_df
+
+
+def stratified_p_value_matrix(categories, strata, cancer_category_index, biomarker_indices = None, test_type = 'ywtest'):
+    """
+    `p_value_matrix` within every stratum of the samples, e.g., by sex or race.
+
+    Parameters
+    ----------
+    categories : list
+        The categories.
+    strata : dict
+        Stratum -> the dataframes of the categories restricted to its samples (see
+        `supplementary_tables.stratify`).
+    cancer_category_index : int
+        The cancer type.
+    biomarker_indices : list, optional
+        The biomarkers (default is None, i.e., all the biomarkers).
+    test_type : str, optional
+        'ywtest' or 'utest' (default is 'ywtest').
+
+    Returns
+    -------
+    pd.DataFrame
+        One row per stratum and biomarker and one column per other category. A stratum without
+        samples of the cancer type is left out, and the p-values of a category with less than two
+        samples in the stratum are NaN.
+    """
+    p_dfs = {}
+    for stratum, stratum_dfs in strata.items():
+        if len(stratum_dfs[cancer_category_index]) < 2:
+            continue
+        sparse = [c for c, df in enumerate(stratum_dfs) if len(df) < 2]
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            p_df = p_value_matrix(categories, stratum_dfs, cancer_category_index, biomarker_indices = biomarker_indices, test_type = test_type)
+        p_df[[categories[c] for c in sparse if c != cancer_category_index]] = np.nan
+        p_dfs[stratum] = p_df
+    p_df = pd.concat(p_dfs, names = ['Stratum', 'Biomarker'])
+    p_df.name = categories[cancer_category_index]
+    return p_df
 
 
 if __name__ == "__main__":
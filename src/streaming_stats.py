@@ -0,0 +1,413 @@
+# Library imports
+import json
+import numpy as np
+import pandas as pd
+
+#  Project imports
+from data_preprocessing import feature_label_split
+from instrumentation import span
+
+# Out-of-core descriptive statistics: the cohort is read in chunks (CSV or Parquet, one row per
+# sample, laid out as Table S6), and every category keeps, for every biomarker, running moments
+# and a KLL quantile sketch (Karnin, Lang and Liberty, 2016). The memory is bounded by the number
+# of categories and biomarkers, not by the number of samples, and the statistics of separate
+# shards can be merged.
+#
+# Error bounds of the quantiles. A sketch keeps at most about 3k values. While a category has no
+# more than k values of a biomarker, nothing is compacted and the quantiles are exact (the linear
+# interpolation of pd.Series.quantile). Beyond, every compaction of a level of weight w moves the
+# rank of any value either by 0, or by +w or -w with probability 1/2 each, independently of the
+# other compactions, so by Hoeffding's inequality the rank error of a quantile exceeds sqrt(2 ln(2 / delta) sum(w^2)) with probability
+# at most delta. `kll_rank_error` returns this bound, as a fraction of the number of values: the
+# returned quantile q lies between the exact quantiles q - error and q + error. For k = 200 and
+# millions of values, the bound is about 2%, and the actual errors are a fraction of it. The MAD is computed on the weighted values of the sketch, and
+# its rank error is at most twice that of the quantiles, plus the effect of the error of the median.
+
+# The default number of values kept by the top level of a sketch
+default_k = 200
+
+
+def kll_sketch(k = default_k, seed = 0):
+    """
+    An empty KLL quantile sketch.
+
+    Parameters
+    ----------
+    k : int, optional
+        The capacity of the top level (default is 200). The sketch keeps at most about 3k values,
+        and is exact up to k values.
+    seed : int, optional
+        The seed of the random choices of the compactions (default is 0).
+
+    Returns
+    -------
+    dict
+        The sketch: the values of every level (of weight 2^level), the number of values, the
+        sum of the squared weights of the compactions, and the number of compactions.
+    """
+    return {'k': k, 'seed': seed, 'levels': [np.empty(0)], 'n': 0, 'squared_weights': 0.0, 'compactions': 0}
+
+
+def _kll_capacity(k, height, level):
+    # The capacities shrink geometrically, by 2/3, from the top level down
+    return max(2, int(np.ceil(k * (2 / 3) ** (height - 1 - level))))
+
+
+def _kll_compress(sketch):
+    # Compact the levels over capacity, from the bottom up, until all of them fit: the sorted
+    # values of a level are halved, keeping either the odd or the even ones, which move up a level
+    # with twice the weight
+    levels = sketch['levels']
+    level = 0
+    while level < len(levels):
+        if len(levels[level]) > _kll_capacity(sketch['k'], len(levels), level):
+            if level + 1 == len(levels):
+                levels.append(np.empty(0))
+            values = np.sort(levels[level])
+            # An odd value out stays at its level
+            kept, values = (values[-1:], values[:-1]) if len(values) % 2 else (values[:0], values)
+            offset = np.random.default_rng([sketch['seed'], sketch['compactions']]).integers(2)
+            levels[level + 1] = np.concatenate([levels[level + 1], values[offset::2]])
+            levels[level] = kept
+            sketch['squared_weights'] += 4.0 ** level
+            sketch['compactions'] += 1
+            # A new level shrinks the capacities of the lower ones
+            level = 0
+        else:
+            level += 1
+    return sketch
+
+
+def kll_update(sketch, values):
+    """
+    Add values to a sketch, in place. NaN values are ignored.
+    """
+    values = np.asarray(values, dtype=float).ravel()
+    values = values[~np.isnan(values)]
+    if values.size:
+        sketch['levels'][0] = np.concatenate([sketch['levels'][0], values])
+        sketch['n'] += values.size
+        _kll_compress(sketch)
+    return sketch
+
+
+def kll_merge(sketch, other):
+    """
+    Merge the values of another sketch (with the same k) into a sketch, in place, as if it had
+    seen both streams.
+    """
+    if sketch['k'] != other['k']:
+        raise ValueError(f"Cannot merge sketches of different sizes ({sketch['k']} and {other['k']}).")
+    for level, values in enumerate(other['levels']):
+        if level == len(sketch['levels']):
+            sketch['levels'].append(np.empty(0))
+        sketch['levels'][level] = np.concatenate([sketch['levels'][level], values])
+    sketch['n'] += other['n']
+    sketch['squared_weights'] += other['squared_weights']
+    sketch['compactions'] += other['compactions']
+    return _kll_compress(sketch)
+
+
+def kll_items(sketch):
+    """
+    The values of a sketch, sorted, with their weights.
+    """
+    values = np.concatenate(sketch['levels'])
+    weights = np.concatenate([np.full(len(level_values), 2.0 ** level) for level, level_values in enumerate(sketch['levels'])])
+    order = np.argsort(values, kind='stable')
+    return values[order], weights[order]
+
+
+def _weighted_quantiles(values, weights, quantile_cuts):
+    # Every value stands for `weight` consecutive ranks among the n values, and is placed at the
+    # middle of them, so that with unit weights this is the linear interpolation of np.quantile
+    if values.size == 0:
+        return np.full(len(quantile_cuts), np.nan)
+    cumulative = np.cumsum(weights)
+    ranks = cumulative - weights + (weights - 1) / 2
+    return np.interp(np.asarray(quantile_cuts, dtype=float) * (cumulative[-1] - 1), ranks, values)
+
+
+def kll_quantiles(sketch, quantile_cuts):
+    """
+    The quantiles of the values of a sketch.
+
+    Parameters
+    ----------
+    sketch : dict
+        The sketch.
+    quantile_cuts : array-like
+        The quantiles, between 0 and 1.
+
+    Returns
+    -------
+    np.ndarray
+        The quantiles, NaN if the sketch is empty.
+    """
+    return _weighted_quantiles(*kll_items(sketch), quantile_cuts)
+
+
+def kll_mad(sketch):
+    """
+    The median absolute deviation of the values of a sketch, from its weighted values.
+    """
+    values, weights = kll_items(sketch)
+    deviations = np.abs(values - _weighted_quantiles(values, weights, [0.5])[0])
+    order = np.argsort(deviations, kind='stable')
+    return float(_weighted_quantiles(deviations[order], weights[order], [0.5])[0])
+
+
+def kll_rank_error(sketch, delta = 0.01):
+    """
+    The bound on the rank error of a quantile of the sketch, as a fraction of the number of
+    values, which holds with probability 1 - delta (0 while the sketch is exact).
+    """
+    if sketch['n'] == 0:
+        return 0.0
+    return float(np.sqrt(2 * np.log(2 / delta) * sketch['squared_weights']) / sketch['n'])
+
+
+def running_moments(n_biomarkers):
+    """
+    The running moments of the levels of n_biomarkers biomarkers: the count of values, the
+    count of missing values, the mean, the sums of the 2nd to 4th powers of the deviations from
+    the mean, the minimum and the maximum.
+    """
+    return {'count': np.zeros(n_biomarkers),
+            'missing': np.zeros(n_biomarkers),
+            'mean': np.zeros(n_biomarkers),
+            'M2': np.zeros(n_biomarkers),
+            'M3': np.zeros(n_biomarkers),
+            'M4': np.zeros(n_biomarkers),
+            'min': np.full(n_biomarkers, np.inf),
+            'max': np.full(n_biomarkers, -np.inf)}
+
+
+def chunk_moments(values):
+    """
+    The running moments of a (samples x biomarkers) matrix of levels, NaN being the missing values.
+    """
+    present = ~np.isnan(values)
+    count = present.sum(axis=0).astype(float)
+    mean = np.divide(np.where(present, values, 0).sum(axis=0), count, out=np.zeros(values.shape[1]), where=count > 0)
+    deviations = np.where(present, values - mean, 0)
+    return {'count': count,
+            'missing': (~present).sum(axis=0).astype(float),
+            'mean': mean,
+            'M2': (deviations ** 2).sum(axis=0),
+            'M3': (deviations ** 3).sum(axis=0),
+            'M4': (deviations ** 4).sum(axis=0),
+            'min': np.where(present, values, np.inf).min(axis=0, initial=np.inf),
+            'max': np.where(present, values, -np.inf).max(axis=0, initial=-np.inf)}
+
+
+def merge_moments(moments, other):
+    """
+    Merge the running moments of two sets of samples (Pébay, 2008), and return the merged moments.
+    """
+    na, nb = moments['count'], other['count']
+    n = na + nb
+    # Divisions by n only where some values are present
+    safe_n = np.where(n > 0, n, 1)
+    delta = other['mean'] - moments['mean']
+    M2a, M2b, M3a, M3b = moments['M2'], other['M2'], moments['M3'], other['M3']
+    return {'count': n,
+            'missing': moments['missing'] + other['missing'],
+            'mean': moments['mean'] + delta * nb / safe_n,
+            'M2': M2a + M2b + delta ** 2 * na * nb / safe_n,
+            'M3': M3a + M3b + delta ** 3 * na * nb * (na - nb) / safe_n ** 2 + 3 * delta * (na * M2b - nb * M2a) / safe_n,
+            'M4': (moments['M4'] + other['M4'] + delta ** 4 * na * nb * (na ** 2 - na * nb + nb ** 2) / safe_n ** 3
+                   + 6 * delta ** 2 * (na ** 2 * M2b + nb ** 2 * M2a) / safe_n ** 2 + 4 * delta * (na * M3b - nb * M3a) / safe_n),
+            'min': np.minimum(moments['min'], other['min']),
+            'max': np.maximum(moments['max'], other['max'])}
+
+
+def streaming_statistics_init(biomarkers, k = default_k, seed = 0):
+    """
+    Empty streaming statistics of the given biomarkers.
+
+    Returns
+    -------
+    dict
+        The biomarkers, the sketch size and seed, and for every category (as they appear) the
+        running moments of all the biomarkers and one sketch per biomarker.
+    """
+    return {'biomarkers': list(biomarkers), 'k': k, 'seed': seed, 'categories': {}}
+
+
+def _category_statistics(statistics, category):
+    if category not in statistics['categories']:
+        n_biomarkers = len(statistics['biomarkers'])
+        statistics['categories'][category] = {'moments': running_moments(n_biomarkers),
+                                              'sketches': [kll_sketch(statistics['k'], statistics['seed']) for _ in range(n_biomarkers)]}
+    return statistics['categories'][category]
+
+
+def update_statistics(statistics, chunk):
+    """
+    Add a chunk of samples to the streaming statistics, in place.
+
+    Parameters
+    ----------
+    statistics : dict
+        The streaming statistics.
+    chunk : pd.DataFrame
+        Samples laid out as Table S6: the tumor type in the third column, and the biomarker levels
+        from the fifth column on.
+    """
+    levels, labels = feature_label_split(chunk)
+    if list(levels.columns) != statistics['biomarkers']:
+        raise ValueError("The biomarkers of the chunk differ from those of the statistics.")
+    levels = levels.apply(pd.to_numeric, errors='coerce').to_numpy(dtype=float)
+    labels = labels.to_numpy()
+    for category in pd.unique(labels):
+        category_levels = levels[labels == category]
+        category_statistics = _category_statistics(statistics, category)
+        category_statistics['moments'] = merge_moments(category_statistics['moments'], chunk_moments(category_levels))
+        for j, sketch in enumerate(category_statistics['sketches']):
+            kll_update(sketch, category_levels[:, j])
+    return statistics
+
+
+def merge_statistics(statistics, other):
+    """
+    Merge the streaming statistics of another shard into the statistics, in place.
+    """
+    if statistics['biomarkers'] != other['biomarkers'] or statistics['k'] != other['k']:
+        raise ValueError("Cannot merge streaming statistics of different biomarkers or sketch sizes.")
+    for category, other_statistics in other['categories'].items():
+        category_statistics = _category_statistics(statistics, category)
+        category_statistics['moments'] = merge_moments(category_statistics['moments'], other_statistics['moments'])
+        for sketch, other_sketch in zip(category_statistics['sketches'], other_statistics['sketches']):
+            kll_merge(sketch, other_sketch)
+    return statistics
+
+
+def read_cohort_chunks(file_path, chunksize = 100000):
+    """
+    Read a cohort in chunks of samples: a CSV file, or a Parquet file (with pyarrow).
+
+    Yields
+    ------
+    pd.DataFrame
+        The chunks, laid out as the file.
+    """
+    if file_path.endswith(".parquet"):
+        try:
+            import pyarrow.parquet as pq
+        except ImportError as error:
+            raise ImportError("Reading Parquet files requires pyarrow (pip install pyarrow).") from error
+        for batch in pq.ParquetFile(file_path).iter_batches(batch_size=chunksize):
+            yield batch.to_pandas()
+    elif file_path.endswith((".csv", ".csv.gz")):
+        yield from pd.read_csv(file_path, chunksize=chunksize)
+    else:
+        raise ValueError(f"Cannot read {file_path} in chunks: use a CSV or a Parquet file.")
+
+
+def streaming_statistics(file_paths, k = default_k, seed = 0, chunksize = 100000):
+    """
+    The streaming statistics of a cohort, read in chunks from one or several files (e.g., the
+    shards of a registry).
+
+    Parameters
+    ----------
+    file_paths : str or list
+        The CSV or Parquet files, laid out as Table S6.
+    k : int, optional
+        The size of the quantile sketches (default is 200).
+    seed : int, optional
+        The seed of the sketches (default is 0).
+    chunksize : int, optional
+        The number of samples read at a time (default is 100000).
+
+    Returns
+    -------
+    dict
+        The streaming statistics.
+    """
+    statistics = None
+    for file_path in [file_paths] if isinstance(file_paths, str) else file_paths:
+        with span('streaming_statistics', 'io', file=file_path):
+            for chunk in read_cohort_chunks(file_path, chunksize):
+                if statistics is None:
+                    statistics = streaming_statistics_init(feature_label_split(chunk)[0].columns, k, seed)
+                update_statistics(statistics, chunk)
+    return statistics
+
+
+def statistics_categories(statistics):
+    """
+    The categories of the streaming statistics, sorted as the sheets of the clinical data.
+    """
+    return sorted(statistics['categories'])
+
+
+def streaming_quantiles(statistics, biomarker_index, quantile_cut = 0.5):
+    """
+    The quantile of a biomarker in every category, as `desc_stats.quantiles_across_categories`.
+    """
+    return [float(kll_quantiles(statistics['categories'][category]['sketches'][biomarker_index], [quantile_cut])[0])
+            for category in statistics_categories(statistics)]
+
+
+def streaming_summary(statistics, biomarker_index, delta = 0.01):
+    """
+    The descriptive statistics of a biomarker in every category.
+
+    Returns
+    -------
+    pd.DataFrame
+        One row per category: the count and the number of missing values, the mean, the standard
+        deviation, the skewness and the excess kurtosis, the minimum, Q1, Q2, Q3, the maximum, the
+        MAD, and the bound on the rank error of the quantiles with probability 1 - delta.
+    """
+    rows = []
+    for category in statistics_categories(statistics):
+        moments = statistics['categories'][category]['moments']
+        sketch = statistics['categories'][category]['sketches'][biomarker_index]
+        n, M2 = moments['count'][biomarker_index], moments['M2'][biomarker_index]
+        rows.append({'Category': category,
+                     'count': int(n),
+                     'missing': int(moments['missing'][biomarker_index]),
+                     'mean': moments['mean'][biomarker_index] if n > 0 else np.nan,
+                     'std': np.sqrt(M2 / (n - 1)) if n > 1 else np.nan,
+                     # The bias-adjusted estimators of pd.Series.skew and pd.Series.kurt
+                     'skewness': (np.sqrt(n * (n - 1)) / (n - 2) * np.sqrt(n) * moments['M3'][biomarker_index] / M2 ** 1.5
+                                  if n > 2 and M2 > 0 else np.nan),
+                     'kurtosis': ((n + 1) * (n * moments['M4'][biomarker_index] / M2 ** 2 - 3) + 6) * (n - 1) / ((n - 2) * (n - 3))
+                                 if n > 3 and M2 > 0 else np.nan,
+                     'min': moments['min'][biomarker_index] if n > 0 else np.nan,
+                     **dict(zip(['Q1', 'Q2', 'Q3'], kll_quantiles(sketch, [0.25, 0.5, 0.75]))),
+                     'max': moments['max'][biomarker_index] if n > 0 else np.nan,
+                     'MAD': kll_mad(sketch) if n > 0 else np.nan,
+                     'rank_error': kll_rank_error(sketch, delta)})
+    return pd.DataFrame(rows).set_index('Category')
+
+
+def save_statistics(statistics, file_path):
+    """
+    Save the streaming statistics as JSON, e.g., to merge the statistics of shards later.
+    """
+    serializable = {key: value for key, value in statistics.items() if key != 'categories'}
+    serializable['categories'] = {
+        str(category): {'moments': {key: value.tolist() for key, value in category_statistics['moments'].items()},
+                        'sketches': [{**sketch, 'levels': [values.tolist() for values in sketch['levels']]}
+                                     for sketch in category_statistics['sketches']]}
+        for category, category_statistics in statistics['categories'].items()}
+    with open(file_path, 'w') as file:
+        json.dump(serializable, file)
+    return file_path
+
+
+def load_statistics(file_path):
+    """
+    Load streaming statistics saved by `save_statistics`.
+    """
+    with open(file_path) as file:
+        statistics = json.load(file)
+    for category_statistics in statistics['categories'].values():
+        category_statistics['moments'] = {key: np.asarray(value, dtype=float) for key, value in category_statistics['moments'].items()}
+        for sketch in category_statistics['sketches']:
+            sketch['levels'] = [np.asarray(values, dtype=float) for values in sketch['levels']]
+    return statistics
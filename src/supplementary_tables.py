@@ -0,0 +1,179 @@
+# Library imports
+import os
+import numpy as np
+import pandas as pd
+
+#  Project imports
+from instrumentation import span
+from fingerprint import file_fingerprint
+from table_reader import read_table
+from extract_blood_test_table import strip_units, strip_stars
+
+# The per-sample tables of the supplementary workbook by Cohen et al., besides the blood test table
+# (Table S6): the clinical characteristics (Table S4), the mutations found in plasma (Table S5) and
+# their concordance with the tumors (Table S7), and the tissue of origin predicted by CancerSEEK
+# (Table S8). Every table is keyed by the plasma sample, as the samples of the clinical data. The
+# selected tables are read from the workbook in a single pass and kept for the process, typed and
+# indexed by sample ID. Their columns are joined onto the samples of the categories through the hash
+# table of the index, as covariates aligned with the dataframes of the categories, to be used as
+# additional features of `random_forest_model.rf_normal_cancers` or as strata of the tests.
+#
+# Tables S1, S3 and S9 to S11 hold no per-sample data, and Table S2 holds the mutations of the
+# primary tumors, several per tumor sample.
+
+# The sheet, the key column (the plasma sample ID) and the rows of footnotes of every table
+supplementary_tables = {'S4': {'sheet_name': 'Table S4', 'key': 'Plasma sample ID #', 'footer': 4},
+                        'S5': {'sheet_name': 'Table S5', 'key': 'Sample ID #', 'footer': 2},
+                        'S6': {'sheet_name': 'Table S6', 'key': 'Sample ID #', 'footer': 4},
+                        'S7': {'sheet_name': 'Table S7', 'key': 'Sample ID #', 'footer': 2},
+                        'S8': {'sheet_name': 'Table S8', 'key': 'Sample ID #', 'footer': 0}}
+
+# The tables loaded in this process, by workbook (path and contents) and table
+_loaded_tables = {}
+
+
+def _typed_table(df, key):
+    # The table indexed by its key, with the names of the columns stripped of their units and
+    # footnote marks, the identifiers as strings, the numeric columns (including the levels
+    # beyond the limits of detection, starred in the workbook) as floats, and the others as
+    # categoricals
+    df = df.dropna(subset = [key])
+    df = df.set_index(df[key].astype(str).str.strip().rename('Sample ID #')).drop(columns = [key])
+    df.columns = [strip_units(str(column)).replace('*', '').strip() for column in df.columns]
+    df = strip_stars(df)
+    typed = {}
+    for column in df.columns:
+        values = df[column]
+        numbers = pd.to_numeric(values, errors = 'coerce')
+        if column.endswith('ID #'):
+            typed[column] = values.astype(str)
+        elif numbers.notna().sum() == values.notna().sum():
+            typed[column] = numbers.astype(float)
+        else:
+            typed[column] = values.astype('category')
+    df = pd.DataFrame(typed, index = df.index)
+    if not df.index.is_unique:
+        duplicates = sorted(set(df.index[df.index.duplicated()]))
+        raise ValueError(f"Duplicate sample IDs {duplicates[:5]} in the table.")
+    return df
+
+
+def load_supplementary_tables(file_path = "data/aar3247_cohen_sm_tables-s1-s11.xlsx", tables = ('S4', 'S5', 'S8'), engine = None):
+    """
+    Load per-sample tables of the supplementary workbook, typed and indexed by sample ID.
+
+    Parameters
+    ----------
+    file_path : str, default "data/aar3247_cohen_sm_tables-s1-s11.xlsx"
+        The supplementary workbook.
+    tables : list, optional
+        The tables, among the keys of `supplementary_tables` (default is Tables S4, S5 and S8).
+    engine : str, optional
+        The Excel engine (default is None, i.e., the fastest installed, see `table_reader.excel_engine`).
+
+    Returns
+    -------
+    dict
+        Table -> dataframe indexed by the plasma sample ID, without the key column. The tables
+        already loaded from the same workbook in this process are not read again.
+
+    Raises
+    ------
+    ValueError
+        If a table is not a per-sample table, or has duplicate sample IDs.
+    """
+    unknown = [table for table in tables if table not in supplementary_tables]
+    if unknown:
+        raise ValueError(f"Unknown tables {unknown}. Choose among {list(supplementary_tables)}.")
+    workbook = (os.path.abspath(file_path), file_fingerprint(file_path))
+    missing = [table for table in tables if (workbook, table) not in _loaded_tables]
+    if missing:
+        with span('load_supplementary_tables', 'io', file=file_path, tables=missing):
+            # All the missing sheets in one pass over the workbook; the footnotes are dropped
+            # afterwards, since their number differs between the sheets
+            sheets = read_table(file_path, sheet_name = [supplementary_tables[table]['sheet_name'] for table in missing],
+                                engine = engine, skiprows = 2)
+            for table in missing:
+                spec = supplementary_tables[table]
+                df = sheets[spec['sheet_name']]
+                _loaded_tables[(workbook, table)] = _typed_table(df.iloc[:len(df) - spec['footer']], spec['key'])
+    return {table: _loaded_tables[(workbook, table)] for table in tables}
+
+
+def join_covariates(dfs, tables, columns, encode = False):
+    """
+    Join columns of the supplementary tables onto the samples of the categories.
+
+    Parameters
+    ----------
+    dfs : list
+        The dataframes of the categories, with the sample ID in the second column (as Table S6).
+    tables : dict
+        Table -> dataframe indexed by sample ID, as returned by `load_supplementary_tables`.
+    columns : dict
+        Table -> the columns of the table to join, e.g., {'S4': ['Age', 'Sex']}.
+    encode : bool, optional
+        Whether to encode the categorical columns as one indicator column per value, in the same
+        columns for every category, to be used as features (default is False).
+
+    Returns
+    -------
+    list
+        For every category, the covariates of its samples, one row per row of its dataframe (with
+        the same index), NaN for the samples absent from a table.
+
+    Raises
+    ------
+    ValueError
+        If a column is not in its table, or is selected from two tables.
+    """
+    selected, names = [], []
+    for table, table_columns in columns.items():
+        unknown = [column for column in table_columns if column not in tables[table].columns]
+        if unknown:
+            raise ValueError(f"Unknown columns {unknown} of Table {table}. Choose among {list(tables[table].columns)}.")
+        selected.append((tables[table], list(table_columns)))
+        names += list(table_columns)
+    if len(set(names)) < len(names):
+        raise ValueError(f"Columns selected from several tables: {sorted({name for name in names if names.count(name) > 1})}.")
+
+    covariates = []
+    for df in dfs:
+        sample_ids = df.iloc[:, 1].astype(str).str.strip()
+        joined = []
+        for table, table_columns in selected:
+            # The positions of the samples in the table, looked up in the hash table of its index
+            positions = table.index.get_indexer(sample_ids)
+            rows = table[table_columns].iloc[np.where(positions >= 0, positions, 0)]
+            rows = rows.mask(np.broadcast_to((positions < 0)[:, np.newaxis], rows.shape))
+            joined.append(rows.set_axis(df.index))
+        covariates.append(pd.concat(joined, axis = 1) if joined else pd.DataFrame(index = df.index))
+
+    if encode and names:
+        encoded = pd.get_dummies(pd.concat(covariates, keys = range(len(covariates))), prefix_sep = ': ', dtype = float)
+        covariates = [encoded.xs(c) for c in range(len(covariates))]
+    return covariates
+
+
+def stratify(dfs, covariates, column):
+    """
+    Split the samples of the categories by the values of a covariate.
+
+    Parameters
+    ----------
+    dfs : list
+        The dataframes of the categories.
+    covariates : list
+        The covariates of the categories, as returned by `join_covariates`.
+    column : str
+        The covariate, e.g., 'Sex'.
+
+    Returns
+    -------
+    dict
+        Value of the covariate -> the dataframes of the categories restricted to the samples with
+        this value (the samples without a value are left out).
+    """
+    values = pd.concat([c[column] for c in covariates]).dropna().unique()
+    return {value: [df[(covariate[column] == value).to_numpy()] for df, covariate in zip(dfs, covariates)]
+            for value in sorted(values, key = str)}
@@ -0,0 +1,125 @@
+# Library imports
+import importlib.util
+import pandas as pd
+
+#  Project imports
+from instrumentation import span
+
+# The readers of the tables of the project: the supplementary workbook by Cohen et al., the
+# clinical data split by tumor type, and their conversions to CSV or Parquet. An Excel workbook is
+# read by calamine (the Rust reader of python-calamine) when it is installed, several times
+# faster than openpyxl, or by openpyxl otherwise. A converted table is read without decoding the
+# XML of a workbook at all, and only the requested columns of a Parquet file are read from disk.
+
+# The Excel engines, fastest first
+excel_engines = ['calamine', 'openpyxl']
+
+# The engines of the converted tables, by file extension
+file_engines = {'.csv': 'csv', '.csv.gz': 'csv', '.parquet': 'parquet'}
+
+
+def excel_engine(engine = None):
+    """
+    The Excel engine to use: the given one, or the fastest installed one.
+
+    Raises
+    ------
+    ValueError
+        If the given engine is not an Excel engine.
+    ImportError
+        If the given engine is not installed.
+    """
+    modules = {'calamine': 'python_calamine', 'openpyxl': 'openpyxl'}
+    if engine is None:
+        return next((engine for engine in excel_engines if importlib.util.find_spec(modules[engine]) is not None), 'openpyxl')
+    if engine not in modules:
+        raise ValueError(f"Unknown Excel engine '{engine}'. Choose among {excel_engines}.")
+    if importlib.util.find_spec(modules[engine]) is None:
+        raise ImportError(f"The Excel engine '{engine}' requires {modules[engine].replace('_', '-')} (pip install {modules[engine].replace('_', '-')}).")
+    return engine
+
+
+def table_engine(file_path, engine = None):
+    """
+    The engine reading a file: 'csv' or 'parquet' for the converted tables, and the Excel engine
+    (see `excel_engine`) for the workbooks.
+    """
+    for extension, file_engine in file_engines.items():
+        if file_path.endswith(extension):
+            return file_engine
+    return excel_engine(engine)
+
+
+def sheet_names(file_path, engine = None):
+    """
+    The names of the sheets of a workbook ([None] for a converted table).
+    """
+    if table_engine(file_path, engine) in file_engines.values():
+        return [None]
+    with pd.ExcelFile(file_path, engine = excel_engine(engine)) as xls:
+        return list(xls.sheet_names)
+
+
+def read_table(file_path, sheet_name = 0, engine = None, columns = None, dtypes = None, skiprows = None, skipfooter = 0):
+    """
+    Read a table: a sheet of a workbook, or a converted CSV or Parquet file.
+
+    Parameters
+    ----------
+    file_path : str
+        The workbook (.xlsx), or the CSV (.csv, .csv.gz) or Parquet (.parquet) file.
+    sheet_name : str, int or list, optional
+        The sheet of a workbook, or a list of sheets (default is 0, the first sheet). Ignored for
+        the converted tables.
+    engine : str, optional
+        The Excel engine, 'calamine' or 'openpyxl' (default is None, i.e., the fastest installed).
+    columns : list, optional
+        The columns to keep, in this order (default is None, i.e., all the columns). The other
+        columns of a CSV or Excel file are skipped while parsing, and those of a Parquet file are
+        not read.
+    dtypes : dict, optional
+        Column -> dtype, instead of the inferred dtypes (default is None).
+    skiprows : int, optional
+        The rows above the header (default is None).
+    skipfooter : int, optional
+        The rows to leave out at the bottom, e.g., footnotes (default is 0).
+
+    Returns
+    -------
+    pd.DataFrame or dict
+        The table, or sheet name -> table for a list of sheets.
+    """
+    engine = table_engine(file_path, engine)
+    with span('read_table', 'io', file=file_path, engine=engine):
+        if engine == 'parquet':
+            if importlib.util.find_spec('pyarrow') is None:
+                raise ImportError("Reading Parquet files requires pyarrow (pip install pyarrow).")
+            df = pd.read_parquet(file_path, columns = columns)
+            df = df.iloc[skiprows or 0:len(df) - skipfooter].reset_index(drop=True)
+            return df.astype(dtypes) if dtypes else df
+        if engine == 'csv':
+            df = pd.read_csv(file_path, usecols = columns, dtype = dtypes, skiprows = skiprows, skipfooter = skipfooter,
+                             engine = 'python' if skipfooter else 'c')
+        else:
+            df = pd.read_excel(file_path, sheet_name = sheet_name, engine = engine, usecols = columns, dtype = dtypes,
+                               skiprows = skiprows, skipfooter = skipfooter)
+    if isinstance(df, dict):
+        return {name: sheet if columns is None else sheet[list(columns)] for name, sheet in df.items()}
+    return df if columns is None else df[list(columns)]
+
+
+def convert_table(file_path, output_path, sheet_name = 0, engine = None, columns = None, dtypes = None):
+    """
+    Convert a sheet of a workbook to CSV or Parquet (by the extension of output_path), to be read
+    by `read_table` without decoding the workbook.
+    """
+    df = read_table(file_path, sheet_name = sheet_name, engine = engine, columns = columns, dtypes = dtypes)
+    if table_engine(output_path) == 'parquet':
+        if importlib.util.find_spec('pyarrow') is None:
+            raise ImportError("Writing Parquet files requires pyarrow (pip install pyarrow).")
+        df.to_parquet(output_path, index = False)
+    elif table_engine(output_path) == 'csv':
+        df.to_csv(output_path, index = False)
+    else:
+        raise ValueError(f"Cannot convert to {output_path}: use a .csv, .csv.gz or .parquet file.")
+    return output_path
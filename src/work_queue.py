@@ -0,0 +1,400 @@
+# A work queue in a shared directory, for running the resampling iterations of the random forest
+# screening on several hosts.
+#
+# The coordinator publishes the dataset (memory-mapped .npy files, see shared_dataset.py) and one
+# task file per iteration: the comparison, the seed and the rows of the iteration (index plan).
+# Workers, on any host that mounts the directory, claim a task by renaming it atomically, fit the
+# forest and publish the result. The queue directory is laid out as
+#
+#   datasets/<fingerprint>/      the memory-mapped dataset of a screen
+#   tasks/<task>.json            the pending tasks
+#   claimed/<task>@<worker>.json the tasks being computed, with the time of the claim
+#   results/<task>.pkl           the results, written once
+#   failed/<task>.json           the tasks that failed max_attempts times, with the error
+#   stop                         asks all the workers to exit
+#   stop.<name>                  asks the workers started with that stop name to exit
+#
+# Task names contain the fingerprint of the dataset and of the parameters, and every iteration is
+# seeded, so retries are idempotent: a task whose claim expired (lease_seconds) is requeued, the
+# first result published wins and later duplicates are discarded, and a coordinator restarted on
+# the same directory reuses the results already there.
+#
+# On one host, `rf_resampling_distributed(..., local_workers=4)` runs the coordinator and four
+# worker processes together. On a cluster, start `python main.py worker --queue DIR` on every host.
+
+# Library imports
+import glob
+import json
+import os
+import pickle
+import socket
+import time
+import traceback
+from multiprocessing import Process
+import numpy as np
+
+#  Project imports
+from fingerprint import fingerprint
+from shared_dataset import save_dataset, rf_resampling_plan, rf_resampling_iteration
+
+
+def _write_atomically(file_path, data, mode = 'w'):
+    with open(file_path + f".{os.getpid()}.tmp", mode) as file:
+        file.write(data)
+    os.replace(file_path + f".{os.getpid()}.tmp", file_path)
+
+
+def _remove(file_path):
+    # The claim of a task may have been requeued by the coordinator in the meantime
+    try:
+        os.remove(file_path)
+    except FileNotFoundError:
+        pass
+
+
+def queue_directories(queue_dir):
+    """
+    The subdirectories of the queue, created if needed.
+    """
+    directories = {name: os.path.join(queue_dir, name) for name in ['datasets', 'tasks', 'claimed', 'results', 'failed']}
+    for directory in directories.values():
+        os.makedirs(directory, exist_ok=True)
+    return directories
+
+
+def comparison_name(categories, category_indices):
+    """
+    The name of a comparison, e.g., "Normal+Ovary".
+    """
+    return "+".join(['Normal'] + [categories[c] for c in category_indices]).replace(" ", "_")
+
+
+def publish_rf_tasks(queue_dir, categories, dfs, comparisons, iterations = 100, selected_biomarkers = None, test_size = 0.2,
+                     roc = False, n_jobs = None, max_attempts = 3):
+    """
+    Publish the dataset and the tasks of the resampling iterations of `rf_normal_cancers`.
+
+    Parameters
+    ----------
+    queue_dir : str
+        The queue directory.
+    categories : list
+        The names of the categories.
+    dfs : list
+        The dataframes of the categories.
+    comparisons : list
+        The comparisons, each a tuple of category indices classified against Normal, e.g.,
+        [(6,), (7,), (3, 6, 7)].
+    iterations : int, optional
+        The number of iterations of every comparison (default is 100).
+    selected_biomarkers : array-like, optional
+        The indices of the biomarkers (default is None, i.e., all the biomarkers).
+    test_size : float, optional
+        The fraction of test samples (default is 0.2).
+    roc : bool, optional
+        Whether to compute the ROC curves, with the first cancer type as positive class
+        (default is False).
+    n_jobs : int, optional
+        The threads of each random forest (default is None).
+    max_attempts : int, optional
+        The number of attempts of a task before it is reported as failed (default is 3).
+
+    Returns
+    -------
+    dict
+        The names of the tasks of every comparison, in the order of the iterations.
+    """
+    directories = queue_directories(queue_dir)
+    # New tasks lift a previous stop of all the workers
+    _remove(os.path.join(queue_dir, "stop"))
+    dataset_fingerprint = fingerprint(list(categories), dfs, selected_biomarkers)[:16]
+    dataset_dir = os.path.join(directories['datasets'], dataset_fingerprint)
+    if not os.path.exists(os.path.join(dataset_dir, "handle.json")):
+        handle = save_dataset(categories, dfs, dataset_dir, selected_biomarkers)
+        _write_atomically(os.path.join(dataset_dir, "handle.json"), json.dumps({**handle, 'path': None}))
+
+    with open(os.path.join(dataset_dir, "handle.json")) as file:
+        handle = {**json.load(file), 'path': dataset_dir}
+
+    task_names = {}
+    for category_indices in comparisons:
+        category_indices = tuple(category_indices)
+        plan = rf_resampling_plan(handle, category_indices, iterations)
+        params = {'test_size': test_size,
+                  'roc_pos_label': categories[category_indices[0]] if roc else None,
+                  'n_jobs': n_jobs}
+        prefix = f"{comparison_name(categories, category_indices)}-{fingerprint(dataset_fingerprint, category_indices, params)[:12]}"
+        task_names[category_indices] = []
+        for i, rows in enumerate(plan):
+            task_name = f"{prefix}-{i:06d}"
+            task_names[category_indices].append(task_name)
+            if not task_status(queue_dir, task_name):
+                task = {'task': task_name,
+                        'dataset': os.path.relpath(dataset_dir, queue_dir),
+                        'comparison': list(category_indices),
+                        'iteration': i,
+                        'rows': rows.tolist(),
+                        'params': params,
+                        'attempt': 1,
+                        'max_attempts': max_attempts}
+                _write_atomically(os.path.join(directories['tasks'], f"{task_name}.json"), json.dumps(task))
+    return task_names
+
+
+def task_status(queue_dir, task_name):
+    """
+    The status of a task: 'done', 'failed', 'claimed', 'pending', or None if it is unknown.
+    """
+    if os.path.exists(os.path.join(queue_dir, "results", f"{task_name}.pkl")):
+        return 'done'
+    if os.path.exists(os.path.join(queue_dir, "failed", f"{task_name}.json")):
+        return 'failed'
+    if glob.glob(os.path.join(queue_dir, "claimed", glob.escape(task_name) + "@*.json")):
+        return 'claimed'
+    if os.path.exists(os.path.join(queue_dir, "tasks", f"{task_name}.json")):
+        return 'pending'
+    return None
+
+
+def claim_task(queue_dir, worker_id):
+    """
+    Claim a pending task, by renaming its file atomically. Among concurrent workers, exactly one
+    rename succeeds.
+
+    Returns
+    -------
+    tuple
+        The task and the path of its claim, or (None, None) if no task is pending.
+    """
+    for task_file in sorted(glob.glob(os.path.join(queue_dir, "tasks", "*.json"))):
+        task_name = os.path.basename(task_file)[:-len(".json")]
+        claim_file = os.path.join(queue_dir, "claimed", f"{task_name}@{worker_id}.json")
+        try:
+            os.rename(task_file, claim_file)
+        except FileNotFoundError:
+            # Claimed by another worker
+            continue
+        # The modification time of the claim starts the lease
+        os.utime(claim_file)
+        with open(claim_file) as file:
+            return json.load(file), claim_file
+    return None, None
+
+
+def publish_result(queue_dir, task_name, result):
+    """
+    Publish the result of a task, unless a result was already published (e.g., by a worker
+    whose lease had expired). Returns whether this result was kept.
+    """
+    result_file = os.path.join(queue_dir, "results", f"{task_name}.pkl")
+    temporary_file = result_file + f".{socket.gethostname()}.{os.getpid()}.tmp"
+    with open(temporary_file, 'wb') as file:
+        pickle.dump(result, file, protocol=pickle.HIGHEST_PROTOCOL)
+    try:
+        # A hard link fails if the result exists, so the first result wins
+        os.link(temporary_file, result_file)
+        return True
+    except FileExistsError:
+        return False
+    finally:
+        os.remove(temporary_file)
+
+
+def requeue_task(queue_dir, task, claim_file, error = None):
+    """
+    Return a claimed task to the queue for another attempt, or move it to the failed tasks
+    after its last attempt.
+    """
+    if task['attempt'] >= task['max_attempts']:
+        _write_atomically(os.path.join(queue_dir, "failed", f"{task['task']}.json"), json.dumps({**task, 'error': error}))
+    else:
+        _write_atomically(os.path.join(queue_dir, "tasks", f"{task['task']}.json"), json.dumps({**task, 'attempt': task['attempt'] + 1}))
+    _remove(claim_file)
+
+
+def requeue_expired_claims(queue_dir, lease_seconds = 600):
+    """
+    Requeue the claimed tasks without a result whose lease expired, e.g., because their worker
+    died. Returns the number of requeued tasks.
+    """
+    requeued = 0
+    for claim_file in glob.glob(os.path.join(queue_dir, "claimed", "*.json")):
+        try:
+            expired = time.time() - os.path.getmtime(claim_file) > lease_seconds
+            if expired:
+                with open(claim_file) as file:
+                    task = json.load(file)
+        except FileNotFoundError:
+            # Completed in the meantime
+            continue
+        if expired:
+            if task_status(queue_dir, task['task']) == 'done':
+                _remove(claim_file)
+            else:
+                requeue_task(queue_dir, task, claim_file, error = f"lease of {lease_seconds} s expired")
+                requeued += 1
+    return requeued
+
+
+def run_worker(queue_dir, worker_id = None, poll_interval = 0.5, idle_timeout = None, stop_name = None, verbose = True):
+    """
+    Pull tasks from the queue and compute them, until the queue is stopped or stays empty for
+    `idle_timeout` seconds.
+
+    Parameters
+    ----------
+    queue_dir : str
+        The queue directory, e.g., on a shared filesystem.
+    worker_id : str, optional
+        The name of the worker (default is "<host>-<pid>").
+    poll_interval : float, optional
+        The seconds between two looks at an empty queue (default is 0.5).
+    idle_timeout : float, optional
+        The seconds after which a worker without tasks exits (default is None, i.e., the worker
+        runs until the queue is stopped).
+    stop_name : str, optional
+        The worker also exits when `stop_workers(queue_dir, stop_name)` is called, e.g., for the
+        workers started by one coordinator (default is None).
+    verbose : bool, optional
+        Whether to print the computed tasks (default is True).
+
+    Returns
+    -------
+    int
+        The number of tasks computed by the worker.
+    """
+    worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+    queue_directories(queue_dir)
+    computed, idle_since = 0, time.time()
+    stop_files = [os.path.join(queue_dir, "stop")] + ([os.path.join(queue_dir, f"stop.{stop_name}")] if stop_name else [])
+    while not any(os.path.exists(stop_file) for stop_file in stop_files):
+        task, claim_file = claim_task(queue_dir, worker_id)
+        if task is None:
+            if idle_timeout is not None and time.time() - idle_since > idle_timeout:
+                break
+            time.sleep(poll_interval)
+            continue
+        idle_since = time.time()
+        if task_status(queue_dir, task['task']) == 'done':
+            # A retry of a task completed in the meantime
+            _remove(claim_file)
+            continue
+        handle_file = os.path.join(queue_dir, task['dataset'], "handle.json")
+        try:
+            with open(handle_file) as file:
+                handle = {**json.load(file), 'path': os.path.join(queue_dir, task['dataset'])}
+            start = time.perf_counter()
+            result = rf_resampling_iteration(handle, np.asarray(task['rows']), task['iteration'], **task['params'])
+            result.update(task = task['task'], worker = worker_id, attempt = task['attempt'], elapsed = time.perf_counter() - start)
+        except Exception:
+            requeue_task(queue_dir, task, claim_file, error = traceback.format_exc())
+            if verbose:
+                print(f"[worker {worker_id}] failed   {task['task']} (attempt {task['attempt']})")
+            continue
+        kept = publish_result(queue_dir, task['task'], result)
+        _remove(claim_file)
+        computed += 1
+        if verbose:
+            print(f"[worker {worker_id}] {'computed' if kept else 'duplicate'} {task['task']} in {result['elapsed']:.2f} s")
+    return computed
+
+
+def collect_results(queue_dir, task_names, lease_seconds = 600, poll_interval = 0.5, timeout = None, verbose = True):
+    """
+    Wait for the results of the given tasks, requeueing the tasks whose lease expired.
+
+    Raises
+    ------
+    RuntimeError
+        If a task failed on all its attempts.
+    TimeoutError
+        If the results are not all available after `timeout` seconds.
+
+    Returns
+    -------
+    list
+        The results, in the order of the task names.
+    """
+    start, reported = time.time(), -1
+    while True:
+        statuses = [task_status(queue_dir, task_name) for task_name in task_names]
+        failed = [task_name for task_name, status in zip(task_names, statuses) if status == 'failed']
+        if failed:
+            with open(os.path.join(queue_dir, "failed", f"{failed[0]}.json")) as file:
+                error = json.load(file)['error']
+            raise RuntimeError(f"{len(failed)} tasks failed, e.g., {failed[0]}:\n{error}")
+        done = statuses.count('done')
+        if verbose and done != reported:
+            print(f"[queue] {done}/{len(task_names)} tasks done")
+            reported = done
+        if done == len(task_names):
+            break
+        if timeout is not None and time.time() - start > timeout:
+            raise TimeoutError(f"{len(task_names) - done} tasks are not done after {timeout} s.")
+        requeue_expired_claims(queue_dir, lease_seconds)
+        time.sleep(poll_interval)
+
+    results = []
+    for task_name in task_names:
+        with open(os.path.join(queue_dir, "results", f"{task_name}.pkl"), 'rb') as file:
+            results.append(pickle.load(file))
+    return results
+
+
+def stop_workers(queue_dir, stop_name = None):
+    """
+    Ask the workers of the queue (or only those started with the given stop name) to exit once
+    their current task is done.
+    """
+    _write_atomically(os.path.join(queue_dir, "stop" if stop_name is None else f"stop.{stop_name}"), "")
+
+
+def rf_resampling_distributed(categories, dfs, comparisons, iterations = 100, selected_biomarkers = None, test_size = 0.2, roc = False,
+                              queue_dir = ".work_queue", local_workers = 0, lease_seconds = 600, timeout = None, n_jobs = None, verbose = True):
+    """
+    Run the resampling iterations of `rf_normal_cancers` for several comparisons on the workers
+    of a queue, optionally starting local worker processes.
+
+    Parameters
+    ----------
+    categories, dfs, comparisons, iterations, selected_biomarkers, test_size, roc, n_jobs
+        See `publish_rf_tasks`.
+    queue_dir : str, optional
+        The queue directory (default is ".work_queue").
+    local_workers : int, optional
+        The number of worker processes started on this host (default is 0, i.e., the tasks
+        are computed by workers started separately, see `run_worker`).
+    lease_seconds : float, optional
+        The seconds after which a claimed task without result is requeued (default is 600).
+    timeout : float, optional
+        The seconds to wait for the results (default is None, i.e., no limit).
+    verbose : bool, optional
+        Whether to print the progress (default is True).
+
+    Returns
+    -------
+    dict
+        The results of `rf_resampling_iteration` for every comparison, in the order of the
+        iterations.
+    """
+    task_names = publish_rf_tasks(queue_dir, categories, dfs, comparisons, iterations, selected_biomarkers, test_size, roc, n_jobs)
+    # The local workers are stopped at the end, without stopping the workers on other hosts
+    stop_name = f"{socket.gethostname()}-{os.getpid()}"
+    workers = [Process(target=run_worker, args=(queue_dir, f"{stop_name}-local{i}"), kwargs={'stop_name': stop_name, 'verbose': False}, daemon=True)
+               for i in range(local_workers)]
+    for worker in workers:
+        worker.start()
+    try:
+        results = collect_results(queue_dir, [task_name for names in task_names.values() for task_name in names],
+                                  lease_seconds = lease_seconds, timeout = timeout, verbose = verbose)
+    finally:
+        if workers:
+            stop_workers(queue_dir, stop_name)
+            for worker in workers:
+                worker.join()
+            _remove(os.path.join(queue_dir, f"stop.{stop_name}"))
+    results_by_comparison, start = {}, 0
+    for category_indices, names in task_names.items():
+        results_by_comparison[category_indices] = results[start:start + len(names)]
+        start += len(names)
+    return results_by_comparison